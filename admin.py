@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+
+import settings
+import strings
+import manager
+import connection
+import framing
+import metrics
+import ratelimit
+import tracing
+
+POLL    = 0.05     # seconds between checks of the outbound queues while the asyncio server drains
+INVALID = object() # value a SET parser could not parse
+
+started  = time.monotonic()
+draining = None # time.monotonic() the server stops at, flushed or not, None while it serves
+
+class Console(connection.SocketConnection):
+    """
+    A connection to the admin socket. Every line is an admin command, answered on the same
+    connection. Consoles are not signed in and never checked for silence.
+    """
+
+def whole(value):
+    """
+    Parses a count or size given to SET.
+
+    Args:
+        value (str): The value.
+
+    Returns:
+        int: The value, or INVALID if it is not a whole number.
+    """
+    return int(value) if value.isdigit() else INVALID
+
+def seconds(value):
+    """
+    Parses a duration or rate given to SET.
+
+    Args:
+        value (str): The value.
+
+    Returns:
+        float: The value, or INVALID if it is not a positive number.
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        return INVALID
+    return number if number >= 0 else INVALID
+
+def optional(parse):
+    """
+    Extends a parser to take none, for the settings that can be switched off.
+
+    Args:
+        parse (callable): The parser of the value.
+
+    Returns:
+        callable: The parser, returning None for none.
+    """
+    return lambda value: None if value.lower() == "none" else parse(value)
+
+def at_least(parse, lowest):
+    """
+    Extends a parser to reject values below a minimum, for the limits the server stops serving
+    under, such as a frame size too small for any command or a rate that never refills a budget.
+
+    Args:
+        parse (callable): The parser of the value.
+        lowest (float): The smallest value accepted.
+
+    Returns:
+        callable: The parser, returning INVALID for values below lowest.
+    """
+    def parse_bounded(value):
+        parsed = parse(value)
+        return parsed if parsed is INVALID or parsed >= lowest else INVALID
+    return parse_bounded
+
+def policy(value):
+    """
+    Parses an overflow policy given to SET by its value, such as drop.
+
+    Args:
+        value (str): The value.
+
+    Returns:
+        settings.overflow: The policy, or INVALID if there is no such policy.
+    """
+    try:
+        return settings.overflow(value.lower())
+    except ValueError:
+        return INVALID
+
+def retune_frames(old):
+    """
+    Applies a new MAX_FRAME_SIZE to the connections decoding frames with the old one.
+
+    Args:
+        old: The setting's previous value.
+
+    Returns: None
+    """
+    for client in list(connection.opened):
+        if client.decoder.max_frame == old:
+            client.decoder.max_frame = settings.MAX_FRAME_SIZE
+
+def retune_limits(old):
+    """
+    Applies a new OUTBOUND_LIMIT to the connections buffering up to the old one.
+
+    Args:
+        old: The setting's previous value.
+
+    Returns: None
+    """
+    for client in list(connection.opened):
+        if client.limit == old:
+            client.limit = settings.OUTBOUND_LIMIT
+
+def retune_policies(old):
+    """
+    Applies a new OVERFLOW_POLICY to the connections under the old one.
+
+    Args:
+        old: The setting's previous value.
+
+    Returns: None
+    """
+    for client in list(connection.opened):
+        if client.policy is old:
+            client.policy = settings.OVERFLOW_POLICY
+
+def retune_clients(old):
+    """
+    Applies new client rate limits to the budgets of the open connections.
+
+    Args:
+        old: The setting's previous value.
+
+    Returns: None
+    """
+    for client in list(connection.opened):
+        client.command_budget = ratelimit.retune(client.command_budget, ratelimit.command_budget())
+        client.message_budget = ratelimit.retune(client.message_budget, ratelimit.message_budget())
+
+def retune_rooms(old):
+    """
+    Applies new room rate limits to the budgets of the rooms.
+
+    Args:
+        old: The setting's previous value.
+
+    Returns: None
+    """
+    for room in manager.registry.rooms.values():
+        room.budget = ratelimit.retune(room.budget, ratelimit.room_budget())
+
+def retune_histories(old):
+    """
+    Resizes the histories of the rooms to new bounds.
+
+    Args:
+        old: The setting's previous value.
+
+    Returns: None
+    """
+    for room in manager.registry.rooms.values():
+        room.history.resize(settings.HISTORY_MESSAGES, settings.HISTORY_BYTES)
+
+def retune_tracing(old):
+    """
+    Applies a new TRACE_SAMPLE.
+
+    Args:
+        old: The setting's previous value.
+
+    Returns: None
+    """
+    tracing.start(settings.TRACE_SAMPLE, settings.TRACE_FILE)
+
+# setting -> (parser of its value, function applying a change to existing state, None when it is read on use)
+TUNABLES = {
+    "MAX_FRAME_SIZE":        (at_least(whole, 512), retune_frames),
+    "OUTBOUND_LIMIT":        (at_least(whole, 65536), retune_limits),
+    "OVERFLOW_POLICY":       (policy, retune_policies),
+    "CLIENT_COMMAND_RATE":   (optional(at_least(seconds, 1)), retune_clients),
+    "CLIENT_COMMAND_BURST":  (at_least(seconds, 1), retune_clients),
+    "CLIENT_MESSAGE_RATE":   (optional(at_least(seconds, 1)), retune_clients),
+    "CLIENT_MESSAGE_BURST":  (at_least(seconds, 1), retune_clients),
+    "ROOM_MESSAGE_RATE":     (optional(at_least(seconds, 1)), retune_rooms),
+    "ROOM_MESSAGE_BURST":    (at_least(seconds, 1), retune_rooms),
+    "HISTORY_MESSAGES":      (whole, retune_histories),
+    "HISTORY_BYTES":         (whole, retune_histories),
+    "HISTORY_REPLAY":        (whole, None),
+    "MAX_BATCH_COMMANDS":    (at_least(whole, 1), None),
+    "MAX_BATCH_BYTES":       (at_least(whole, 512), None),
+    "MEMBERS_PAGE":          (at_least(whole, 1), None),
+    "SEARCH_LIMIT":          (at_least(whole, 1), None),
+    "SEARCH_SCAN":           (at_least(whole, 1), None),
+    "PRESENCE_WINDOW":       (seconds, None),
+    "PRESENCE_LIMIT":        (optional(whole), None),
+    "IDLE_TIMEOUT":          (at_least(seconds, 1), None),
+    "PONG_TIMEOUT":          (at_least(seconds, 1), None),
+    "COMPRESSION_THRESHOLD": (whole, None),
+    "TRACE_SAMPLE":          (whole, retune_tracing),
+    "TRACE_TIMEOUT":         (at_least(seconds, 1), None),
+    "DRAIN_TIMEOUT":         (seconds, None),
+}
+
+def execute(line):
+    """
+    Runs an admin command typed on standard input or sent to the admin socket.
+
+    Args:
+        line (str): The command line.
+
+    Returns:
+        str: The answer, None when there is nothing to answer.
+    """
+    verb, _, argument = line.strip().partition(" ")
+    verb = verb.upper()
+    argument = argument.strip()
+    if verb == strings.EXIT:
+        stop(0)
+        return None
+    if verb == strings.STATS:
+        return stats()
+    if verb == strings.KICK and argument:
+        return kick(argument)
+    if verb == strings.DRAIN:
+        return drain()
+    if verb == strings.SET and argument:
+        return change(*argument.partition(" ")[::2])
+    if not verb:
+        return None
+    return strings.ADMIN_UNKNOWN
+
+def stats():
+    """
+    Summarizes the state of the server.
+
+    Args: None
+
+    Returns:
+        str: The answer.
+    """
+    return strings.ADMIN_STATS.format(
+        clients=len(manager.registry.clients),
+        connections=manager.total_clients,
+        rooms=len(manager.registry.rooms),
+        subscriptions=manager.registry.subscriptions.count,
+        queued=connection.queue_depth(),
+        uptime=int(time.monotonic() - started),
+        draining=strings.YES if draining is not None else strings.NO,
+    )
+
+def kick(name):
+    """
+    Disconnects a user signed in on this server, telling it why.
+
+    Args:
+        name (str): The user's name.
+
+    Returns:
+        str: The answer.
+    """
+    _client = manager.registry.find(name)
+    if _client is None or _client.connection not in connection.opened:
+        return strings.KICK_UNKNOWN + name
+    _client.connection.send(strings.KICKED.encode(settings.SUPPORTED_TEXT_TYPE))
+    _client.connection.hang_up()
+    return strings.USER_KICKED + name
+
+def drain():
+    """
+    Starts a graceful shutdown: the server stops accepting connections and reading commands,
+    tells the signed-in users, and stops once every outbound queue is written out, or
+    settings.DRAIN_TIMEOUT seconds from now, whichever comes first.
+
+    Args: None
+
+    Returns:
+        str: The answer.
+    """
+    if draining is None:
+        stop(settings.DRAIN_TIMEOUT)
+        local = [_client for _client in manager.registry.clients.values() if _client.connection in connection.opened]
+        manager.broadcast(local, strings.SERVER_DRAINING)
+    return strings.DRAINING + str(connection.queue_depth())
+
+def stop(delay):
+    """
+    Sets the time the server stops at, keeping an earlier one.
+
+    Args:
+        delay (float): Seconds from now.
+
+    Returns: None
+    """
+    global draining
+    deadline = time.monotonic() + delay
+    if draining is None or deadline < draining:
+        draining = deadline
+
+def drained():
+    """
+    Tells whether a stopping server may stop: its outbound queues are empty or time is up.
+
+    Args: None
+
+    Returns:
+        bool: True once the server should stop, always False while it serves.
+    """
+    if draining is None:
+        return False
+    return time.monotonic() >= draining or not connection.queue_depth()
+
+def timeout():
+    """
+    Returns how long the server loop may wait before it has to give up draining.
+
+    Args: None
+
+    Returns:
+        float: Seconds to wait, or None while the server serves.
+    """
+    return None if draining is None else max(draining - time.monotonic(), 0)
+
+def change(key, value):
+    """
+    Changes a setting at run time and applies it to the connections and rooms already there.
+    Limits that connections were given explicitly, such as those of worker links, are kept.
+
+    Args:
+        key (str): The setting's name, in any case.
+        value (str): The new value.
+
+    Returns:
+        str: The answer.
+    """
+    key = key.upper()
+    if key not in TUNABLES:
+        return strings.UNKNOWN_SETTING + ", ".join(sorted(TUNABLES)).lower()
+    parse, apply = TUNABLES[key]
+    parsed = parse(value.strip())
+    if parsed is INVALID:
+        return strings.INVALID_SETTING + key.lower()
+    old = getattr(settings, key)
+    setattr(settings, key, parsed)
+    if apply is not None:
+        apply(old)
+    return f"{key.lower()}{strings.SETTING_CHANGED}{getattr(old, 'value', old)} -> {getattr(parsed, 'value', parsed)}"
+
+def open_endpoint(path):
+    """
+    Starts listening on the admin Unix-domain socket.
+
+    Args:
+        path (str): The socket path.
+
+    Returns:
+        socket.socket: The listening socket.
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(metrics.endpoint_path(path))
+    listener.listen(settings.MAX_CONNECT_REQUEST)
+    return listener
+
+def accept(listener, server_stream):
+    """
+    Accepts a console on the admin socket and adds it to the server stream.
+
+    Args:
+        listener (socket.socket): The listening socket returned by open_endpoint.
+        server_stream (ServerStream): The inputs of the server loop.
+
+    Returns: None
+    """
+    client, _ = listener.accept()
+    server_stream.add(Console(client))
+
+def handle_input(console, server_stream):
+    """
+    Runs the commands a console sent, answering each one, and closes the console once it hangs up
+    or sends a command longer than settings.MAX_FRAME_SIZE.
+
+    Args:
+        console (Console): The console.
+        server_stream (ServerStream): The inputs of the server loop.
+
+    Returns: None
+    """
+    try:
+        size = console.recv_into(console.decoder.writable())
+    except connection.WOULD_BLOCK:
+        return
+    except OSError:
+        size = 0
+    if not size:
+        server_stream.discard(console)
+        console.close()
+        return
+    console.decoder.commit(size)
+    try:
+        for frame in console.decoder.frames():
+            answer = execute(bytes(frame).decode(settings.SUPPORTED_TEXT_TYPE, 'replace'))
+            if answer is not None:
+                console.send((answer + strings.NEW_LINE).encode(settings.SUPPORTED_TEXT_TYPE))
+    except framing.FrameTooLarge:
+        console.send((strings.FRAME_TOO_LARGE + strings.NEW_LINE).encode(settings.SUPPORTED_TEXT_TYPE))
+        console.flush()
+        server_stream.discard(console)
+        console.close()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import array
+import bisect
+import mmap
+import os
+import struct
+import threading
+
+import settings
+
+RECORD  = struct.Struct("!QqQII") # room's previous record offset, time in ns, message id, room number, body size
+BUCKET  = struct.Struct("!IIQ")   # room number, time bucket, offset of the room's first record in the bucket
+NONE    = 0xFFFFFFFFFFFFFFFF      # previous offset of a room's first record
+DATA    = "messages.dat"
+ROOMS   = "rooms.dat"
+HEADS   = "heads.dat"
+BUCKETS = "buckets.dat"
+
+archive = None # Archive of this server, None when archiving is off
+
+class Archive:
+    """
+    An on-disk archive of every room message, read through mmap so queries never copy it.
+
+    messages.dat holds the messages back to back, each behind a fixed-layout header carrying the
+    offset of the previous message of the same room, so each room's messages form a chain running
+    back in time. heads.dat holds the offset of every room's latest message at a fixed position per
+    room, and buckets.dat the offset of every room's first message in each time bucket of
+    settings.ARCHIVE_BUCKET seconds, so a query starts walking the chain at the end of its time
+    range and stops at its beginning. rooms.dat numbers the rooms, one name per line.
+
+    Messages are queued by the serving thread and written by a background thread every
+    settings.ARCHIVE_INTERVAL seconds. A batch is fsynced to messages.dat, rooms.dat and
+    buckets.dat before heads.dat is replaced by a new file pointing at it, so after a crash the
+    heads only ever point at messages on disk.
+    """
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The directory holding the archive files, created if missing.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.data      = open(os.path.join(directory, DATA), "ab+")
+        self.size      = self.data.seek(0, os.SEEK_END)
+        self.view      = None
+        self.numbers   = {}                 # room name -> room number
+        self.heads     = array.array("Q")   # room number -> offset of the room's latest message
+        self.buckets   = []                 # room number -> (array of buckets, array of first offsets)
+        self.pending   = []
+        self.lock      = threading.Lock()
+        self.stopped   = threading.Event()
+        self.load()
+        self.thread    = threading.Thread(target=self.run, name="archive", daemon=True)
+        self.thread.start()
+
+    def load(self):
+        """
+        Reads the room numbers, heads and time buckets of an existing archive.
+
+        Args: None
+
+        Returns: None
+        """
+        with open(os.path.join(self.directory, ROOMS), "a+", encoding=settings.SUPPORTED_TEXT_TYPE) as rooms_file:
+            rooms_file.seek(0)
+            for name in rooms_file.read().splitlines():
+                self.numbers[name] = len(self.buckets)
+                self.buckets.append((array.array("L"), array.array("Q")))
+        with open(os.path.join(self.directory, HEADS), "ab+") as heads_file:
+            heads_file.seek(0)
+            data = heads_file.read()
+        self.heads.frombytes(data[:len(data) - len(data) % self.heads.itemsize])
+        self.heads.extend([NONE] * (len(self.buckets) - len(self.heads)))
+        with open(os.path.join(self.directory, BUCKETS), "ab+") as buckets_file:
+            buckets_file.seek(0)
+            data = buckets_file.read()
+        for number, bucket, offset in BUCKET.iter_unpack(data[:len(data) - len(data) % BUCKET.size]):
+            if number < len(self.buckets):
+                self.buckets[number][0].append(bucket)
+                self.buckets[number][1].append(offset)
+
+    def add(self, room, message_id, time_ns, body):
+        """
+        Queues a message for the writer thread.
+
+        Args:
+            room (str): The room name.
+            message_id (int): The message id.
+            time_ns (int): The time the message was sent at, in ns since the epoch.
+            body (bytes): The message.
+
+        Returns: None
+        """
+        with self.lock:
+            self.pending.append((room, message_id, time_ns, body))
+
+    def run(self):
+        """
+        Writes the queued messages in batches until the archive is closed.
+
+        Args: None
+
+        Returns: None
+        """
+        while True:
+            stopping = self.stopped.wait(settings.ARCHIVE_INTERVAL)
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if batch:
+                self.write(batch)
+            if stopping:
+                self.data.close()
+                return
+
+    def write(self, batch):
+        """
+        Appends messages to the archive, then publishes the new heads and buckets to queries.
+
+        Args:
+            batch (list): (room, message id, time, body) tuples.
+
+        Returns: None
+        """
+        names, chunks, heads, buckets, latest = [], [], {}, [], {}
+        offset = self.size
+        for room, message_id, time_ns, body in batch:
+            number = self.numbers.get(room)
+            if number is None:
+                number = len(self.numbers)
+                self.numbers[room] = number
+                names.append(room + "\n")
+            if number not in heads:
+                known = number < len(self.buckets) and self.buckets[number][0]
+                heads[number] = self.heads[number] if number < len(self.heads) else NONE
+                latest[number] = known[-1] if known else -1
+            previous = heads[number]
+            bucket = time_ns // 1000000000 // settings.ARCHIVE_BUCKET
+            if bucket > latest[number]:
+                latest[number] = bucket
+                buckets.append((number, bucket, offset))
+            chunks.append(RECORD.pack(previous, time_ns, message_id, number, len(body)))
+            chunks.append(body)
+            heads[number] = offset
+            offset += RECORD.size + len(body)
+
+        self.data.write(b"".join(chunks))
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        if names:
+            append(os.path.join(self.directory, ROOMS), "".join(names).encode(settings.SUPPORTED_TEXT_TYPE))
+        if buckets:
+            append(os.path.join(self.directory, BUCKETS), b"".join(BUCKET.pack(*entry) for entry in buckets))
+
+        with self.lock:
+            while len(self.buckets) < len(self.numbers):
+                self.buckets.append((array.array("L"), array.array("Q")))
+            self.heads.extend([NONE] * (len(self.numbers) - len(self.heads)))
+            for number, bucket, start in buckets:
+                self.buckets[number][0].append(bucket)
+                self.buckets[number][1].append(start)
+            for number, head in heads.items():
+                self.heads[number] = head
+            self.size = offset
+            heads_bytes = self.heads.tobytes()
+        target = os.path.join(self.directory, HEADS)
+        with open(target + ".tmp", "wb") as heads_file:
+            heads_file.write(heads_bytes)
+            heads_file.flush()
+            os.fsync(heads_file.fileno())
+        os.replace(target + ".tmp", target)
+
+    def mapped(self):
+        """
+        Returns a read-only map of the written messages, mapping the file again once it has grown.
+
+        Args: None
+
+        Returns:
+            mmap.mmap: The map, or None while the archive is empty.
+        """
+        if self.size and (self.view is None or len(self.view) < self.size):
+            self.view = mmap.mmap(self.data.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self.view
+
+    def query(self, room, start_ns, end_ns, term=None, limit=None):
+        """
+        Starts a search for a room's messages sent within a time range, optionally containing a
+        term, to be walked by Search.scan.
+
+        Args:
+            room (str): The room name.
+            start_ns (int): The start of the range, in ns since the epoch.
+            end_ns (int): The end of the range, in ns since the epoch.
+            term (bytes): Text the messages have to contain, None for all messages.
+            limit (int): The number of latest matches returned, settings.SEARCH_LIMIT when None.
+
+        Returns:
+            Search: The search, positioned at the room's latest message sent by end_ns.
+        """
+        limit = settings.SEARCH_LIMIT if limit is None else limit
+        with self.lock:
+            number = self.numbers.get(room)
+            if number is None or number >= len(self.heads):
+                return Search(None, NONE, start_ns, end_ns, term, limit)
+            offset = self.heads[number]
+            bucket_numbers, bucket_offsets = self.buckets[number]
+            after = bisect.bisect_right(bucket_numbers, end_ns // 1000000000 // settings.ARCHIVE_BUCKET)
+            later = bucket_offsets[after] if after < len(bucket_offsets) else None
+            view = self.mapped()
+        if view is None:
+            return Search(None, NONE, start_ns, end_ns, term, limit)
+        if later is not None:
+            offset = RECORD.unpack_from(view, later)[0]
+        return Search(view, offset, start_ns, end_ns, term, limit)
+
+    def search(self, room, start_ns, end_ns, term=None, limit=None):
+        """
+        Finds a room's messages sent within a time range, optionally containing a term, in one scan.
+
+        Args:
+            room (str): The room name.
+            start_ns (int): The start of the range, in ns since the epoch.
+            end_ns (int): The end of the range, in ns since the epoch.
+            term (bytes): Text the messages have to contain, None for all messages.
+            limit (int): The number of latest matches returned, settings.SEARCH_LIMIT when None.
+
+        Returns:
+            list: (message id, time in ns, memoryview of the message) tuples, oldest first.
+                  The views point into the map of the archive.
+        """
+        found = self.query(room, start_ns, end_ns, term, limit)
+        found.scan()
+        return found.results()
+
+    def close(self):
+        """
+        Writes what is still queued and stops the writer thread.
+
+        Args: None
+
+        Returns: None
+        """
+        self.stopped.set()
+        self.thread.join()
+
+class Search:
+    """
+    A search walking a room's chain of messages back in time, a bounded number of records per
+    call to scan, so that a search through a long history is spread over several turns of the
+    server loop instead of stalling every other client until it ends. The map it reads stays
+    valid while the archive grows, and messages written meanwhile are newer than the ones it
+    walks, so it finds what was archived when it started.
+    """
+
+    def __init__(self, view, offset, start_ns, end_ns, term, limit):
+        """
+        Args:
+            view (mmap.mmap): The map of the archive, None while the archive is empty.
+            offset (int): The offset of the first record to walk, NONE when there is none.
+            start_ns (int): The start of the range, in ns since the epoch.
+            end_ns (int): The end of the range, in ns since the epoch.
+            term (bytes): Text the messages have to contain, None for all messages.
+            limit (int): The number of latest matches returned.
+        """
+        self.view     = view
+        self.offset   = offset
+        self.start_ns = start_ns
+        self.end_ns   = end_ns
+        self.term     = term
+        self.limit    = limit
+        self.found    = [] # matches, newest first
+
+    def scan(self, budget=None):
+        """
+        Walks the next records of the chain.
+
+        Args:
+            budget (int): The number of records walked at most, all of them when None.
+
+        Returns:
+            bool: True once the search is done.
+        """
+        view, offset, term = self.view, self.offset, self.term
+        found = self.found
+        message_view = memoryview(view) if view is not None else None
+        walked = 0
+        while offset != NONE and len(found) < self.limit:
+            if budget is not None and walked == budget:
+                self.offset = offset
+                return False
+            previous, time_ns, message_id, _, size = RECORD.unpack_from(view, offset)
+            if time_ns < self.start_ns:
+                break
+            body = offset + RECORD.size
+            if time_ns <= self.end_ns and (term is None or view.find(term, body, body + size) >= 0):
+                found.append((message_id, time_ns, message_view[body:body + size]))
+            offset = previous
+            walked += 1
+        self.offset = NONE
+        return True
+
+    def results(self):
+        """
+        Returns the matches found so far.
+
+        Args: None
+
+        Returns:
+            list: (message id, time in ns, memoryview of the message) tuples, oldest first.
+                  The views point into the map of the archive.
+        """
+        return self.found[::-1]
+
+def append(path, data):
+    """
+    Appends data to a file and fsyncs it.
+
+    Args:
+        path (str): The file's path.
+        data (bytes): The data.
+
+    Returns: None
+    """
+    with open(path, "ab") as appended_file:
+        appended_file.write(data)
+        appended_file.flush()
+        os.fsync(appended_file.fileno())
+
+def start(directory):
+    """
+    Opens the archive in a directory.
+
+    Args:
+        directory (str): The archive directory.
+
+    Returns: None
+    """
+    global archive
+    archive = Archive(directory)
+
+def stop():
+    """
+    Writes the messages still queued and closes the archive.
+
+    Args: None
+
+    Returns: None
+    """
+    global archive
+    if archive is not None:
+        archive.close()
+        archive = None
+
+def message_added(room, message_id, time_ns, body):
+    """
+    Queues a room message for the archive.
+
+    Args:
+        room (str): The room name.
+        message_id (int): The message id.
+        time_ns (int): The time the message was sent at, in ns since the epoch.
+        body (bytes): The message.
+
+    Returns: None
+    """
+    if archive is not None:
+        archive.add(room, message_id, time_ns, body)
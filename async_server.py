@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import sys
+import time
+
+import settings
+import manager
+import strings
+import terminal
+import connection
+import framing
+import metrics
+import timers
+import tls
+import admin
+
+log = logging.getLogger(__name__)
+searcher = None # task continuing the searches still scanning, None before the first one
+
+async def handle_connection(reader, writer, server_stream):
+    """
+    Serves one client for the lifetime of its connection. Feeds client input to the client's frame
+    decoder, runs every complete command through terminal.execute_async and disconnects the client
+    once the stream is closed or fails, once it sends an oversized frame, or once it is reaped for
+    not answering a PING.
+
+    Args:
+        reader (asyncio.StreamReader): The reading half of the client connection.
+        writer (asyncio.StreamWriter): The writing half of the client connection.
+        server_stream (set): The set of connected clients.
+
+    Returns: None
+    """
+    client = connection.StreamConnection(reader, writer)
+    client.watch(client.abort)
+    ssl_object = writer.get_extra_info('ssl_object')
+    if ssl_object is not None:
+        tls.handshake_done(ssl_object)
+    manager.total_clients += 1
+    log.info('%s %s', strings.NEW_CLIENT, writer.get_extra_info('peername'))
+    server_stream.add(client)
+    writer_task = asyncio.create_task(client.run_writer())
+    try:
+        while True:
+            try:
+                client_input = await reader.read(settings.RECEIVE_BUFFER_SIZE)
+            except (ConnectionError, OSError):
+                break
+            if not client_input:
+                break
+            client.last_seen = time.monotonic()
+            for frame in client.decoder.feed(client_input):
+                await terminal.execute_async(frame, client)
+                resume_searches()
+                log.debug(strings.CLIENT_INPUT)
+    except framing.FrameTooLarge:
+        client.send(strings.FRAME_TOO_LARGE.encode(settings.SUPPORTED_TEXT_TYPE))
+        client.flush()
+    finally:
+        manager.disconnect(server_stream, client)
+        writer_task.cancel()
+
+def resume_searches():
+    """
+    Starts continuing the searches still scanning, unless that is running already.
+
+    Args: None
+
+    Returns: None
+    """
+    global searcher
+    if manager.searches and (searcher is None or searcher.done()):
+        searcher = asyncio.create_task(run_searches())
+
+async def run_searches():
+    """
+    Continues the searches still scanning, letting the other tasks run between turns, until
+    none is left.
+
+    Args: None
+
+    Returns: None
+    """
+    while manager.searches:
+        manager.continue_searches()
+        await connection.settle()
+        await asyncio.sleep(0)
+
+async def run_timers():
+    """
+    Runs the ticks of the timer wheel as they pass, until the server stops.
+
+    Args: None
+
+    Returns: None
+    """
+    while True:
+        await asyncio.sleep(settings.TIMER_TICK)
+        timers.advance()
+
+async def answer_stats(reader, writer):
+    """
+    Answers a connection on the metrics endpoint with the metrics and closes it.
+
+    Args:
+        reader (asyncio.StreamReader): The reading half of the connection.
+        writer (asyncio.StreamWriter): The writing half of the connection.
+
+    Returns: None
+    """
+    writer.write(metrics.export().encode(settings.SUPPORTED_TEXT_TYPE))
+    try:
+        await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    writer.close()
+
+def watch_stdin(loop, stopped):
+    """
+    Registers standard input with the event loop so that admin commands can be typed on it.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): The running event loop.
+        stopped (asyncio.Event): Event set once the server should stop or drain.
+
+    Returns: None
+    """
+    def read_command():
+        command = sys.stdin.readline()
+        if not command:
+            loop.remove_reader(sys.stdin)
+            return
+        answer = admin.execute(command)
+        if answer is not None:
+            print(answer)
+        if admin.draining is not None:
+            stopped.set()
+
+    try:
+        loop.add_reader(sys.stdin, read_command)
+    except (NotImplementedError, ValueError, OSError):
+        pass
+
+async def serve_console(reader, writer, stopped):
+    """
+    Serves a console on the admin socket, setting stopped once a command stops or drains the server.
+
+    Args:
+        reader (asyncio.StreamReader): The reading half of the connection.
+        writer (asyncio.StreamWriter): The writing half of the connection.
+        stopped (asyncio.Event): Event set once the server should stop or drain.
+
+    Returns: None
+    """
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            answer = admin.execute(line.decode(settings.SUPPORTED_TEXT_TYPE, 'replace'))
+            if answer is not None:
+                writer.write((answer + strings.NEW_LINE).encode(settings.SUPPORTED_TEXT_TYPE))
+                await writer.drain()
+            if admin.draining is not None:
+                stopped.set()
+    except (ConnectionError, OSError):
+        pass
+    writer.close()
+
+async def drain(server_stream):
+    """
+    Stops reading from the clients and waits until their outbound queues are written out or
+    the drain times out.
+
+    Args:
+        server_stream (set): The set of connected clients.
+
+    Returns: None
+    """
+    for client in list(server_stream):
+        client.writer.transport.pause_reading()
+    while not admin.drained():
+        await asyncio.sleep(admin.POLL)
+
+async def serve():
+    """
+    Starts the asyncio server on the default host and port specified in settings and serves
+    clients until exit or drain is typed on standard input or sent to the admin socket, running
+    the timer wheel alongside. When the server serves TLS, asyncio runs the handshakes without
+    blocking the loop. When settings.STATS_SOCKET is set, the metrics are served on that
+    Unix-domain socket, and when settings.ADMIN_SOCKET is set, admin commands on that one.
+
+    Args: None
+
+    Returns: None
+    """
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    server_stream = set()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, server_stream),
+        settings.DEFAULT_HOST or None,
+        settings.PORT,
+        backlog=settings.LISTEN_BACKLOG,
+        reuse_address=True,
+        ssl=tls.context,
+        ssl_handshake_timeout=settings.TLS_HANDSHAKE_TIMEOUT if tls.context else None,
+    )
+    stats = None
+    if settings.STATS_SOCKET:
+        stats = await asyncio.start_unix_server(answer_stats, metrics.endpoint_path(settings.STATS_SOCKET))
+    consoles = None
+    if settings.ADMIN_SOCKET:
+        consoles = await asyncio.start_unix_server(lambda reader, writer: serve_console(reader, writer, stopped),
+                                                   metrics.endpoint_path(settings.ADMIN_SOCKET))
+    watch_stdin(loop, stopped)
+    ticker = asyncio.create_task(run_timers())
+    async with server:
+        await stopped.wait()
+    await drain(server_stream)
+    ticker.cancel()
+    if stats:
+        stats.close()
+        metrics.close_endpoint(None, settings.STATS_SOCKET)
+    if consoles:
+        consoles.close()
+        metrics.close_endpoint(None, settings.ADMIN_SOCKET)
+    for client in list(server_stream):
+        client.abort()
+    while server_stream:
+        await asyncio.sleep(0)
+    print(strings.SERVER_STOPPED)
+
+def run_server():
+    """
+    Runs the asyncio server until it is stopped.
+
+    Args: None
+
+    Returns: None
+    """
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(strings.SERVER_STOPPED)
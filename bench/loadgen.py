@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+import strings
+import tls
+import session
+
+SCENARIOS = ("huge-room", "many-rooms", "churn", "slow-consumers")
+STAMP     = re.compile(rb"~(\d+)\.(\d+)~") # ~sender.time_ns~ embedded in every benchmark message
+
+class Stats:
+    """
+    Counters and latency samples collected by all simulated clients of a run.
+    """
+
+    def __init__(self):
+        self.connected = 0
+        self.connect_errors = 0
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+        self.connect_times = []
+
+    def record(self, sent_ns):
+        """
+        Records the delivery of one message.
+
+        Args:
+            sent_ns (int): The wall clock time the message was sent at, in nanoseconds.
+
+        Returns: None
+        """
+        self.delivered += 1
+        self.latencies.append(time.time_ns() - sent_ns)
+
+class SimulatedClient(session.Session):
+    """
+    One benchmark client: a session.Session that stamps the messages it sends and records the
+    latency of the stamped messages it receives. It does not reconnect, so lost connections show
+    in the figures, and negotiates frames without compression, so the server's costs stay
+    comparable across runs.
+    """
+
+    def __init__(self, index, stats, port, context=None, slow=False):
+        """
+        Args:
+            index (int): The client's index, also used in its user name.
+            stats (Stats): Where the client records what it sees.
+            port (int): The server port.
+            context (ssl.SSLContext): The TLS context to connect with, plain TCP when None.
+            slow (bool): Whether the client stops reading after joining its room.
+        """
+        super().__init__(f"bench{index}", settings.LOCAL_HOST, port, context, compress=False, reconnect=False)
+        self.index  = index
+        self.own    = str(index).encode()
+        self.stats  = stats
+        self.slow   = slow
+        self.joined = 0
+
+    async def sign_in(self):
+        """
+        Opens the session. The time to sign in, TLS handshake included, is recorded.
+
+        Args: None
+
+        Returns:
+            bool: True once the client is signed in.
+        """
+        started = time.perf_counter()
+        try:
+            signed_in = await self.open()
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            signed_in = False
+        if not signed_in:
+            self.stats.connect_errors += 1
+            self.close()
+            return False
+        self.stats.connected += 1
+        self.stats.connect_times.append(time.perf_counter() - started)
+        return True
+
+    async def join(self, room, create=False):
+        """
+        Joins a room, creating it first when asked to. Messages sent before the join reach the
+        client only as history replay and are left out of the latency figures. A slow client
+        stops reading once it joined.
+
+        Args:
+            room (str): The room name.
+            create (bool): Whether to create the room.
+
+        Returns:
+            bool: True if the client is a member of the room.
+        """
+        if create:
+            await self.request(f"{strings.ROOM} {room}", strings.ROOM_ADDED)
+        self.joined = time.time_ns()
+        joined = await super().join(room)
+        if self.slow:
+            self.pause()
+        return joined
+
+    def send_stamped(self, room, padding):
+        """
+        Sends a stamped message to a room.
+
+        Args:
+            room (str): The room name.
+            padding (str): Filler bringing the message to the configured size.
+
+        Returns: None
+        """
+        self.send(room, f"~{self.index}.{time.time_ns()}~{padding}")
+        self.stats.sent += 1
+
+    def received(self, data):
+        """
+        Records the latency of every stamped message sent by another client.
+
+        Args:
+            data (bytes): A frame.
+
+        Returns: None
+        """
+        for match in STAMP.finditer(data):
+            if match.group(1) != self.own and int(match.group(2)) >= self.joined:
+                self.stats.record(int(match.group(2)))
+
+def percentile(samples, fraction):
+    """
+    Returns a percentile of sorted samples.
+
+    Args:
+        samples (list): The sorted samples.
+        fraction (float): The percentile as a fraction, 0.99 for p99.
+
+    Returns:
+        float: The percentile, None when there are no samples.
+    """
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+def server_rss(pid):
+    """
+    Returns the resident memory of a server process and its worker processes, on Linux.
+
+    Args:
+        pid (int): The server's process id.
+
+    Returns:
+        int: The resident set size in bytes, None when it can not be read.
+    """
+    if pid is None:
+        return None
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open(f"/proc/{current}/task/{current}/children") as children:
+                pending.extend(int(child) for child in children.read().split())
+    except (OSError, ValueError):
+        return total or None
+    return total
+
+def spawn_server(port, server_args):
+    """
+    Starts server.py on a port and waits until it accepts connections. Rate limits are turned
+    off, so the benchmark measures the server rather than its limits.
+
+    Args:
+        port (int): The port to serve on.
+        server_args (list): Extra command line arguments for server.py.
+
+    Returns:
+        subprocess.Popen: The server process.
+    """
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port), "--no-rate-limits"] + server_args,
+        cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + settings.CLIENT_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((settings.LOCAL_HOST, port), 1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise SystemExit(strings.CAN_NOT_CONNECT)
+
+def stop_server(process):
+    """
+    Stops a server started by spawn_server.
+
+    Args:
+        process (subprocess.Popen): The server process.
+
+    Returns: None
+    """
+    try:
+        process.stdin.write(b"exit\n")
+        process.stdin.flush()
+        process.wait(settings.CLIENT_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        process.kill()
+
+async def connect_all(options, stats, slow_count=0):
+    """
+    Connects and signs in the configured number of clients, a limited number at a time.
+
+    Args:
+        options (argparse.Namespace): The benchmark options.
+        stats (Stats): The run's statistics.
+        slow_count (int): How many of the clients stop reading once they joined.
+
+    Returns:
+        tuple: The signed-in clients and the connect rate in handshakes per second.
+    """
+    clients = [SimulatedClient(index, stats, options.port, options.context, index < slow_count) for index in range(options.clients)]
+    gate = asyncio.Semaphore(options.concurrency)
+
+    async def connect(client):
+        async with gate:
+            return await client.sign_in()
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(connect(client) for client in clients))
+    elapsed = time.perf_counter() - started
+    return [client for client, ok in zip(clients, results) if ok], stats.connected / elapsed
+
+async def join_rooms(clients, room_size):
+    """
+    Groups clients into rooms of room_size members, the first member of each creating it.
+
+    Args:
+        clients (list): The signed-in clients.
+        room_size (int): The number of members per room.
+
+    Returns:
+        dict: Maps each client to its room name.
+    """
+    rooms = {}
+    for start in range(0, len(clients), room_size):
+        members = clients[start:start + room_size]
+        room = f"bench-room-{start // room_size}"
+        await members[0].join(room, create=True)
+        await asyncio.gather(*(member.join(room) for member in members[1:]))
+        for member in members:
+            rooms[member] = room
+    return rooms
+
+async def drive(senders, rooms, options, stats):
+    """
+    Sends stamped messages from the senders at the target total rate for the configured duration.
+
+    Args:
+        senders (list): The clients sending messages.
+        rooms (dict): Maps each client to its room name.
+        options (argparse.Namespace): The benchmark options.
+        stats (Stats): The run's statistics.
+
+    Returns: None
+    """
+    padding = "x" * max(0, options.message_size - 32)
+    interval = len(senders) / options.rate
+
+    async def pace(client):
+        due = time.perf_counter() + random.random() * interval
+        stop = time.perf_counter() + options.duration
+        while due < stop:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            client.send_stamped(rooms[client], padding)
+            due += interval
+
+    await asyncio.gather(*(pace(client) for client in senders))
+
+async def run_traffic(options, stats, room_size, slow_count=0):
+    """
+    Runs a traffic scenario: connects the clients, joins them to rooms and drives SEND traffic.
+
+    Args:
+        options (argparse.Namespace): The benchmark options.
+        stats (Stats): The run's statistics.
+        room_size (int): The number of members per room.
+        slow_count (int): How many clients stop reading once they joined.
+
+    Returns:
+        dict: The scenario's measurements.
+    """
+    clients, connect_rate = await connect_all(options, stats, slow_count)
+    rooms = await join_rooms(clients, room_size)
+    senders = [client for client in clients if not client.slow][:options.senders] or clients[:1]
+
+    started = time.perf_counter()
+    await drive(senders, rooms, options, stats)
+    await asyncio.sleep(options.grace)
+    elapsed = time.perf_counter() - started
+
+    for client in clients:
+        client.close()
+    await asyncio.gather(*(client.task for client in clients), return_exceptions=True)
+    return {"connect_rate": connect_rate, "messages_per_second": stats.delivered / elapsed}
+
+async def run_churn(options, stats):
+    """
+    Runs the churn scenario: clients repeatedly connect, sign in, join a shared room, send one
+    message and disconnect for the configured duration.
+
+    Args:
+        options (argparse.Namespace): The benchmark options.
+        stats (Stats): The run's statistics.
+
+    Returns:
+        dict: The scenario's measurements.
+    """
+    room = "bench-churn"
+    owner = SimulatedClient(0, stats, options.port, options.context)
+    if not await owner.sign_in():
+        raise SystemExit(strings.CAN_NOT_CONNECT)
+    await owner.join(room, create=True)
+    padding = "x" * max(0, options.message_size - 32)
+    stop = time.perf_counter() + options.duration
+
+    async def cycle(slot):
+        generation = 0
+        while time.perf_counter() < stop:
+            client = SimulatedClient(1 + slot + generation * options.clients, stats, options.port, options.context)
+            generation += 1
+            if await client.sign_in():
+                await client.join(room)
+                client.send_stamped(room, padding)
+                await client.drain()
+            client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(cycle(slot) for slot in range(options.clients)))
+    await asyncio.sleep(options.grace)
+    elapsed = time.perf_counter() - started
+    owner.close()
+    await asyncio.gather(owner.task, return_exceptions=True)
+    return {"connect_rate": stats.connected / elapsed, "messages_per_second": stats.delivered / elapsed}
+
+async def run_scenario(options, stats):
+    """
+    Runs the selected scenario.
+
+    Args:
+        options (argparse.Namespace): The benchmark options.
+        stats (Stats): The run's statistics.
+
+    Returns:
+        dict: The scenario's measurements.
+    """
+    if options.scenario == "huge-room":
+        return await run_traffic(options, stats, options.clients)
+    if options.scenario == "many-rooms":
+        return await run_traffic(options, stats, options.room_size)
+    if options.scenario == "slow-consumers":
+        return await run_traffic(options, stats, options.clients, int(options.clients * options.slow_fraction))
+    return await run_churn(options, stats)
+
+def git_revision():
+    """
+    Returns the commit the benchmarked tree is at, so results can be compared across commits.
+
+    Args: None
+
+    Returns:
+        str: The commit hash, None outside a git checkout.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_arguments(argv=None):
+    """
+    Parses the benchmark's command line options.
+
+    Args:
+        argv (list): The command line arguments, sys.argv[1:] when None.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="load generator and benchmark for the chat server")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="huge-room")
+    parser.add_argument("--clients", type=int, default=100, help="number of simulated clients")
+    parser.add_argument("--senders", type=int, default=10, help="number of clients sending messages")
+    parser.add_argument("--rate", type=float, default=1000, help="target messages per second, all senders together")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    parser.add_argument("--grace", type=float, default=1, help="seconds to wait for deliveries after the traffic")
+    parser.add_argument("--room-size", type=int, default=10, help="members per room in the many-rooms scenario")
+    parser.add_argument("--slow-fraction", type=float, default=0.1, help="share of clients that stop reading in the slow-consumers scenario")
+    parser.add_argument("--message-size", type=int, default=64, help="bytes per message")
+    parser.add_argument("--concurrency", type=int, default=200, help="handshakes in flight at once")
+    parser.add_argument("--port", type=int, default=settings.PORT + 100, help="port of the benchmarked server")
+    parser.add_argument("--external", action="store_true", help="benchmark a server that is already running instead of spawning one")
+    parser.add_argument("--server-pid", type=int, help="process id of an external server, to report its memory")
+    parser.add_argument("--server-args", default="", help="extra arguments for the spawned server.py, for example --async")
+    parser.add_argument("--tls-cert", help="PEM certificate to serve and connect over TLS with, trusted by the clients; plain TCP when omitted")
+    parser.add_argument("--tls-key", help="PEM private key of the certificate, when it is not in the certificate file")
+    parser.add_argument("--output", help="file to write the JSON results to, standard output when omitted")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """
+    Runs one benchmark and writes its results as JSON.
+
+    Args:
+        argv (list): The command line arguments, sys.argv[1:] when None.
+
+    Returns: None
+    """
+    options = parse_arguments(argv)
+    options.context = tls.client_context(options.tls_cert) if options.tls_cert else None
+    server_args = options.server_args.split()
+    if options.tls_cert:
+        server_args += ["--tls-cert", options.tls_cert] + (["--tls-key", options.tls_key] if options.tls_key else [])
+    process = None if options.external else spawn_server(options.port, server_args)
+    pid = options.server_pid if process is None else process.pid
+    stats = Stats()
+    rss_before = server_rss(pid)
+    try:
+        measured = asyncio.run(run_scenario(options, stats))
+        rss_after = server_rss(pid)
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    latencies = sorted(stats.latencies)
+    connect_times = sorted(stats.connect_times)
+    results = {
+        "scenario": options.scenario,
+        "revision": git_revision(),
+        "server_args": options.server_args,
+        "tls": options.context is not None,
+        "clients": options.clients,
+        "connected": stats.connected,
+        "connect_errors": stats.connect_errors,
+        "connect_rate": measured["connect_rate"],
+        "connect_ms": {
+            name: None if value is None else value * 1e3
+            for name, value in (("p50", percentile(connect_times, 0.5)), ("p99", percentile(connect_times, 0.99)))
+        },
+        "sent": stats.sent,
+        "delivered": stats.delivered,
+        "messages_per_second": measured["messages_per_second"],
+        "latency_ms": {
+            name: None if value is None else value / 1e6
+            for name, value in (
+                ("p50", percentile(latencies, 0.5)),
+                ("p99", percentile(latencies, 0.99)),
+                ("p999", percentile(latencies, 0.999)),
+            )
+        },
+        "server_rss_bytes": {"before": rss_before, "after": rss_after},
+    }
+    report = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
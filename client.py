@@ -1,3 +1,4 @@
+import argparse
 import socket   
 import sys
 import select
@@ -6,15 +7,19 @@ import settings
 import manager
 import strings
 import terminal
+import tls
 
-def connect_to_server():
+def connect_to_server(use_tls=False, cafile=None):
     """
     Creates a socket object for the client, sets the socket timeout as specified in settings,
     attempts to connect to the server at the default host and port specified in settings,
     and prints a message indicating whether the connection was successful. If the connection
-    was not successful, exits the program with an error message.
+    was not successful, exits the program with an error message. Over TLS, the handshake resumes
+    the session of the last connection to the server when there is one.
 
-    Args: None
+    Args:
+        use_tls: whether to connect over TLS
+        cafile: the PEM file of the certificates to trust, the system's when None
 
     Returns:
         client: a socket object representing the client's connection to the server
@@ -26,13 +31,42 @@ def connect_to_server():
         client.connect((settings.LOCAL_HOST, settings.PORT))
     except:
         sys.exit(strings.CAN_NOT_CONNECT)
+    if use_tls:
+        try:
+            client = tls.connect(client, settings.LOCAL_HOST, settings.PORT, cafile)
+        except OSError as error:
+            sys.exit(strings.TLS_FAILED + str(error))
     print(strings.CONNECTION_SUCCESS)
     return client
 
+def direct(name):
+    """
+    Prints the prompt of the signed-in user to the console.
+
+    Args:
+        name: the username of the client
+
+    Returns: None
+    """
+    print(f'> {name} $ ', end='', flush=True)
+
+def print_response(response):
+    """
+    Prints a response of the server to the console, followed by a new prompt.
+
+    Args:
+        response: the response message
+
+    Returns: None
+    """
+    print(f"\n{response}\n")
+    direct(manager.username)
+
 def read_from_server(client):
     """
     Attempts to read data from the client socket representing the server's response.
-    If the read is successful, prints the response to the terminal using terminal.print_response.
+    If the read is successful, answers any PING from the server with a PONG and prints the rest of
+    the response to the terminal using print_response.
     If there is an error reading the socket or the socket is closed, exits the program with an error message.
 
     Args:
@@ -42,17 +76,30 @@ def read_from_server(client):
     """
     try:
         response = client.recv(settings.INPUT_SIZE)
+        while tls.pending(client):
+            response += client.recv(settings.INPUT_SIZE)
     except:
         sys.exit(strings.DISCONNECTED_FROM_SERVER)
+    tls.remember(client, settings.LOCAL_HOST, settings.PORT)
+    if response and manager.decoder is not None:
+        response = manager.decoder.feed(response)
+        if not response:
+            return
     if response:
-        terminal.print_response(response)
+        ping = strings.PING.encode(settings.SUPPORTED_TEXT_TYPE)
+        lines = response.split(strings.NEW_LINE.encode(settings.SUPPORTED_TEXT_TYPE))
+        if ping in lines:
+            client.send((strings.PONG + strings.NEW_LINE).encode(settings.SUPPORTED_TEXT_TYPE))
+            response = strings.NEW_LINE.encode(settings.SUPPORTED_TEXT_TYPE).join(line for line in lines if line != ping)
+        if response.strip():
+            print_response(response)
     else:
         sys.exit(strings.DISCONNECTED_FROM_SERVER)
 
 def send_to_server(client):
     """
-    Reads a line of text from standard input and filters it as a client command using terminal.filter_client_command,
-    then sends the resulting command string to the server using the client socket.
+    Reads a line of text from standard input and hands it to terminal.filter_client_command, which exits on EXIT
+    and sends any other command to the server using the client socket.
 
     Args:
         client: a socket object representing the client's connection to the server
@@ -60,20 +107,23 @@ def send_to_server(client):
     Returns: None
     """
     send_command = sys.stdin.readline()
-    filtered_command = terminal.filter_client_command(send_command, client)
-    client.send(filtered_command.encode(settings.SUPPORTED_TEXT_TYPE))
+    terminal.filter_client_command(send_command, client)
 
-def run_client():
+def run_client(use_tls=False, cafile=None, compress=False):
     """
     Runs the client program by connecting to the server, creating a client stream with the client socket and standard input,
     and entering a loop that selects from the client stream and handles input accordingly.
 
-    Args: None
+    Args:
+        use_tls: whether to connect over TLS
+        cafile: the PEM file of the certificates to trust, the system's when None
+        compress: whether to ask the server to compress what it sends
 
     Returns: None
     """
-    client = connect_to_server()
-    manager.welcome(client)
+    client = connect_to_server(use_tls, cafile)
+    manager.welcome(client, compress)
+    direct(manager.username)
     client_stream = [client, sys.stdin]
     while True:
         read_list, _, _ = select.select(client_stream, [], [])
@@ -83,5 +133,24 @@ def run_client():
             else:
                 send_to_server(client)
 
+def parse_arguments(argv=None):
+    """
+    Parses the client's command line options.
+
+    Args:
+        argv (list): The command line arguments, sys.argv[1:] when None.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description=strings.CLIENT_DESCRIPTION)
+    parser.add_argument('--port', type=int, default=settings.PORT, help=strings.PORT_HELP)
+    parser.add_argument('--tls', action='store_true', help=strings.TLS_HELP)
+    parser.add_argument('--tls-ca', default=settings.TLS_CAFILE, help=strings.TLS_CA_HELP)
+    parser.add_argument('--compress', action='store_true', help=strings.COMPRESS_HELP)
+    return parser.parse_args(argv)
+
 if __name__ == '__main__':
-    run_client()
+    arguments = parse_arguments()
+    settings.PORT = arguments.port
+    run_client(arguments.tls, arguments.tls_ca, arguments.compress)
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import marshal
+import socket
+import time
+import zlib
+
+import settings
+import strings
+import manager
+import framing
+import connection
+
+FWD  = "FWD"  # run a command for a user signed in on the sending worker
+MCST = "MCST" # deliver one frame to several users signed in on the receiving worker
+RSRV = "RSRV" # reserve a name owned by the receiving worker
+RSVD = "RSVD" # answer to a reservation
+QUIT = "QUIT" # a user signed in on the sending worker disconnected
+RMAD = "RMAD" # a room owned by the sending worker was created
+SUBS = "SUBS" # a user signed in on the sending worker subscribed to a room name pattern
+USUB = "USUB" # a user signed in on the sending worker unsubscribed from a room name pattern
+
+ROOM_COMMANDS = (strings.JOIN, strings.LEVE, strings.ROOM)
+
+worker  = 0  # index of this worker process
+workers = 1  # number of worker processes
+links   = {} # worker index -> Link to that worker
+pending = {} # name -> connection waiting for the name's owner to reserve it, and its USER argument
+execute = None # runs a command line forwarded for a remote user, given to start by the server
+
+class Link(connection.SocketConnection):
+    """
+    A Unix-domain socket to another worker process. Messages are marshalled tuples sent as
+    length-prefixed frames. Frames delivered to several users on the other worker are coalesced,
+    so a room message crosses each link at most once whatever the number of members behind it.
+    """
+
+    def __init__(self, peer, client):
+        """
+        Args:
+            peer (int): The index of the worker at the other end.
+            client (socket.socket): The Unix-domain socket.
+        """
+        super().__init__(client, settings.LINK_OUTBOUND_LIMIT, settings.overflow.BLOCK)
+        self.peer    = peer
+        self.decoder = framing.FrameDecoder(settings.delimiter.LENGTH_PREFIX, settings.LINK_MAX_FRAME_SIZE)
+        self.batch_frame = None
+        self.batch_names = []
+
+    def post(self, *message):
+        """
+        Queues a message for the other worker.
+
+        Args:
+            message (tuple): The message verb followed by its fields.
+
+        Returns: None
+        """
+        self.commit()
+        self.send(framing.encode_frame(marshal.dumps(message)))
+
+    def deliver(self, name, data):
+        """
+        Queues data for a user signed in on the other worker. Consecutive deliveries of the same
+        frame are sent as one message naming all of their receivers.
+
+        Args:
+            name (str): The receiving user's name.
+            data (bytes): The data to deliver.
+
+        Returns: None
+        """
+        if data is not self.batch_frame:
+            self.commit()
+            self.batch_frame = data
+        self.batch_names.append(name)
+        self.wake()
+
+    def commit(self):
+        """
+        Queues the coalesced delivery being built, if any.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.batch_names:
+            message = (MCST, tuple(self.batch_names), bytes(self.batch_frame))
+            self.batch_frame = None
+            self.batch_names = []
+            self.send(framing.encode_frame(marshal.dumps(message)))
+
+    def flush(self):
+        self.commit()
+        return super().flush()
+
+    def dispatch(self, message):
+        """
+        Handles a message received on the link.
+
+        Args:
+            message (tuple): The message verb followed by its fields.
+
+        Returns: None
+        """
+        dispatch(self, message)
+
+class RemoteConnection:
+    """
+    Stands in for the connection of a user signed in on another worker, so that the command
+    handlers in manager serve remote members of the rooms this worker owns like local ones.
+    """
+    closed = False
+    batch  = None
+    command_budget = None # limited by the worker the user is signed in on
+    message_budget = None
+    compression    = None # applied by the worker the user is signed in on
+    last_seen      = None # when the latest forwarded command arrived
+
+    def __init__(self, link, name):
+        """
+        Args:
+            link (Link): The link to the worker the user is signed in on.
+            name (str): The user's name.
+        """
+        self.link = link
+        self.name = name
+
+    def send(self, data):
+        """
+        Relays data to the user through the link.
+
+        Args:
+            data (bytes): The data to send.
+
+        Returns:
+            int: The number of bytes queued.
+        """
+        self.link.deliver(self.name, data)
+        return len(data)
+
+    def close(self):
+        """
+        Nothing to close, the user's connection belongs to the other worker.
+
+        Args: None
+
+        Returns: None
+        """
+
+def owner(name):
+    """
+    Returns the index of the worker owning a room or a user name.
+
+    Args:
+        name (str): The room or user name.
+
+    Returns:
+        int: The owning worker's index.
+    """
+    return zlib.crc32(name.encode(settings.SUPPORTED_TEXT_TYPE)) % workers
+
+def create_links(count):
+    """
+    Creates one Unix-domain socket pair for every pair of workers, before the workers are forked.
+
+    Args:
+        count (int): The number of workers.
+
+    Returns:
+        dict: Maps (lower index, higher index) to the socket pair connecting the two workers.
+    """
+    return {
+        (first, second): socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        for first in range(count)
+        for second in range(first + 1, count)
+    }
+
+def close_links(pairs):
+    """
+    Closes every socket of the socket pairs, in the parent once the workers are forked.
+
+    Args:
+        pairs (dict): The socket pairs returned by create_links.
+
+    Returns: None
+    """
+    for pair in pairs.values():
+        for end in pair:
+            end.close()
+
+def start(index, count, pairs, executor):
+    """
+    Sets up the cluster state of a freshly forked worker, keeping its own ends of the socket pairs.
+    The command executor is passed in rather than imported, as terminal imports manager, which
+    imports this module.
+
+    Args:
+        index (int): The worker's index.
+        count (int): The number of workers.
+        pairs (dict): The socket pairs returned by create_links.
+        executor (callable): Runs a command line for a connection, terminal.execute.
+
+    Returns:
+        list: The links to the other workers.
+    """
+    global worker, workers, execute
+    worker = index
+    workers = count
+    execute = executor
+    for (first, second), (first_end, second_end) in pairs.items():
+        if first == index:
+            links[second] = Link(second, first_end)
+            second_end.close()
+        elif second == index:
+            links[first] = Link(first, second_end)
+            first_end.close()
+        else:
+            first_end.close()
+            second_end.close()
+    return list(links.values())
+
+def forward(command, argument, client):
+    """
+    Forwards a room command to the worker owning the room, and a new user name to the worker owning
+    the name for reservation.
+
+    Args:
+        command (str): The command.
+        argument (str): The argument to the command.
+        client: The client connection.
+
+    Returns:
+        bool: True if the command was forwarded, False if it is to be run on this worker.
+    """
+    if workers == 1 or isinstance(client, RemoteConnection):
+        return False
+
+    if command == strings.USER:
+        return reserve(argument, client)
+    if command == strings.PMSG:
+        return forward_groups(command, argument, client, manager.private_message)
+    if command == strings.SEND and "," in argument.split(" ", 1)[0]:
+        return forward_groups(command, argument, client, manager.send_message)
+    if command in (strings.SEND, strings.HIST, strings.SRCH, strings.LIME, strings.ACKS, strings.RCPT):
+        room = argument.split(" ", 1)[0]
+    elif command in ROOM_COMMANDS:
+        room = argument
+    else:
+        return False
+
+    target = owner(room)
+    _client = manager.registry.client(client)
+    if target == worker or _client is None:
+        return False
+    links[target].post(FWD, _client.name, command + " " + argument)
+    return True
+
+def forward_groups(command, argument, client, run):
+    """
+    Splits a command naming several users or rooms in a comma separated list by the workers owning
+    the names, and forwards each part to its owner: the owner of a user name knows where the user
+    is signed in, and the owner of a room its members. Every part is acknowledged to the sender on
+    its own, and users reached through several parts receive the message once per part.
+
+    Args:
+        command (str): The command, PMSG or SEND.
+        argument (str): The comma separated names and the message, separated by a space.
+        client: The sender's connection.
+        run (callable): The manager function running the part owned by this worker.
+
+    Returns:
+        bool: True if the command was forwarded, False if it is to be run by this worker.
+    """
+    _client = manager.registry.client(client)
+    names, _, message = argument.partition(" ")
+    groups = {}
+    for name in dict.fromkeys(names.split(",")):
+        groups.setdefault(owner(name), []).append(name)
+    if _client is None or not message or list(groups) == [worker]:
+        return False
+    for target, group in groups.items():
+        if target == worker:
+            run((",".join(group), message.encode(settings.SUPPORTED_TEXT_TYPE)), client)
+        else:
+            links[target].post(FWD, _client.name, command + " " + ",".join(group) + " " + message)
+    return True
+
+def reserve(argument, client):
+    """
+    Asks the worker owning a user name to reserve it for a client signing in on this worker.
+
+    Args:
+        argument (str): The user name, optionally followed by a compression capability.
+        client: The client connection.
+
+    Returns:
+        bool: True if the reservation is handled here, False if the name is owned by this worker.
+    """
+    name = manager.split_capability(argument)[0]
+    target = owner(name)
+    if target == worker or client in manager.clients:
+        return False
+    if name in pending or manager.registry.find(name):
+        client.send(strings.CLIENT_EXISTS.encode(settings.SUPPORTED_TEXT_TYPE))
+        return True
+    pending[name] = (client, argument)
+    links[target].post(RSRV, name)
+    return True
+
+def room_added(name):
+    """
+    Tells the other workers about a room created on this worker so that they can list it.
+
+    Args:
+        name (str): The room name.
+
+    Returns: None
+    """
+    for link in links.values():
+        link.post(RMAD, name)
+
+def client_quit(name):
+    """
+    Tells the other workers that a user signed in on this worker disconnected.
+
+    Args:
+        name (str): The user name.
+
+    Returns: None
+    """
+    for link in links.values():
+        link.post(QUIT, name)
+
+def subscription_changed(name, pattern, subscribed):
+    """
+    Tells the other workers that a user signed in on this worker subscribed to a room name pattern
+    or unsubscribed from it, so that their rooms matching it deliver to the user too.
+
+    Args:
+        name (str): The user name.
+        pattern (str): The room name pattern.
+        subscribed (bool): True for a subscription, False for its removal.
+
+    Returns: None
+    """
+    for link in links.values():
+        link.post(SUBS if subscribed else USUB, name, pattern)
+
+def proxy(link, name):
+    """
+    Returns the stand-in client for a user signed in on the worker at the other end of a link,
+    creating it on first use.
+
+    Args:
+        link (Link): The link to the user's worker.
+        name (str): The user name.
+
+    Returns:
+        Client: The stand-in client, or None if the name belongs to a user signed in here.
+    """
+    _client = manager.registry.find(name)
+    if _client is None:
+        return manager.registry.add_client(name, RemoteConnection(link, name))
+    if isinstance(_client.connection, RemoteConnection):
+        return _client
+    return None
+
+def dispatch(link, message):
+    """
+    Handles a message received from another worker.
+
+    Args:
+        link (Link): The link the message arrived on.
+        message (tuple): The message verb followed by its fields.
+
+    Returns: None
+    """
+    verb = message[0]
+    if verb == MCST:
+        frame = memoryview(message[2])
+        for name in message[1]:
+            _client = manager.registry.find(name)
+            if _client is not None and not isinstance(_client.connection, RemoteConnection):
+                _client.connection.send(frame)
+    elif verb == FWD:
+        _client = proxy(link, message[1])
+        if _client is not None:
+            _client.connection.last_seen = time.monotonic()
+            execute(message[2], _client.connection)
+    elif verb == RSRV:
+        name = message[1]
+        link.post(RSVD, name, manager.registry.find(name) is None and proxy(link, name) is not None)
+    elif verb == RSVD:
+        name, reserved = message[1], message[2]
+        client, argument = pending.pop(name, (None, None))
+        if client is None or client.closed:
+            if reserved:
+                link.post(QUIT, name)
+        elif reserved:
+            manager.create_user(argument, client)
+        else:
+            client.send(strings.CLIENT_EXISTS.encode(settings.SUPPORTED_TEXT_TYPE))
+    elif verb == QUIT:
+        _client = manager.registry.find(message[1])
+        if _client is not None and isinstance(_client.connection, RemoteConnection) and _client.connection.link is link:
+            manager.registry.remove_client(_client.connection)
+    elif verb == RMAD:
+        manager.registry.add_room(message[1])
+    elif verb in (SUBS, USUB):
+        _client = proxy(link, message[1])
+        if _client is None:
+            return
+        if verb == SUBS:
+            manager.registry.subscribe(_client, message[2])
+        else:
+            manager.registry.unsubscribe(_client, message[2])
+
+def handle_link_input(link, server_stream):
+    """
+    Reads data from a link and handles every complete message it yields.
+
+    Args:
+        link (Link): The link.
+        server_stream (set): The server's set of connected streams.
+
+    Returns: None
+    """
+    try:
+        size = link.recv_into(link.decoder.writable())
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError:
+        size = 0
+
+    if not size:
+        server_stream.discard(link)
+        link.close()
+        return
+
+    link.decoder.commit(size)
+    for frame in link.decoder.frames():
+        link.dispatch(marshal.loads(frame))
+        if link.closed:
+            return
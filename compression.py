@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import struct
+import zlib
+
+import settings
+import strings
+import metrics
+
+HEADER = struct.Struct("!BI") # kind and size in front of every frame sent to a client that negotiated compression
+RAW    = 0                    # the frame is sent as it is
+ZLIB   = 1                    # the frame is a raw deflate block primed with DICTIONARY
+
+# Text that recurs in what the server sends, most frequent last, where deflate finds it cheapest.
+# Both ends prime every block with it, so even short messages compress.
+DICTIONARY = "".join((
+    strings.HELP_MESSAGE,
+    strings.WELCOME_CLIENT,
+    strings.ROOM_HISTORY,
+    strings.SEARCH_RESULTS,
+    strings.ROOM_MEMBERS,
+    strings.ROOMS_AVAILABLE_TITLE,
+    strings.PRIVATE_SENT,
+    strings.NEW_MEMBER_JOINED,
+    strings.MEMBER_LEFT,
+    " the and you to is it that of in for on this what with have are ",
+    "@private: ",
+    " You@",
+    "\n#",
+)).encode(settings.SUPPORTED_TEXT_TYPE)
+
+class Context:
+    """
+    A compression capability a client can negotiate. Frames below settings.COMPRESSION_THRESHOLD
+    bytes, and frames deflate does not shrink, are sent raw. Every frame is compressed on its own
+    rather than as part of a per-connection stream, so a broadcast message is compressed once
+    and the same bytes are queued to every receiver that negotiated the context. A context that
+    does not deflate only frames, for clients that need to tell answers apart but not to save bandwidth.
+    """
+    __slots__ = ("name", "level", "deflate")
+
+    def __init__(self, name, level=None, deflate=True):
+        """
+        Args:
+            name (str): The capability's name, given after the user name in the USER command.
+            level (int): The zlib compression level, settings.COMPRESSION_LEVEL when None.
+            deflate (bool): Whether to compress frames, or send every frame raw.
+        """
+        self.name    = name
+        self.level   = settings.COMPRESSION_LEVEL if level is None else level
+        self.deflate = deflate
+
+    def encode(self, data):
+        """
+        Frames data for a client that negotiated the context.
+
+        Args:
+            data (bytes | memoryview): The data.
+
+        Returns:
+            bytes: The frame.
+        """
+        size = len(data)
+        if self.deflate and size >= settings.COMPRESSION_THRESHOLD:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=DICTIONARY)
+            packed = compressor.compress(data) + compressor.flush()
+            if len(packed) < size:
+                metrics.deflated_in.inc(size)
+                metrics.deflated_out.inc(len(packed))
+                return HEADER.pack(ZLIB, len(packed)) + packed
+        return HEADER.pack(RAW, size) + data
+
+CONTEXTS = { # capability name -> Context
+    strings.ZLIB:  Context(strings.ZLIB),
+    strings.FRAME: Context(strings.FRAME, deflate=False),
+}
+
+def negotiate(capability):
+    """
+    Looks up a compression capability requested by a client.
+
+    Args:
+        capability (str): The capability's name, in any case.
+
+    Returns:
+        Context: The context, or None if the server does not offer the capability.
+    """
+    return CONTEXTS.get(capability.upper())
+
+class Decoder:
+    """
+    Client side of a negotiated compression: splits the bytes received from the server into
+    frames and inflates the compressed ones.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, data):
+        """
+        Takes bytes received from the server.
+
+        Args:
+            data (bytes): The bytes received.
+
+        Returns:
+            bytes: The content of the frames they complete.
+        """
+        return b"".join(self.frames(data))
+
+    def frames(self, data):
+        """
+        Takes bytes received from the server, frame by frame.
+
+        Args:
+            data (bytes): The bytes received.
+
+        Yields:
+            bytes: The content of each frame they complete.
+        """
+        self.buffer += data
+        while len(self.buffer) >= HEADER.size:
+            kind, size = HEADER.unpack_from(self.buffer)
+            end = HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            frame = self.buffer[HEADER.size:end]
+            self.buffer = self.buffer[end:]
+            if kind == ZLIB:
+                frame = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DICTIONARY).decompress(frame)
+            yield frame
+
+def framed(data):
+    """
+    Tells whether bytes received from the server are compression frames rather than text, which
+    is how a client learns that the server accepted the compression it asked for.
+
+    Args:
+        data (bytes): The first bytes received after the USER command.
+
+    Returns:
+        bool: True if the data starts with a frame header.
+    """
+    return bool(data) and data[0] in (RAW, ZLIB)
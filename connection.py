@@ -0,0 +1,789 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import itertools
+import selectors
+import socket
+import ssl
+import time
+
+import settings
+import framing
+import metrics
+import ratelimit
+import strings
+import timers
+import tls
+
+class Interest(set):
+    """
+    A set of connections that tells a listener of every connection added to it or removed from
+    it, so that a selector can follow the set without scanning it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.changed = None # called with every connection added or removed, None when nothing follows the set
+
+    def add(self, client):
+        if client not in self:
+            super().add(client)
+            if self.changed is not None:
+                self.changed(client)
+
+    def discard(self, client):
+        if client in self:
+            super().discard(client)
+            if self.changed is not None:
+                self.changed(client)
+
+opened     = set()      # connections that are not closed yet
+writers    = Interest() # socket connections with queued outbound data, watched for writability
+overflowed = set()      # connections that exceeded their buffer under the disconnect policy
+blocking   = []         # connections pushed over their limit under the block policy by the current command
+
+GATHER_WRITES = hasattr(socket.socket, "sendmsg")
+WOULD_BLOCK   = (BlockingIOError, InterruptedError) + tls.WOULD_BLOCK
+TLS_RECORD    = 16384 # most plaintext bytes in one TLS record
+
+class Connection:
+    """
+    A client connection with a frame decoder for its input and a bounded outbound buffer. Data
+    handed to send() is queued and written when the connection is writable, so one slow receiver
+    never delays delivery to the others. When the buffer is full the connection's overflow policy
+    decides what happens: drop the oldest queued data, disconnect the slow consumer, or block the sender.
+    While the commands of a batch run, data sent to the connection is held back, up to the
+    outbound limit, and sent as one combined answer when the batch ends. A connection that
+    negotiated compression frames and compresses what it sends. The connection's commands, and the receivers of its
+    messages, are taken from its own rate limit budgets. A watched connection that stays silent
+    for settings.IDLE_TIMEOUT seconds is sent a PING, and reaped unless it answers within
+    settings.PONG_TIMEOUT seconds.
+    """
+
+    def __init__(self, limit=None, policy=None):
+        """
+        Args:
+            limit (int): The outbound buffer size in bytes, settings.OUTBOUND_LIMIT when None.
+            policy (settings.overflow): The overflow policy, settings.OVERFLOW_POLICY when None.
+        """
+        self.outbound = collections.deque()
+        self.pending  = 0
+        self.started  = False
+        self.closed   = False
+        self.limit    = settings.OUTBOUND_LIMIT if limit is None else limit
+        self.policy   = settings.OVERFLOW_POLICY if policy is None else policy
+        self.decoder  = framing.FrameDecoder()
+        self.batch    = None # commands of a batch being received, None outside a batch
+        self.batched  = 0    # bytes of the commands in the batch
+        self.held     = None # answers held back while a batch runs
+        self.withheld = 0    # bytes of the answers sent while the batch runs, held back or not
+        self.command_budget = ratelimit.command_budget()
+        self.message_budget = ratelimit.message_budget()
+        self.last_seen = time.monotonic() # when input last arrived
+        self.pinged    = None # when the unanswered PING was sent
+        self.keepalive = None # Timer of the next idle check, None when not watched
+        self.reap      = None
+        self.compression = None # compression.Context negotiated at USER time
+        self.traces      = None # [bytes left to write, tracing.Trace, receiver name] of traced messages queued
+        opened.add(self)
+
+    def send(self, data):
+        """
+        Queues data for delivery without blocking.
+
+        Args:
+            data (bytes): The data to send.
+
+        Returns:
+            int: The number of bytes queued, 0 if the data was refused.
+        """
+        if self.closed:
+            return 0
+        if self.held is not None:
+            self.withheld += len(data)
+            if self.withheld <= self.limit:
+                self.held.append(bytes(data))
+            return len(data)
+        if self.compression is not None:
+            data = self.compression.encode(data)
+        return self.queue(data)
+
+    def queue(self, data):
+        """
+        Queues data already framed for the connection's compression.
+
+        Args:
+            data (bytes): The data to send.
+
+        Returns:
+            int: The number of bytes queued, 0 if the data was refused.
+        """
+        if self.closed:
+            return 0
+        size = len(data)
+        if self.pending + size > self.limit and not self.overflow(size):
+            return 0
+        self.outbound.append(data if isinstance(data, memoryview) else memoryview(data))
+        self.pending += size
+        self.wake()
+        return size
+
+    def overflow(self, size):
+        """
+        Applies the overflow policy when queuing size more bytes would exceed the limit.
+
+        Args:
+            size (int): The size of the data about to be queued.
+
+        Returns:
+            bool: True if the data should still be queued, False if it is refused.
+        """
+        if self.policy is settings.overflow.DISCONNECT:
+            overflowed.add(self)
+            return False
+
+        if self.policy is settings.overflow.BLOCK:
+            if self not in blocking:
+                blocking.append(self)
+            return True
+
+        # a partly written chunk stays at the head so the peer never sees a torn message
+        head = self.outbound.popleft() if self.started else None
+        while self.outbound and self.pending + size > self.limit:
+            self.pending -= len(self.outbound.popleft())
+        if head is not None:
+            self.outbound.appendleft(head)
+        return self.pending + size <= self.limit
+
+    def written(self, sent):
+        """
+        Removes sent bytes from the head of the outbound queue.
+
+        Args:
+            sent (int): The number of bytes written to the peer.
+
+        Returns: None
+        """
+        self.pending -= sent
+        if self.traces:
+            self.unwind(sent)
+        while sent:
+            head = self.outbound[0]
+            if sent < len(head):
+                self.outbound[0] = head[sent:]
+                self.started = True
+                return
+            sent -= len(head)
+            self.outbound.popleft()
+        self.started = False
+
+    def follow(self, trace, name):
+        """
+        Follows the traced message just queued until it is written to the peer.
+
+        Args:
+            trace (tracing.Trace): The message's trace.
+            name (str): The receiver's name.
+
+        Returns: None
+        """
+        if self.traces is None:
+            self.traces = []
+        self.traces.append([self.pending, trace, name])
+
+    def unwind(self, sent):
+        """
+        Tells the traces of the messages written out by sent bytes that they were flushed.
+
+        Args:
+            sent (int): The number of bytes written to the peer.
+
+        Returns: None
+        """
+        for entry in self.traces:
+            entry[0] -= sent
+        while self.traces and self.traces[0][0] <= 0:
+            _, trace, name = self.traces.pop(0)
+            trace.written(name)
+
+    def relieved(self):
+        """
+        Tells whether the outbound buffer has drained below its low-water mark, half the limit.
+
+        Args: None
+
+        Returns:
+            bool: True if senders blocked on this connection may continue.
+        """
+        return self.closed or self.pending <= self.limit // 2
+
+    def queued(self):
+        """
+        Returns the number of bytes waiting to be written to the peer.
+
+        Args: None
+
+        Returns:
+            int: The number of queued bytes.
+        """
+        return self.pending
+
+    def wake(self):
+        """
+        Signals that outbound data is waiting to be written.
+
+        Args: None
+
+        Returns: None
+        """
+
+    def watch(self, reap):
+        """
+        Starts checking the connection for silence. The check is one timer on the wheel, and
+        the server loop waits on a selector, so neither the waits nor the ticks scan the
+        connections however many of them are watched.
+
+        Args:
+            reap (callable): Called without arguments to disconnect the connection when it does
+                             not answer a PING.
+
+        Returns: None
+        """
+        self.reap = reap
+        self.keepalive = timers.schedule(settings.IDLE_TIMEOUT, self.check_idle)
+
+    def hang_up(self):
+        """
+        Writes what the peer takes of the queued data at once and disconnects the connection.
+
+        Args: None
+
+        Returns: None
+        """
+        self.flush()
+        self.reap()
+
+    def check_idle(self):
+        """
+        Runs when the connection's idle check is due: reaps the connection if nothing arrived since
+        its PING, sends a PING if it has been silent for settings.IDLE_TIMEOUT seconds, and
+        otherwise schedules the next check for when it would have been.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.closed:
+            return
+        now = time.monotonic()
+        idle = now - self.last_seen
+        if self.pinged is not None and self.last_seen < self.pinged:
+            self.keepalive = None
+            metrics.reaped.inc()
+            self.reap()
+        elif idle < settings.IDLE_TIMEOUT:
+            self.pinged = None
+            self.keepalive = timers.schedule(settings.IDLE_TIMEOUT - idle, self.check_idle)
+        else:
+            self.pinged = now
+            self.send((strings.NEW_LINE + strings.PING).encode(settings.SUPPORTED_TEXT_TYPE))
+            self.keepalive = timers.schedule(settings.PONG_TIMEOUT, self.check_idle)
+
+    def close(self):
+        """
+        Marks the connection as closed and forgets any queued data.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.keepalive is not None:
+            self.keepalive.cancel()
+            self.keepalive = None
+        self.closed = True
+        self.outbound.clear()
+        self.pending = 0
+        self.traces = None
+        opened.discard(self)
+        writers.discard(self)
+        overflowed.discard(self)
+
+class SocketConnection(Connection):
+    """
+    A connection over a non-blocking socket, served by the loop in server.run_server.
+    """
+    handshaking = False
+
+    def __init__(self, client, limit=None, policy=None):
+        """
+        Args:
+            client (socket.socket): The client socket.
+            limit (int): The outbound buffer size in bytes.
+            policy (settings.overflow): The overflow policy.
+        """
+        super().__init__(limit, policy)
+        self.socket = client
+        self.socket.setblocking(False)
+
+    def fileno(self):
+        """
+        Returns the socket's file descriptor so the connection can be registered with a selector.
+
+        Args: None
+
+        Returns:
+            int: The file descriptor.
+        """
+        return self.socket.fileno()
+
+    def recv_into(self, buffer):
+        """
+        Reads from the socket into buffer.
+
+        Args:
+            buffer (memoryview): The buffer to fill.
+
+        Returns:
+            int: The number of bytes read, 0 once the peer has closed the connection.
+        """
+        return self.socket.recv_into(buffer)
+
+    def buffered(self):
+        """
+        Returns the number of bytes read from the socket but not yet handed out by recv_into,
+        which the selector does not report as readable.
+
+        Args: None
+
+        Returns:
+            int: The number of bytes.
+        """
+        return 0
+
+    def wake(self):
+        writers.add(self)
+
+    def flush(self):
+        """
+        Writes as much queued data as the socket accepts without blocking, gathering up to
+        settings.MAX_GATHER_BUFFERS queued frames into one sendmsg call where it is available.
+
+        Args: None
+
+        Returns:
+            bool: False if the socket failed, True otherwise.
+        """
+        while self.outbound:
+            try:
+                if GATHER_WRITES and len(self.outbound) > 1:
+                    sent = self.socket.sendmsg(itertools.islice(self.outbound, settings.MAX_GATHER_BUFFERS))
+                else:
+                    sent = self.socket.send(self.outbound[0])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                return False
+            self.written(sent)
+        if not self.outbound:
+            writers.discard(self)
+        return True
+
+    def close(self):
+        super().close()
+        self.socket.close()
+
+class TLSConnection(SocketConnection):
+    """
+    A connection over a non-blocking TLS socket, served by the loop in server.run_server.
+    The handshake never blocks the loop: it is advanced whenever the socket is readable or
+    writable, and the connection is reaped if it has not finished within
+    settings.TLS_HANDSHAKE_TIMEOUT seconds. TLS sockets cannot gather writes, so queued frames are
+    joined into one buffer of up to a TLS record before they are written.
+    """
+
+    def __init__(self, client, limit=None, policy=None):
+        """
+        Args:
+            client (ssl.SSLSocket): The client socket, wrapped without running the handshake.
+            limit (int): The outbound buffer size in bytes.
+            policy (settings.overflow): The overflow policy.
+        """
+        super().__init__(client, limit, policy)
+        self.handshaking = True
+        self.deadline    = timers.schedule(settings.TLS_HANDSHAKE_TIMEOUT, self.check_handshake)
+
+    def handshake(self):
+        """
+        Advances the handshake as far as the socket allows without blocking.
+
+        Args: None
+
+        Returns:
+            bool: False if the handshake failed, True if it finished or is waiting for the socket.
+        """
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLWantReadError:
+            writers.discard(self)
+            return True
+        except ssl.SSLWantWriteError:
+            writers.add(self)
+            return True
+        except OSError:
+            tls.handshake_failed()
+            return False
+        self.handshaking = False
+        self.deadline.cancel()
+        tls.handshake_done(self.socket)
+        if self.outbound:
+            writers.add(self)
+        else:
+            writers.discard(self)
+        return True
+
+    def check_handshake(self):
+        """
+        Reaps the connection if its handshake has not finished in time.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.handshaking and not self.closed:
+            tls.handshake_failed()
+            self.reap()
+
+    def buffered(self):
+        return self.socket.pending()
+
+    def wake(self):
+        if not self.handshaking:
+            writers.add(self)
+
+    def flush(self):
+        """
+        Advances the handshake, or writes as much queued data as the socket accepts without
+        blocking. A write the socket could not take has to be repeated with the same data, so
+        the head of the queue is then kept even under the drop-oldest policy.
+
+        Args: None
+
+        Returns:
+            bool: False if the socket failed, True otherwise.
+        """
+        if self.handshaking:
+            return self.handshake()
+        while self.outbound:
+            if len(self.outbound) > 1 and not self.started:
+                self.coalesce()
+            try:
+                sent = self.socket.send(self.outbound[0])
+            except ssl.SSLWantWriteError:
+                self.started = True
+                break
+            except WOULD_BLOCK:
+                break
+            except OSError:
+                return False
+            self.written(sent)
+        if not self.outbound:
+            writers.discard(self)
+        return True
+
+    def coalesce(self):
+        """
+        Joins the frames at the head of the queue into one buffer of up to TLS_RECORD bytes and
+        at most settings.MAX_GATHER_BUFFERS frames.
+
+        Args: None
+
+        Returns: None
+        """
+        chunks = [self.outbound.popleft()]
+        size = len(chunks[0])
+        while self.outbound and len(chunks) < settings.MAX_GATHER_BUFFERS and size + len(self.outbound[0]) <= TLS_RECORD:
+            chunk = self.outbound.popleft()
+            chunks.append(chunk)
+            size += len(chunk)
+        self.outbound.appendleft(memoryview(b"".join(chunks)) if len(chunks) > 1 else chunks[0])
+
+    def close(self):
+        self.deadline.cancel()
+        super().close()
+
+class StreamConnection(Connection):
+    """
+    A connection over an asyncio StreamReader/StreamWriter pair, served by async_server. A writer
+    task moves queued data to the transport whenever the transport is below its high-water mark.
+    """
+
+    def __init__(self, reader, writer, limit=None, policy=None):
+        """
+        Args:
+            reader (asyncio.StreamReader): The reading half of the client connection.
+            writer (asyncio.StreamWriter): The writing half of the client connection.
+            limit (int): The outbound buffer size in bytes.
+            policy (settings.overflow): The overflow policy.
+        """
+        super().__init__(limit, policy)
+        self.reader = reader
+        self.writer = writer
+        self.ready  = asyncio.Event()
+        self.drained = asyncio.Event()
+
+    def wake(self):
+        self.ready.set()
+
+    async def run_writer(self):
+        """
+        Writes queued data to the transport until the connection closes.
+
+        Args: None
+
+        Returns: None
+        """
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.outbound:
+                    self.flush()
+                    if self.relieved():
+                        self.drained.set()
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            self.abort()
+
+    def flush(self):
+        """
+        Hands all queued data to the transport, which writes it as the socket becomes writable.
+
+        Args: None
+
+        Returns:
+            bool: Always True, transport errors surface in run_writer.
+        """
+        chunks = list(self.outbound)
+        self.outbound.clear()
+        if self.traces:
+            self.unwind(self.pending)
+        self.pending = 0
+        self.writer.writelines(chunks)
+        return True
+
+    def queued(self):
+        return self.pending + self.writer.transport.get_write_buffer_size()
+
+    def hang_up(self):
+        """
+        Hands the queued data to the transport and closes it once it is written, so the reader
+        sees the end of the stream and disconnects the connection.
+
+        Args: None
+
+        Returns: None
+        """
+        self.flush()
+        self.writer.close()
+
+    async def wait_relieved(self):
+        """
+        Waits until the outbound buffer has drained below its low-water mark.
+
+        Args: None
+
+        Returns: None
+        """
+        while not self.relieved():
+            self.drained.clear()
+            await self.drained.wait()
+
+    def abort(self):
+        """
+        Drops the transport and anything still buffered on it, so the connection's reader sees
+        the end of the stream right away even if the peer stopped reading.
+
+        Args: None
+
+        Returns: None
+        """
+        self.writer.transport.abort()
+
+    def close(self):
+        super().close()
+        self.ready.set()
+        self.drained.set()
+        self.writer.close()
+
+class ServerStream(set):
+    """
+    The inputs of the loop in server.run_server: listening sockets, standard input, connections and
+    links. Every input is registered with a selector as it is added and unregistered as it is
+    removed, so a wait costs time in proportion to the inputs that are ready rather than to all
+    of them, and descriptors above select's FD_SETSIZE are served like any other. An input is
+    watched for writability while it is in writers, and for readability unless it is muted.
+    """
+
+    def __init__(self, selector):
+        """
+        Args:
+            selector (selectors.BaseSelector): The selector the inputs are registered with.
+        """
+        super().__init__()
+        self.selector = selector
+        self.interest = {}    # input -> its file descriptor and the events it is registered for
+        self.muted    = set() # inputs not read from for now, such as paused senders
+
+    def add(self, input):
+        """
+        Adds an input and registers it with the selector.
+
+        Args:
+            input: The input, anything with a fileno method.
+
+        Returns: None
+
+        Raises:
+            OSError: If the selector can not watch the input, such as a regular file under epoll.
+        """
+        if input in self:
+            return
+        self.interest[input] = (input.fileno(), 0)
+        try:
+            self.follow(input)
+        except (OSError, ValueError):
+            del self.interest[input]
+            raise
+        super().add(input)
+
+    def discard(self, input):
+        """
+        Removes an input and unregisters it from the selector. The input may already be closed.
+
+        Args:
+            input: The input.
+
+        Returns: None
+        """
+        if input not in self:
+            return
+        super().discard(input)
+        self.muted.discard(input)
+        fd, events = self.interest.pop(input)
+        if events:
+            self.selector.unregister(fd)
+
+    def remove(self, input):
+        if input not in self:
+            raise KeyError(input)
+        self.discard(input)
+
+    def update(self, inputs):
+        for input in inputs:
+            self.add(input)
+
+    def mute(self, input):
+        """
+        Stops reading from an input until it is unmuted. Its queued data is still written.
+
+        Args:
+            input: The input.
+
+        Returns: None
+        """
+        self.muted.add(input)
+        self.follow(input)
+
+    def unmute(self, input):
+        """
+        Reads from a muted input again.
+
+        Args:
+            input: The input.
+
+        Returns: None
+        """
+        self.muted.discard(input)
+        self.follow(input)
+
+    def follow(self, input):
+        """
+        Brings the events an input is registered for in line with whether it is muted and whether
+        it is in writers. An input watched for no event at all is left out of the selector.
+
+        Args:
+            input: The input.
+
+        Returns: None
+        """
+        if input not in self.interest or getattr(input, 'closed', False):
+            return
+        fd, current = self.interest[input]
+        events = (0 if input in self.muted else selectors.EVENT_READ) | (selectors.EVENT_WRITE if input in writers else 0)
+        if events == current:
+            return
+        if not current:
+            self.selector.register(fd, events, input)
+        elif not events:
+            self.selector.unregister(fd)
+        else:
+            self.selector.modify(fd, events, input)
+        self.interest[input] = (fd, events)
+
+    def select(self, timeout):
+        """
+        Waits until inputs are ready or the timeout passes.
+
+        Args:
+            timeout (float): Seconds to wait at most, None to wait for input only.
+
+        Returns:
+            tuple: The list of inputs ready to be read, and the list of inputs ready to be written.
+        """
+        ready = self.selector.select(timeout)
+        return ([key.data for key, events in ready if events & selectors.EVENT_READ],
+                [key.data for key, events in ready if events & selectors.EVENT_WRITE])
+
+def queue_depth():
+    """
+    Returns the number of bytes queued for delivery over all open connections.
+
+    Args: None
+
+    Returns:
+        int: The number of queued bytes.
+    """
+    return sum(client.queued() for client in list(opened))
+
+metrics.gauge("chat_outbound_queued_bytes", "Bytes queued for delivery over all open connections.", queue_depth)
+
+def take_blocking():
+    """
+    Returns and clears the connections the last command pushed over their limit under the block policy.
+
+    Args: None
+
+    Returns:
+        list: The connections the sender has to wait for.
+    """
+    receivers = blocking[:]
+    blocking.clear()
+    return receivers
+
+async def settle():
+    """
+    Applies the overflow policies of stream connections after a command ran: waits for receivers the
+    command pushed over their limit under the block policy, and aborts slow consumers under the
+    disconnect policy.
+
+    Args: None
+
+    Returns: None
+    """
+    for receiver in take_blocking():
+        await receiver.wait_relieved()
+    for receiver in list(overflowed):
+        overflowed.discard(receiver)
+        receiver.abort()
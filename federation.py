@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import errno
+import itertools
+import logging
+import socket
+import time
+
+import settings
+import strings
+import manager
+import cluster
+import timers
+
+NODE = "NODE" # handshake naming the node at the other end of a new link
+NICK = "NICK" # a user signed in
+QUIT = "QUIT" # a user disconnected
+RMAD = "RMAD" # a room was created
+JOIN = "JOIN" # a user joined a room
+LEVE = "LEVE" # a user left a room
+RMSG = "RMSG" # a message was sent to a room
+PMSG = "PMSG" # a private message to a user behind the link
+
+node     = None # name of this node in the network
+listener = None # socket accepting links from other nodes
+stream   = None # inputs of the server loop, which links leave as they close
+peers    = {}   # node name -> Peer
+routes   = {}   # room name -> {Peer: number of members behind it}
+unlinked = {}   # resolved address of a configured peer -> time of the next connection attempt
+parked   = {}   # node name -> address of a configured peer not dialled while the node is linked otherwise
+sequence = itertools.count(1)
+seen     = set()
+history  = collections.deque()
+
+log = logging.getLogger(__name__)
+
+class Peer(cluster.Link):
+    """
+    A TCP link to another server node. Node, user, room and membership events are flooded to
+    every other link once, while room messages are only relayed to links with members of the
+    room behind them. Events carry their origin node and a sequence number so duplicates are
+    dropped even if links form a cycle. A link this node opens connects without blocking: it is
+    watched for writability, and established once the socket becomes writable.
+    """
+
+    def __init__(self, client, address=None):
+        """
+        Args:
+            client (socket.socket): The TCP socket to the other node.
+            address (tuple): The resolved address the link was opened to, None for accepted links.
+        """
+        super().__init__(None, client)
+        self.address    = address
+        self.connecting = None # Timer giving up the connection attempt, None once connected
+
+    def dispatch(self, message):
+        receive(self, message)
+
+    def flush(self):
+        """
+        Finishes the connection attempt once the socket is writable, then writes the queued messages.
+
+        Args: None
+
+        Returns:
+            bool: False if the connection failed, True otherwise.
+        """
+        if self.connecting is not None:
+            if self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                return False
+            self.connecting.cancel()
+            self.connecting = None
+        return super().flush()
+
+    def check_connect(self):
+        """
+        Closes the link if its connection attempt has not finished within settings.CLIENT_TIMEOUT seconds.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.connecting is not None and not self.closed:
+            self.connecting = None
+            self.close()
+
+    def close(self):
+        """
+        Removes the link from the server loop and closes it, forgetting what was behind it.
+
+        Args: None
+
+        Returns: None
+        """
+        if not self.closed:
+            if self.connecting is not None:
+                self.connecting.cancel()
+                self.connecting = None
+            if stream is not None:
+                stream.discard(self)
+            super().close()
+            split(self)
+
+class RemoteUser:
+    """
+    Stands in for the connection of a user signed in on another node. Room messages reach
+    that user through the link, so sends to the stand-in are dropped.
+    """
+    closed      = False
+    compression = None
+
+    def __init__(self, link):
+        """
+        Args:
+            link (Peer): The link leading to the user's node.
+        """
+        self.link = link
+
+    def send(self, data):
+        """
+        Drops data meant for the remote user, room messages are relayed per link instead.
+
+        Args:
+            data (bytes): The data to send.
+
+        Returns:
+            int: Always 0.
+        """
+        return 0
+
+    def close(self):
+        """
+        Nothing to close, the user's connection belongs to the other node.
+
+        Args: None
+
+        Returns: None
+        """
+
+def start(server_stream):
+    """
+    Starts listening for links from other nodes and schedules connections to the configured peers,
+    resolving their addresses once, so that connecting never waits for name resolution.
+
+    Args:
+        server_stream (set): The server's set of connected streams.
+
+    Returns: None
+    """
+    global node, listener, stream
+    node = settings.NODE_NAME or f"{socket.gethostname()}:{settings.PORT}"
+    stream = server_stream
+    if settings.PEER_PORT:
+        listener = socket.socket(settings.IPV4, settings.CONNECT_TCP)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((settings.DEFAULT_HOST, settings.PEER_PORT))
+        listener.listen(settings.MAX_CONNECT_REQUEST)
+        server_stream.add(listener)
+    for host, port in settings.PEERS:
+        try:
+            address = socket.getaddrinfo(host, port, settings.IPV4, settings.CONNECT_TCP)[0][4]
+        except OSError:
+            log.warning('%s %s:%s', strings.PEER_UNRESOLVED, host, port)
+            continue
+        unlinked[address] = 0
+
+def timeout():
+    """
+    Returns how long the server loop may wait before connecting to an unlinked peer.
+
+    Args: None
+
+    Returns:
+        float: Seconds to wait, or None if no peer is waiting to be connected.
+    """
+    if not unlinked:
+        return None
+    return max(0, min(unlinked.values()) - time.monotonic())
+
+def connect_peers(server_stream):
+    """
+    Starts connecting to the configured peers that are due for a connection attempt, without
+    waiting for the connections to be established.
+
+    Args:
+        server_stream (set): The server's set of connected streams.
+
+    Returns: None
+    """
+    now = time.monotonic()
+    for address, due in list(unlinked.items()):
+        if due > now:
+            continue
+        client = socket.socket(settings.IPV4, settings.CONNECT_TCP)
+        client.setblocking(False)
+        if client.connect_ex(address) not in (0, errno.EINPROGRESS):
+            client.close()
+            unlinked[address] = now + settings.PEER_RETRY_INTERVAL
+            continue
+        del unlinked[address]
+        link = Peer(client, address)
+        link.connecting = timers.schedule(settings.CLIENT_TIMEOUT, link.check_connect)
+        link.post(NODE, node, 0)
+        server_stream.add(link)
+
+def accept(server_stream):
+    """
+    Accepts a link from another node.
+
+    Args:
+        server_stream (set): The server's set of connected streams.
+
+    Returns: None
+    """
+    client, _ = listener.accept()
+    link = Peer(client)
+    link.post(NODE, node, 0)
+    server_stream.add(link)
+
+def fresh(origin, number):
+    """
+    Records an event and tells whether it is seen for the first time.
+
+    Args:
+        origin (str): The name of the node the event started on.
+        number (int): The event's sequence number on that node.
+
+    Returns:
+        bool: True the first time an event is seen.
+    """
+    key = (origin, number)
+    if key in seen:
+        return False
+    seen.add(key)
+    history.append(key)
+    if len(history) > settings.FEDERATION_SEEN_EVENTS:
+        seen.discard(history.popleft())
+    return True
+
+def flood(message, source=None):
+    """
+    Sends an event to every linked node except the one it came from.
+
+    Args:
+        message (tuple): The event.
+        source (Peer): The link the event arrived on, None for local events.
+
+    Returns: None
+    """
+    for link in peers.values():
+        if link is not source:
+            link.post(*message)
+
+def originate(verb, *fields):
+    """
+    Floods a new event starting on this node.
+
+    Args:
+        verb (str): The event verb.
+        fields (tuple): The event's fields.
+
+    Returns: None
+    """
+    if peers:
+        message = (verb, node, next(sequence)) + fields
+        fresh(node, message[2])
+        flood(message)
+
+def add_route(room, link):
+    """
+    Counts one more member of a room behind a link.
+
+    Args:
+        room (str): The room name.
+        link (Peer): The link.
+
+    Returns: None
+    """
+    routes.setdefault(room, {})
+    routes[room][link] = routes[room].get(link, 0) + 1
+
+def drop_route(room, link):
+    """
+    Counts one member of a room less behind a link, dropping the route with the last one.
+
+    Args:
+        room (str): The room name.
+        link (Peer): The link.
+
+    Returns: None
+    """
+    members = routes.get(room)
+    if members is None or link not in members:
+        return
+    members[link] -= 1
+    if members[link] == 0:
+        del members[link]
+        if not members:
+            del routes[room]
+
+def user_added(name):
+    """
+    Tells the network that a user signed in on this node.
+
+    Args:
+        name (str): The user name.
+
+    Returns: None
+    """
+    originate(NICK, name)
+
+def user_quit(name):
+    """
+    Tells the network that a user signed in on this node disconnected.
+
+    Args:
+        name (str): The user name.
+
+    Returns: None
+    """
+    originate(QUIT, name)
+
+def room_added(name):
+    """
+    Tells the network that a room was created on this node.
+
+    Args:
+        name (str): The room name.
+
+    Returns: None
+    """
+    originate(RMAD, name)
+
+def member_joined(room, name):
+    """
+    Tells the network that a user signed in on this node joined a room.
+
+    Args:
+        room (str): The room name.
+        name (str): The user name.
+
+    Returns: None
+    """
+    originate(JOIN, room, name)
+
+def member_left(room, name):
+    """
+    Tells the network that a user signed in on this node left a room.
+
+    Args:
+        room (str): The room name.
+        name (str): The user name.
+
+    Returns: None
+    """
+    originate(LEVE, room, name)
+
+def relay(room, name, message, source=None, origin=None, number=None):
+    """
+    Sends a room message to the linked nodes with members of the room behind them, at most once
+    per link and never back over the link it came from.
+
+    Args:
+        room (str): The room name.
+        name (str): The sender's name.
+        message (bytes): The message.
+        source (Peer): The link the message arrived on, None for local messages.
+        origin (str): The node the message started on, this node when None.
+        number (int): The message's sequence number on its origin node.
+
+    Returns: None
+    """
+    links = routes.get(room)
+    if not links:
+        return
+    if origin is None:
+        origin, number = node, next(sequence)
+        fresh(origin, number)
+    for link in links:
+        if link is not source:
+            link.post(RMSG, origin, number, room, name, message)
+
+def private(sender, name, message, link):
+    """
+    Sends a private message toward the node a user is signed in on, over the link the user is behind.
+
+    Args:
+        sender (str): The sender's name.
+        name (str): The receiving user's name.
+        message (bytes): The message.
+        link (Peer): The link the user is behind.
+
+    Returns: None
+    """
+    number = next(sequence)
+    fresh(node, number)
+    link.post(PMSG, node, number, sender, name, message)
+
+def remote_user(name, link):
+    """
+    Looks up the stand-in client of a user signed in behind a link.
+
+    Args:
+        name (str): The user name.
+        link (Peer): The link the user is behind.
+
+    Returns:
+        Client: The stand-in client, or None.
+    """
+    _client = manager.registry.find(name)
+    if _client is not None and isinstance(_client.connection, RemoteUser) and _client.connection.link is link:
+        return _client
+    return None
+
+def remove_user(_client):
+    """
+    Removes the stand-in client of a remote user from the registry and from the routing table.
+
+    Args:
+        _client (Client): The stand-in client.
+
+    Returns: None
+    """
+    for room in _client.rooms:
+        drop_route(room.name, _client.connection.link)
+    manager.registry.remove_client(_client.connection)
+
+def burst(link):
+    """
+    Sends the whole network state known to this node to a newly linked node: rooms, users and
+    room memberships, leaving out users behind the new link itself.
+
+    Args:
+        link (Peer): The new link.
+
+    Returns: None
+    """
+    def post(verb, *fields):
+        number = next(sequence)
+        fresh(node, number)
+        link.post(verb, node, number, *fields)
+
+    for name in manager.rooms:
+        post(RMAD, name)
+    for _client in manager.clients.values():
+        if not (isinstance(_client.connection, RemoteUser) and _client.connection.link is link):
+            post(NICK, _client.name)
+    for room in manager.rooms.values():
+        for member in room.members:
+            if not (isinstance(member.connection, RemoteUser) and member.connection.link is link):
+                post(JOIN, room.name, member.name)
+
+def opener(link):
+    """
+    Returns the name of the node that opened a link.
+
+    Args:
+        link (Peer): The link, its peer known.
+
+    Returns:
+        str: The node name.
+    """
+    return node if link.address is not None else link.peer
+
+def split(link):
+    """
+    Forgets the users behind a lost link, tells the other nodes they quit, and schedules a
+    reconnection if the link was opened by this node. A link opened by this node to a node that
+    is still linked otherwise, or to this node itself, is not reopened until that other link is lost.
+
+    Args:
+        link (Peer): The lost link.
+
+    Returns: None
+    """
+    if peers.get(link.peer) is link:
+        del peers[link.peer]
+        address = parked.pop(link.peer, None)
+        if address is not None:
+            unlinked[address] = time.monotonic() + settings.PEER_RETRY_INTERVAL
+    lost = [_client for _client in manager.clients.values()
+            if isinstance(_client.connection, RemoteUser) and _client.connection.link is link]
+    for _client in lost:
+        remove_user(_client)
+        user_quit(_client.name)
+    if link.address is not None:
+        if link.peer in peers or link.peer == node:
+            parked[link.peer] = link.address
+        else:
+            unlinked[link.address] = time.monotonic() + settings.PEER_RETRY_INTERVAL
+
+def receive(link, message):
+    """
+    Applies an event received from another node and passes it on. Of two links between the
+    same nodes, which both nodes open when each lists the other as a peer, both ends keep the one
+    opened by the node whose name sorts first.
+
+    Args:
+        link (Peer): The link the event arrived on.
+        message (tuple): The event verb, origin node, sequence number and fields.
+
+    Returns: None
+    """
+    verb, origin, number = message[0], message[1], message[2]
+    if verb == NODE:
+        current = peers.get(origin)
+        link.peer = origin
+        if origin == node or current is not None and opener(link) >= opener(current):
+            link.flush()
+            link.close()
+            return
+        peers[origin] = link
+        if current is not None:
+            current.close()
+        burst(link)
+        return
+
+    if link.peer is None or not fresh(origin, number):
+        return
+
+    registry = manager.registry
+    if verb == PMSG:
+        sender, name, text = message[3], message[4], message[5]
+        if not manager.deliver_private(sender, name, text):
+            _client = registry.find(name)
+            if _client is not None and isinstance(_client.connection, RemoteUser) and _client.connection.link is not link:
+                _client.connection.link.post(*message)
+        return
+
+    if verb == RMSG:
+        room_name, name, text = message[3], message[4], message[5]
+        room = registry.room(room_name)
+        if room is not None:
+            manager.publish(room, name, text)
+        relay(room_name, name, text, link, origin, number)
+        return
+
+    if verb == NICK:
+        if registry.find(message[3]) is None:
+            registry.add_client(message[3], RemoteUser(link))
+    elif verb == QUIT:
+        _client = remote_user(message[3], link)
+        if _client is not None:
+            remove_user(_client)
+    elif verb == RMAD:
+        registry.add_room(message[3])
+    elif verb == JOIN:
+        room = registry.room(message[3])
+        _client = remote_user(message[4], link)
+        if room is not None and _client is not None and _client not in room.members:
+            manager.presence(room, joined=1, member=_client)
+            registry.join(_client, room)
+            add_route(room.name, link)
+    elif verb == LEVE:
+        room = registry.room(message[3])
+        _client = remote_user(message[4], link)
+        if room is not None and _client is not None and registry.leave(_client, room):
+            drop_route(room.name, link)
+            manager.presence(room, left=1)
+    flood(message, link)
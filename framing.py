@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import struct
+
+import settings
+
+HEADER = struct.Struct("!I") # length prefix of a frame in length-prefixed mode
+
+class FrameTooLarge(Exception):
+    """
+    Raised when a peer sends a frame longer than the decoder's maximum frame size.
+    """
+
+class FrameDecoder:
+    """
+    Incremental decoder splitting a byte stream into frames, either newline terminated or
+    prefixed with their length. Data is received straight into the decoder's buffer and frames
+    are handed out as memoryview slices of it, so a read yields zero or more complete frames
+    without copying them. The buffer starts small and grows up to the maximum frame size only
+    while a long frame is being received.
+    """
+
+    def __init__(self, delimiter=None, max_frame=None):
+        """
+        Args:
+            delimiter (settings.delimiter): How frames are delimited, settings.FRAME_DELIMITER when None.
+            max_frame (int): The maximum frame size in bytes, settings.MAX_FRAME_SIZE when None.
+        """
+        self.delimiter = settings.FRAME_DELIMITER if delimiter is None else delimiter
+        self.max_frame = settings.MAX_FRAME_SIZE if max_frame is None else max_frame
+        self.buffer    = bytearray(settings.RECEIVE_BUFFER_SIZE)
+        self.start     = 0 # first byte of the frame being received
+        self.end       = 0 # end of the received data
+        self.scan      = 0 # where to resume looking for a newline
+
+    def writable(self):
+        """
+        Returns the free space at the end of the buffer, to be filled with recv_into and then committed.
+
+        Args: None
+
+        Returns:
+            memoryview: A writable view of the free space.
+        """
+        if self.end == len(self.buffer):
+            self.make_room()
+        return memoryview(self.buffer)[self.end:]
+
+    def commit(self, size):
+        """
+        Marks size bytes written into the view returned by writable as received.
+
+        Args:
+            size (int): The number of bytes received.
+
+        Returns: None
+        """
+        self.end += size
+
+    def unread(self):
+        """
+        Returns the received data not handed out as frames yet, the start of a frame still arriving.
+
+        Args: None
+
+        Returns:
+            bytes: The data.
+        """
+        return bytes(self.buffer[self.start:self.end])
+
+    def feed(self, data):
+        """
+        Copies received data into the buffer and yields the frames it completes.
+
+        Args:
+            data (bytes): The data received.
+
+        Yields:
+            memoryview: Each complete frame, valid until the next call into the decoder.
+        """
+        data = memoryview(data)
+        while data:
+            free = self.writable()
+            size = min(len(free), len(data))
+            free[:size] = data[:size]
+            self.commit(size)
+            data = data[size:]
+            yield from self.frames()
+
+    def frames(self):
+        """
+        Yields the complete frames in the buffer.
+
+        Args: None
+
+        Yields:
+            memoryview: Each complete frame, valid until the next call into the decoder.
+
+        Raises:
+            FrameTooLarge: If a frame is longer than the maximum frame size.
+        """
+        view = memoryview(self.buffer)
+        if self.delimiter is settings.delimiter.NEWLINE:
+            while True:
+                index = self.buffer.find(b"\n", self.scan, self.end)
+                if index < 0:
+                    self.scan = self.end
+                    if self.end - self.start > self.max_frame:
+                        raise FrameTooLarge()
+                    break
+                if index - self.start > self.max_frame:
+                    raise FrameTooLarge()
+                frame_end = index - 1 if index > self.start and self.buffer[index - 1] == 13 else index
+                frame = view[self.start:frame_end]
+                self.start = self.scan = index + 1
+                yield frame
+        else:
+            while self.end - self.start >= HEADER.size:
+                (size,) = HEADER.unpack_from(self.buffer, self.start)
+                if size > self.max_frame:
+                    raise FrameTooLarge()
+                frame_start = self.start + HEADER.size
+                if self.end - frame_start < size:
+                    break
+                frame = view[frame_start:frame_start + size]
+                self.start = self.scan = frame_start + size
+                yield frame
+
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+            if len(self.buffer) > settings.RECEIVE_BUFFER_SIZE:
+                self.buffer = bytearray(settings.RECEIVE_BUFFER_SIZE)
+
+    def make_room(self):
+        """
+        Moves the partly received frame to the front of the buffer, growing the buffer when the
+        frame fills more than half of it.
+
+        Args: None
+
+        Returns: None
+        """
+        size = self.end - self.start
+        capacity = len(self.buffer)
+        if size * 2 > capacity:
+            capacity = min(capacity * 2, self.max_frame + HEADER.size + 2)
+        if capacity != len(self.buffer):
+            buffer = bytearray(capacity)
+            buffer[:size] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+        else:
+            self.buffer[:size] = self.buffer[self.start:self.end]
+        self.scan -= self.start
+        self.start = 0
+        self.end = size
+
+def encode_frame(data):
+    """
+    Prefixes data with its length for peers reading length-prefixed frames.
+
+    Args:
+        data (bytes): The frame payload.
+
+    Returns:
+        bytes: The length-prefixed frame.
+    """
+    return HEADER.pack(len(data)) + data
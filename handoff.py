@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import marshal
+import socket
+import struct
+
+import settings
+import strings
+import manager
+import connection
+import compression
+import metrics
+import terminal
+
+VERSION = 2                    # snapshot format
+HEADER  = struct.Struct("!II") # number of descriptor messages and snapshot size, in front of the snapshot
+FDS     = 250                  # descriptors passed per message, below the kernel's SCM_MAX_FD of 253
+
+log = logging.getLogger(__name__)
+
+def open_endpoint(path):
+    """
+    Starts listening on the Unix-domain socket a successor connects to to take the server over.
+
+    Args:
+        path (str): The socket path.
+
+    Returns:
+        socket.socket: The listening socket.
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(metrics.endpoint_path(path))
+    listener.listen(1)
+    return listener
+
+def capture(clients):
+    """
+    Marshals what a successor needs to serve the clients as if nothing happened: the rooms with
+    their histories, acknowledgements and pending presence changes, the names of the users that
+    signed out recently, and for every client its user, rooms, patterns, compression, the part
+    of a command it has not finished sending, the data still queued for it and its open batch.
+
+    Args:
+        clients (list): The client connections handed over, in the order of their descriptors.
+
+    Returns:
+        bytes: The marshalled state.
+    """
+    registry = manager.registry
+    rooms = [(room.name, room.history.last_id(), room.history.since(0), room.acks, room.arrivals, room.departures,
+              [(member.name, missed) for member, missed in room.newcomers.items()])
+             for room in registry.rooms.values()]
+    states = []
+    for client in clients:
+        _client = registry.client(client)
+        states.append((
+            _client.name if _client else None,
+            [room.name for room in _client.rooms] if _client else [],
+            list(_client.patterns) if _client else [],
+            client.compression.name if client.compression else None,
+            client.decoder.unread(),
+            b"".join(client.outbound),
+            client.batch,
+            client.held,
+        ))
+    return marshal.dumps((VERSION, rooms, list(registry.departed), states))
+
+def restore(state, sockets):
+    """
+    Loads a state captured by the predecessor into the registry, and wraps the client sockets
+    in connections carrying on where the predecessor stopped.
+
+    Args:
+        state (bytes): The marshalled state.
+        sockets (list): The client sockets, in the order of the captured clients.
+
+    Returns:
+        list: The client connections.
+    """
+    version, rooms, departed, states = marshal.loads(state)
+    if version != VERSION:
+        raise ValueError(f"unsupported handoff version {version}")
+    registry = manager.registry
+    for name, last_id, messages, acks, _, _, _ in rooms:
+        room = registry.add_room(name)
+        room.history.skip(last_id - len(messages))
+        for message_id, data in messages:
+            room.history.add(data, message_id)
+        room.history.skip(last_id)
+        room.acks.update(acks)
+    registry.departed.update(dict.fromkeys(departed))
+
+    clients = []
+    for (name, joined, patterns, context, unread, outbound, batch, held), client in zip(states, sockets):
+        client = connection.SocketConnection(client)
+        client.compression = compression.negotiate(context) if context else None
+        client.batch = batch
+        client.batched = sum(map(len, batch)) if batch else 0
+        client.held = held
+        if outbound:
+            client.queue(outbound)
+        if name is not None:
+            _client = registry.add_client(name, client)
+            for room_name in joined:
+                registry.join(_client, registry.room(room_name))
+            for pattern in patterns:
+                registry.subscribe(_client, pattern)
+        for frame in client.decoder.feed(unread):
+            terminal.execute_frame(frame, client)
+        clients.append(client)
+    manager.total_clients = len(clients)
+    for name, _, _, _, arrivals, departures, newcomers in rooms:
+        if arrivals or departures:
+            room = registry.room(name)
+            manager.presence(room, arrivals, departures)
+            room.newcomers.update((registry.find(member), missed) for member, missed in newcomers)
+    return clients
+
+def hand_off(listener, server, server_stream):
+    """
+    Hands the server over to a successor connecting to the handoff socket: passes it the
+    listening socket and the descriptors of the client sockets with SCM_RIGHTS, followed by the
+    captured state. The sockets stay open in the successor, so clients see no disconnect, and
+    what they send meanwhile waits in the kernel for the successor to read it. Consoles of the
+    admin socket are not handed over.
+
+    Args:
+        listener (socket.socket): The listening socket returned by open_endpoint.
+        server (socket.socket): The listening socket of the chat server.
+        server_stream (ServerStream): The inputs of the server loop.
+
+    Returns:
+        socket.socket: The connection to the successor, to be closed once this server has
+                       released its files, or None if the handoff failed.
+    """
+    successor, _ = listener.accept()
+    # searches still scanning are finished here, their results go out with the queued output
+    manager.continue_searches(0)
+    clients = [input for input in server_stream if type(input) is connection.SocketConnection and not input.closed]
+    fds = [server.fileno()] + [client.fileno() for client in clients]
+    state = capture(clients)
+    batches = [fds[index:index + FDS] for index in range(0, len(fds), FDS)]
+    try:
+        successor.settimeout(settings.HANDOFF_TIMEOUT)
+        successor.sendall(HEADER.pack(len(batches), len(state)))
+        for batch in batches:
+            socket.send_fds(successor, [b"\0"], batch)
+        successor.sendall(state)
+    except OSError:
+        log.warning(strings.HANDOFF_FAILED)
+        successor.close()
+        return None
+    log.info('%s %s', strings.HANDED_OFF, len(clients))
+    return successor
+
+def take_over(path):
+    """
+    Connects to the handoff socket of a running server and takes it over, restoring its state and
+    its client connections. Waits until the predecessor has released its files, such as the data
+    directory, the archive and its Unix-domain sockets, before returning.
+
+    Args:
+        path (str): The predecessor's handoff socket path.
+
+    Returns:
+        tuple: The listening socket, and the list of client connections.
+
+    Raises:
+        OSError: If the predecessor can not be reached or hangs up before the handoff is complete.
+    """
+    predecessor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    predecessor.settimeout(settings.HANDOFF_TIMEOUT)
+    predecessor.connect(path)
+    data = bytearray()
+    fds = []
+    size = None
+    while size is None or len(data) < size:
+        received, descriptors, _, _ = socket.recv_fds(predecessor, 1 << 16, FDS)
+        if not received:
+            raise ConnectionError(strings.HANDOFF_FAILED)
+        data += received
+        fds += descriptors
+        if size is None and len(data) >= HEADER.size:
+            batches, length = HEADER.unpack_from(data)
+            size = HEADER.size + batches + length
+    # the predecessor closes the connection once its files are released, which takes as long as
+    # its log and archive take to be written out, so this wait has no timeout
+    predecessor.settimeout(None)
+    while predecessor.recv(1):
+        pass
+    predecessor.close()
+    server = socket.socket(fileno=fds[0])
+    clients = restore(bytes(data[HEADER.size + batches:]), [socket.socket(fileno=fd) for fd in fds[1:]])
+    log.info('%s %s', strings.TOOK_OVER, len(clients))
+    return server, clients
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import array
+
+import settings
+
+class History:
+    """
+    The recent messages of a room in a ring buffer bounded by message count and by bytes. Message
+    bytes are kept back to back in one preallocated bytearray, with their offsets and sizes in two
+    preallocated arrays, so a room's history costs the same memory however many messages went
+    through it. Every message gets the next id of the room; the ids of the kept messages are
+    consecutive, so the oldest id and the count locate any of them. The buffers are allocated with
+    the room's first message.
+    """
+    __slots__ = ("messages", "size", "buffer", "offsets", "sizes", "first", "oldest", "count", "head", "used")
+
+    def __init__(self, messages=None, size=None):
+        """
+        Args:
+            messages (int): The number of messages kept, settings.HISTORY_MESSAGES when None.
+            size (int): The number of message bytes kept, settings.HISTORY_BYTES when None.
+        """
+        self.messages = settings.HISTORY_MESSAGES if messages is None else messages
+        self.size     = settings.HISTORY_BYTES if size is None else size
+        self.buffer   = None
+        self.offsets  = None
+        self.sizes    = None
+        self.first    = 0 # slot of the oldest kept message
+        self.oldest   = 1 # id of the oldest kept message
+        self.count    = 0 # number of kept messages
+        self.head     = 0 # offset the next message is written at
+        self.used     = 0 # number of bytes kept
+
+    def last_id(self):
+        """
+        Returns the id of the latest message.
+
+        Args: None
+
+        Returns:
+            int: The id, 0 before the first message.
+        """
+        return self.oldest + self.count - 1
+
+    def skip(self, message_id):
+        """
+        Moves the ids on so the next message gets an id above message_id, dropping the kept
+        messages if that leaves a gap. Used to restore a history saved to disk.
+
+        Args:
+            message_id (int): The id the latest message should have.
+
+        Returns: None
+        """
+        if message_id > self.last_id():
+            self.oldest = message_id + 1
+            self.first = self.count = self.head = self.used = 0
+
+    def add(self, data, message_id=None):
+        """
+        Keeps a message, dropping the oldest ones to make room for it. A message larger than the
+        whole buffer gets its id but is not kept, and drops everything kept before it.
+
+        Args:
+            data (bytes): The message.
+            message_id (int): The id to keep the message under when restoring a saved history,
+                              the room's next id when None.
+
+        Returns:
+            int: The message id.
+        """
+        if message_id is not None:
+            if message_id <= self.last_id():
+                return message_id
+            self.skip(message_id - 1)
+        size = len(data)
+        if self.buffer is None:
+            self.buffer  = bytearray(self.size)
+            self.offsets = array.array("L", bytes(self.messages * array.array("L").itemsize))
+            self.sizes   = array.array("L", bytes(self.messages * array.array("L").itemsize))
+
+        if size > self.size or not self.messages:
+            self.oldest += self.count + 1
+            self.first = self.count = self.head = self.used = 0
+            return self.oldest - 1
+
+        while self.count == self.messages or self.used + size > self.size:
+            self.used -= self.sizes[self.first]
+            self.first = (self.first + 1) % self.messages
+            self.oldest += 1
+            self.count -= 1
+
+        start = self.head
+        end = start + size
+        if end <= self.size:
+            self.buffer[start:end] = data
+        else:
+            split = self.size - start
+            self.buffer[start:] = data[:split]
+            self.buffer[:size - split] = data[split:]
+        slot = (self.first + self.count) % self.messages
+        self.offsets[slot] = start
+        self.sizes[slot] = size
+        self.head = end % self.size
+        self.used += size
+        self.count += 1
+        return self.oldest + self.count - 1
+
+    def resize(self, messages, size):
+        """
+        Changes the bounds of the history, keeping the latest messages that fit the new ones.
+        Ids are kept: the next message gets the id it would have had.
+
+        Args:
+            messages (int): The number of messages kept.
+            size (int): The number of message bytes kept.
+
+        Returns: None
+        """
+        kept = []
+        used = 0
+        for _, data in reversed(self.since(0)):
+            if len(kept) == messages or used + len(data) > size:
+                break
+            kept.append(data)
+            used += len(data)
+        self.oldest   = self.last_id() + 1 - len(kept)
+        self.messages = messages
+        self.size     = size
+        self.buffer   = self.offsets = self.sizes = None
+        self.first    = self.count = self.head = self.used = 0
+        for data in reversed(kept):
+            self.add(data)
+
+    def get(self, index):
+        """
+        Returns a kept message.
+
+        Args:
+            index (int): The message's position among the kept messages, 0 for the oldest.
+
+        Returns:
+            bytes: The message.
+        """
+        slot = (self.first + index) % self.messages
+        start = self.offsets[slot]
+        end = start + self.sizes[slot]
+        if end <= self.size:
+            return bytes(self.buffer[start:end])
+        return bytes(self.buffer[start:]) + bytes(self.buffer[:end - self.size])
+
+    def since(self, message_id):
+        """
+        Returns the kept messages newer than a message.
+
+        Args:
+            message_id (int): The id of the last message already seen.
+
+        Returns:
+            list: (id, message) pairs, oldest first.
+        """
+        start = max(message_id + 1 - self.oldest, 0)
+        return [(self.oldest + index, self.get(index)) for index in range(start, self.count)]
+
+    def latest(self, count):
+        """
+        Returns the most recent kept messages.
+
+        Args:
+            count (int): The number of messages.
+
+        Returns:
+            list: (id, message) pairs, oldest first.
+        """
+        return self.since(self.last_id() - max(count, 0))
@@ -1,33 +1,66 @@
+import collections
+import datetime
+import itertools
+import logging
+import time
 import settings
 import strings
 import sys
-import terminal
-
-clients       = {}
-rooms         = {}
+import cluster
+import federation
+import metrics
+import persistence
+import archive
+import ratelimit
+import compression
+import timers
+import tracing
+from registry import Registry
+
+registry      = Registry()
+clients       = registry.clients
+rooms         = registry.rooms
 total_clients = 0
 username      = strings.DEFAULT_USERNAME
+decoder       = None # compression.Decoder of client.py once the server accepted compression
+searches      = collections.deque() # (client connection, archive.Search) of the SRCH commands still scanning
+log           = logging.getLogger(__name__)
+
+metrics.gauge("chat_connected_clients", "Client connections being served.", lambda: total_clients)
+metrics.gauge("chat_rooms", "Rooms known to this server.", lambda: len(rooms))
+metrics.gauge("chat_subscriptions", "Room name pattern subscriptions.", lambda: registry.subscriptions.count)
 
-def welcome(client):
+def welcome(client, compress=False):
     """Prompts the user to input their name, sends it to the server as a 'USER' command, and waits for a welcome message
-    from the server before displaying it. If the welcome message indicates success, returns and prints the user's name as
-    a prompt for further input.
+    from the server before displaying it. Returns once the welcome message indicates success.
+    When asked to, requests compression; if the server accepts it, its answers arrive as
+    compression frames from the welcome message on, and `decoder` is set to unpack them.
 
     Args:
     - client: a socket representing the client's connection to the server.
+    - compress: whether to ask the server to compress what it sends.
 
     Returns: None
     """
     complete = 0
-    global username
+    global username, decoder
     while not complete:
         print(strings.YOUR_NAME, end='', flush=True)
         username = sys.stdin.readline().rstrip()
-        send_data = strings.USER + username
+        send_data = strings.USER + " " + username + (" " + strings.ZLIB if compress else "") + strings.NEW_LINE
         client.send(send_data.encode(settings.SUPPORTED_TEXT_TYPE))
 
         try:
-            response = client.recv(settings.INPUT_SIZE).decode(settings.SUPPORTED_TEXT_TYPE).rstrip()
+            response = client.recv(settings.INPUT_SIZE)
+            if compress and compression.framed(response):
+                decoder = compression.Decoder()
+                response = decoder.feed(response)
+                while not response:
+                    data = client.recv(settings.INPUT_SIZE)
+                    if not data:
+                        raise ConnectionError
+                    response = decoder.feed(data)
+            response = response.decode(settings.SUPPORTED_TEXT_TYPE).rstrip()
         except:
             sys.exit(strings.DISCONNECTED_FROM_SERVER)
 
@@ -35,7 +68,6 @@ def welcome(client):
 
         if (response[0:2] == strings.WELCOME_CLIENT[0:2]):
             complete = 1
-    terminal.direct(username)
 
 def disconnect(server_stream, client):
     """
@@ -43,25 +75,25 @@ def disconnect(server_stream, client):
     updating the server state. 
 
     Args:
-        server_stream (socket.socket): The server's socket stream.
+        server_stream (set): The server's set of connected streams.
         client (socket.socket): The client's socket stream to be disconnected.
 
     Returns:
         None
     """
-    global total_clients,clients
-
-    try:
-        
-        print(strings.CLIENT_DISCONNECT)
-        _rooms = clients[client][strings.ROOMS]
-        for room in _rooms:
-            rooms[room][strings.CLIENTS].remove(clients[client])
-        clients.pop(client)
+    global total_clients
 
-    except:
-        print(strings.CLIENT_DISCONNECT_ERR)
+    if client not in server_stream:
+        return
 
+    log.info(strings.CLIENT_DISCONNECT)
+    _client = registry.remove_client(client)
+    if _client is None:
+        log.info(strings.CLIENT_DISCONNECT_ERR)
+    elif cluster.workers > 1:
+        cluster.client_quit(_client.name)
+    else:
+        federation.user_quit(_client.name)
 
     client.close()
     server_stream.remove(client)
@@ -69,35 +101,71 @@ def disconnect(server_stream, client):
 
 def create_user(name, client):
     """
-    Creates a new user with the given name and adds them to the clients list.
+    Creates a new user with the given name and adds them to the clients list. When the server
+    persists its state, the user rejoins the rooms it was a member of when it last left. A
+    compression capability named after the user name, as in USER name ZLIB, is switched on
+    before the welcome message, which is then the first compressed frame.
 
     Args:
-        name (str): The name of the user to create.
+        name (str): The name of the user to create, optionally followed by a compression capability.
         client (socket): The socket object representing the client.
 
     Returns:
         int: 0, indicating the function completed successfully.
 
     """
-    if clients.__contains__(client):
+    if client in clients:
         client.send(strings.CLIENT_ALREADY_IN.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0
 
-    for _client in clients:
-        if clients[_client][strings.NAME] == name:
-            client.send(strings.CLIENT_EXISTS.encode(settings.SUPPORTED_TEXT_TYPE))
-            return 0
-
-    clients[client] = {
-        strings.NAME: name,
-        strings.ROOMS: [],
-        strings.SOCKET: client
-    }
+    name, context = split_capability(name)
+    if registry.add_client(name, client) is None:
+        client.send(strings.CLIENT_EXISTS.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
 
+    federation.user_added(name)
     welcome = strings.WELCOME_CLIENT + strings.HELP_MESSAGE
+    rejoined = rejoin(registry.find(name)) if cluster.workers == 1 else []
+    if rejoined:
+        welcome += strings.ROOMS_REJOINED + ''.join(room + strings.NEW_LINE for room in rejoined)
+    client.compression = context
     client.send(welcome.encode(settings.SUPPORTED_TEXT_TYPE))
     return 0
 
+def split_capability(argument):
+    """
+    Splits the compression capability a client may name after its user name in the USER command.
+
+    Args:
+        argument (str): The argument of the USER command.
+
+    Returns:
+        tuple: The user name, and the compression.Context asked for or None.
+    """
+    name, _, capability = argument.rpartition(" ")
+    context = compression.negotiate(capability) if name else None
+    return (name, context) if context is not None else (argument, None)
+
+def rejoin(member):
+    """
+    Joins a user signing in to the rooms it is a member of according to the saved memberships.
+
+    Args:
+        member (Client): The user signing in.
+
+    Returns:
+        list: The names of the rooms joined.
+    """
+    rejoined = []
+    for name in sorted(persistence.saved_rooms(member.name)):
+        room = registry.room(name)
+        if room is not None and member not in room.members:
+            presence(room, joined=1, member=member)
+            registry.join(member, room)
+            federation.member_joined(name, member.name)
+            rejoined.append(name)
+    return rejoined
+
 def authenticate(client):
     """
     Check if a client is authenticated.
@@ -106,49 +174,183 @@ def authenticate(client):
         client (socket): The client socket object to authenticate.
 
     Returns:
-        bool: True if the client is authenticated, False otherwise.
+        Client: The signed-in client if the client is authenticated, None otherwise.
     """
-    if (client in clients):
-        return True
-    else:
+    _client = registry.client(client)
+    if _client is None:
         client.send(strings.CLIENT_INVALID.encode(settings.SUPPORTED_TEXT_TYPE))
-        return False
+    return _client
+
+def broadcast(receivers, note, sender=None):
+    """
+    Encodes a message once and queues the same immutable frame to every receiver, so the
+    cost of building and encoding it does not grow with the number of receivers. Messages
+    already encoded are queued as they are. Receivers that negotiated compression get the frame
+    compressed once per compression context.
+
+    Args:
+        receivers (iterable): The clients to send the message to.
+        note (str | bytes): The message to send.
+        sender (Client): A client to leave out, usually the author of the message.
+
+    Returns:
+        int: The number of receivers the message was queued to.
+    """
+    frame = memoryview(note if isinstance(note, bytes) else note.encode(settings.SUPPORTED_TEXT_TYPE))
+    count = 0
+    packed = {}
+    for receiver in receivers:
+        if receiver is not sender:
+            context = receiver.connection.compression
+            if context is None or receiver.connection.held is not None:
+                receiver.connection.send(frame)
+            else:
+                if context not in packed:
+                    packed[context] = memoryview(context.encode(frame))
+                receiver.connection.queue(packed[context])
+            count += 1
+    metrics.fan_out_sizes.observe(count)
+    return count
+
+def presence(room, joined=0, left=0, member=None):
+    """
+    Notes members joining or leaving a room and announces it to the members. Changes within
+    settings.PRESENCE_WINDOW seconds are coalesced into one notice, so a burst of joins, such as
+    users rejoining after a restart, costs one broadcast per window rather than one per join.
+    A lone join or leave is announced as before; several as one "N joined, M left" notice.
+    A member that joined within the window is told only of the changes after its own join.
+    Rooms with more than settings.PRESENCE_LIMIT members are not told at all.
 
-def validate(name):
+    Args:
+        room (Room): The room.
+        joined (int): The number of members that joined.
+        left (int): The number of members that left.
+        member (Client): The member that joined, when joined is 1.
+
+    Returns: None
+    """
+    if settings.PRESENCE_LIMIT is not None and len(room.members) > settings.PRESENCE_LIMIT:
+        return
+    if member is not None and settings.PRESENCE_WINDOW:
+        room.newcomers[member] = (room.arrivals, room.departures)
+    room.arrivals += joined
+    room.departures += left
+    if not settings.PRESENCE_WINDOW:
+        announce(room)
+    elif room.notice is None:
+        room.notice = timers.schedule(settings.PRESENCE_WINDOW, lambda: announce(room))
+
+def announce(room):
+    """
+    Broadcasts the presence changes of a room noted since its last notice. The members that
+    joined meanwhile are told apart, grouped by the changes they missed before joining.
+
+    Args:
+        room (Room): The room.
+
+    Returns: None
+    """
+    joined, left = room.arrivals, room.departures
+    newcomers = room.newcomers
+    room.arrivals = room.departures = 0
+    room.newcomers = {}
+    room.notice = None
+    if not newcomers:
+        notify(room, room.members, joined, left)
+        return
+    notify(room, room.members.difference(newcomers), joined, left)
+    groups = {}
+    for member, missed in newcomers.items():
+        groups.setdefault(missed, []).append(member)
+    for (arrivals, departures), members in groups.items():
+        notify(room, members, joined - arrivals - 1, left - departures)
+
+def notify(room, receivers, joined, left):
+    """
+    Broadcasts one presence notice of a room.
+
+    Args:
+        room (Room): The room.
+        receivers (iterable): The members to tell.
+        joined (int): The number of members that joined.
+        left (int): The number of members that left.
+
+    Returns: None
+    """
+    if (joined, left) == (1, 0):
+        broadcast(receivers, strings.NEW_MEMBER_JOINED)
+    elif (joined, left) == (0, 1):
+        broadcast(receivers, strings.MEMBER_LEFT)
+    elif joined or left:
+        broadcast(receivers, f"{strings.PRESENCE_CHANGES}{room.name}: {joined}{strings.PRESENCE_JOINED}{left}{strings.PRESENCE_LEFT}")
+
+def publish(room, name, message, sender=None, receivers=None):
     """
-    Validates the given name to ensure that it is not empty and does not contain any whitespace.
+    Keeps a message in the room's history under the room's next message id and broadcasts it to
+    the members of the room and the clients subscribing to it through a pattern.
 
     Args:
-        name (str): The name to validate.
+        room (Room): The room.
+        name (str): The author's name.
+        message (bytes | str): The message.
+        sender (Client): A client to leave out, usually the author of the message.
+        receivers (iterable): The clients to broadcast to, the members and subscribers of the room when None.
 
     Returns:
-        bool: True if the name is valid, False otherwise.
+        int: The message id.
     """
-    return (len(str.split(name,' ')) > 1 or len(name) == 0)
-       
-def transmit(rooms,note):
+    if isinstance(message, str):
+        message = message.encode(settings.SUPPORTED_TEXT_TYPE)
+    record = b"%s@%s: %s" % (name.encode(settings.SUPPORTED_TEXT_TYPE), room.name.encode(settings.SUPPORTED_TEXT_TYPE), message)
+    message_id = room.history.add(record)
+    persistence.message_added(registry, room.name, message_id, record)
+    archive.message_added(room.name, message_id, time.time_ns(), record)
+    if receivers is None:
+        receivers = room.members
+        subscribers = registry.subscribers(room)
+        if subscribers:
+            receivers = itertools.chain(receivers, [subscriber for subscriber in subscribers if subscriber not in room.members])
+    trace = tracing.current
+    if trace is None:
+        broadcast(receivers, b"\n#%d " % message_id + record, sender)
+    else:
+        receivers = [receiver for receiver in receivers if receiver is not sender]
+        broadcast(receivers, b"\n#%d " % message_id + record)
+        trace.fanned_out(room.name, message_id, name, receivers)
+    return message_id
+
+def replay(messages):
+    """
+    Renders history messages, one per line with its id.
+
+    Args:
+        messages (list): (id, message) pairs returned by the room history.
+
+    Returns:
+        bytes: The rendered messages.
+    """
+    return b"".join(b"#%d %s\n" % message for message in messages)
+
+def transmit(names, note):
     """
     Sends a message to all clients in the specified rooms, or to all clients if no rooms are specified.
 
     Args:
-        rooms (list): A list of room names to send the message to.
+        names (list): A list of room names to send the message to.
         note (str): The message to send.
 
     Returns:
         None.
     """
-    if len(rooms) == 0:
-        for client in clients:
-            clients[client][strings.SOCKET].send(note.encode(settings.SUPPORTED_TEXT_TYPE))
+    if len(names) == 0:
+        broadcast(clients.values(), note)
         return 0
 
-    while len(rooms) > 0:
-        name = rooms.pop(0)
-        if rooms.__contains__(name):
-            _clients = rooms[name][strings.CLIENTS]
-            for client in _clients:
-                client[strings.SOCKET].send(note.encode(settings.SUPPORTED_TEXT_TYPE))   
-                
+    for name in names:
+        room = registry.room(name)
+        if room is not None:
+            broadcast(room.members, note)
+
 def list_rooms(argument, client):
     """
     Sends a list of available chat rooms to the client.
@@ -166,19 +368,21 @@ def list_rooms(argument, client):
     send_string = ''
     if len(rooms) > 0:
         send_string += strings.ROOMS_AVAILABLE_TITLE
-        for room in rooms:
-            send_string += rooms[room][strings.NAME] + strings.NEW_LINE
+        send_string += ''.join(name + strings.NEW_LINE for name in rooms)
     else:
         send_string += strings.NO_ROOMS_TITLE  
     client.send(send_string.encode(settings.SUPPORTED_TEXT_TYPE))
     return 0
 
-def list_members(argument, client):
+def list_members(arguments, client):
     """
-    Lists members in a particular chat room.
+    Lists members in a particular chat room, settings.MEMBERS_PAGE of them at a time, so a large
+    room is never rendered into one giant answer. When more members follow, the answer ends with
+    the LIME command listing the next page. Pages follow the order of the room's member set, so
+    members joining or leaving between two pages can shift the members listed on them.
 
     Args:
-        argument (str): The room name.
+        arguments (tuple): The room name, and the offset of the page as str or None for the first.
         client (socket): The socket object of the client.
 
     Returns:
@@ -186,26 +390,30 @@ def list_members(argument, client):
     """
     if not (authenticate(client)):
         return 0
-        
-    if validate(argument):
-        client.send(strings.INVALID_ROOM_NAME.encode(settings.SUPPORTED_TEXT_TYPE))
-        return 0
 
-    if not rooms.__contains__(argument):
+    name, offset = arguments
+    room = registry.room(name)
+    if room is None:
         client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0
 
-    room_members = rooms[argument][strings.CLIENTS]
+    if offset is not None and not offset.isdigit():
+        client.send(strings.INVALID_MEMBERS_PAGE.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+    start = int(offset) if offset is not None else 0
+
+    page = [member.name for member in itertools.islice(room.members, start, start + settings.MEMBERS_PAGE)]
     send_string = ""
     send_string += strings.ROOM_MEMBERS
-    for member in room_members:
-        send_string += member[strings.NAME] + strings.NEW_LINE
+    send_string += ''.join(member + strings.NEW_LINE for member in page)
+    if start + len(page) < len(room.members):
+        send_string += f"{strings.MORE_MEMBERS}{strings.LIME.lower()} {name} {start + len(page)}"
     client.send(send_string.encode(settings.SUPPORTED_TEXT_TYPE))
     return 0
 
 def create_room(name, client):
     """
-    Create a new chat room with the given name, and add the client to the room's client list.
+    Create a new chat room with the given name.
 
     Args:
         name (str): The name of the room to be created.
@@ -217,19 +425,14 @@ def create_room(name, client):
     if not (authenticate(client)):
         return 0
 
-    if validate(name):
-        client.send(strings.INVALID_ROOM_NAME.encode(settings.SUPPORTED_TEXT_TYPE))
+    if registry.add_room(name) is None:
+        client.send(strings.ROOM_EXISTS.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0
-    
-    for room in rooms:
-        if rooms[room][strings.NAME] == name:
-            client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
-            return 0
 
-    rooms[name] = {
-        strings.NAME    : name,
-        strings.CLIENTS : []
-    }
+    if cluster.workers > 1:
+        cluster.room_added(name)
+    federation.room_added(name)
+    persistence.room_added(registry, name)
 
     send_string = ""
     send_string += strings.ROOM_ADDED
@@ -240,7 +443,8 @@ def join_room(name, client):
     """
     Joins a user to a specified room if the user is authenticated and the room exists.
     If the user is already a member of the room, sends a message indicating so.
-    Sends a message to all members of the room that a new member has joined.
+    Announces the new member to the members of the room through presence, and replays
+    the room's latest settings.HISTORY_REPLAY messages to the new member.
     
     Args:
     - name: string, the name of the room to join.
@@ -250,32 +454,33 @@ def join_room(name, client):
     - 0 if the user was not able to join the room.
     - None otherwise.
     """
-    if not (authenticate(client)):
+    member = authenticate(client)
+    if not member:
         return 0
 
-    if validate(name):
-        client.send(strings.INVALID_ROOM_NAME.encode(settings.SUPPORTED_TEXT_TYPE))
-        return 0
-
-    if not rooms.__contains__(name):
+    room = registry.room(name)
+    if room is None:
         client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0
 
-    room_members = rooms[name][strings.CLIENTS]
-    member = clients[client]
-    if member in room_members:
+    if member in room.members:
         client.send(strings.ALREADY_MEMBER.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0
 
-    transmit([name], strings.NEW_MEMBER_JOINED)
-    room_members.append(member)
-    member[strings.ROOMS].append(name)
-    client.send(strings.MEMBERSHIP_GRANTED.encode(settings.SUPPORTED_TEXT_TYPE))
+    presence(room, joined=1, member=member)
+    registry.join(member, room)
+    federation.member_joined(name, member.name)
+    persistence.member_joined(registry, name, member.name)
+    send_bytes = strings.MEMBERSHIP_GRANTED.encode(settings.SUPPORTED_TEXT_TYPE)
+    messages = room.history.latest(settings.HISTORY_REPLAY)
+    if messages:
+        send_bytes += strings.ROOM_HISTORY.encode(settings.SUPPORTED_TEXT_TYPE) + replay(messages)
+    client.send(send_bytes)
     return 0
 
 def leave_room(name, client):
     """
-    Removes a client from a room and broadcasts to all remaining members that they have left.
+    Removes a client from a room and announces it to the remaining members through presence.
     Args:
         name (str): The name of the room to leave.
         client (socket): The client's socket object.
@@ -283,74 +488,468 @@ def leave_room(name, client):
     Returns:
         int: Always returns 0.
     """
-    if not (authenticate(client)):
-        return 0
-
-    if validate(name):
-        client.send(strings.INVALID_ROOM_NAME.encode(settings.SUPPORTED_TEXT_TYPE))
+    member = authenticate(client)
+    if not member:
         return 0
 
-    if not rooms.__contains__(name):
+    room = registry.room(name)
+    if room is None:
         client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0
 
-    _clients = rooms[name][strings.CLIENTS]
-    _client = clients[client]
-
-    if not (_client in _clients):
+    if not registry.leave(member, room):
         client.send(strings.NOT_MEMBER.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0
 
-    _clients.remove(_client)
-    _client[strings.ROOMS].remove(name)
-    transmit([name], strings.MEMBER_LEFT)
+    presence(room, left=1)
+    federation.member_left(name, member.name)
+    persistence.member_left(registry, name, member.name)
     client.send(strings.YOU_LEFT_ROOM.encode(settings.SUPPORTED_TEXT_TYPE))
     
     return 0
 
+def subscribe(pattern, client):
+    """
+    Subscribes a client to the rooms whose names match a pattern, existing or created later. A
+    subscriber receives the messages sent to the rooms, without being a member: it is not listed
+    as one, is not told about joins and leaves, and can not send to the rooms.
+
+    Args:
+        pattern (str): The pattern, room name segments separated by dots, with * matching one
+                       segment and # any number of them.
+        client (socket): The client's socket object.
+
+    Returns:
+        int: Always returns 0.
+    """
+    _client = authenticate(client)
+    if not _client:
+        return 0
+
+    if not registry.subscribe(_client, pattern):
+        client.send((strings.ALREADY_SUBSCRIBED + pattern).encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    cluster.subscription_changed(_client.name, pattern, True)
+    client.send((strings.SUBSCRIBED + pattern).encode(settings.SUPPORTED_TEXT_TYPE))
+    return 0
+
+def unsubscribe(pattern, client):
+    """
+    Unsubscribes a client from a room name pattern.
+
+    Args:
+        pattern (str): The pattern, as given when subscribing.
+        client (socket): The client's socket object.
+
+    Returns:
+        int: Always returns 0.
+    """
+    _client = authenticate(client)
+    if not _client:
+        return 0
+
+    if not registry.unsubscribe(_client, pattern):
+        client.send((strings.NOT_SUBSCRIBED + pattern).encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    cluster.subscription_changed(_client.name, pattern, False)
+    client.send((strings.UNSUBSCRIBED + pattern).encode(settings.SUPPORTED_TEXT_TYPE))
+    return 0
+
 def send_message(arguments, client):
-    """Sends a message to a specified room and its members.
+    """Sends a message to a specified room and its members, or to several rooms named in a
+    comma separated list. A message costs one token per member of the room, taken from both the
+    sender's and the room's message budgets, and is rejected when either is spent.
 
     Args:
-        arguments (str): A string containing the name of the room and the message to be sent,
-                         separated by a space.
+        arguments (tuple): The name of the room, or the comma separated names of the rooms, and
+                           the message to be sent as bytes.
         client (socket): The socket object representing the client that sent the message.
 
     Returns:
         int: Returns 0 to indicate the function has completed.
 
     """
-    if not (authenticate(client)):
+    _client = authenticate(client)
+    if not _client:
         return 0
 
-    arguments_arr = str.split(arguments, " ",1)
-    
-    if not (len(arguments_arr) == 2 and len(arguments_arr[0]) > 0 and len(arguments_arr[1]) > 0 ):
-        client.send(strings.INVALID_MESSAGE_FORMAT.encode(settings.SUPPORTED_TEXT_TYPE))
-        return 0
-
-    room = arguments_arr[0]
-    message = arguments_arr[1]
+    room_name, message = arguments
+    if "," in room_name:
+        return send_to_rooms(room_name.split(","), message, _client)
 
     # check if room exists
-    if not rooms.__contains__(room):
+    room = registry.room(room_name)
+    if room is None:
         client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0    
 
-    _clients = rooms[room][strings.CLIENTS]
-    _client = clients[client]
-    username = _client[strings.NAME]
-
-    if not (_client in _clients):
+    if not (_client in room.members):
         client.send(strings.NOT_MEMBER.encode(settings.SUPPORTED_TEXT_TYPE))
         return 0    
 
-    for receiver in _clients:
-        if not (receiver == _client):
-            send_string = f"\n{username}@{room}: " + message
-            receiver[strings.SOCKET].send(send_string.encode(settings.SUPPORTED_TEXT_TYPE))
+    if not ratelimit.allow(len(room.members), client.message_budget, room.budget):
+        client.send(strings.RATE_LIMITED.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
 
-    
-    send_string = f"You@{room}: " + message
+    message_id = publish(room, _client.name, message, _client)
+    federation.relay(room_name, _client.name, message)
+
+    client.send(b"#%d You@%s: %s" % (message_id, room_name.encode(settings.SUPPORTED_TEXT_TYPE), message))
+    return 0
+
+def send_to_rooms(names, message, _client):
+    """
+    Sends a message to several rooms the sender is a member of. Every room keeps the message in
+    its history, but a user in several of the rooms receives it once, from the first of them.
+    The sender is told the message id in each room, and which rooms do not exist, do not have the
+    sender as a member or are over their rate limit.
+
+    Args:
+        names (list): The room names.
+        message (bytes): The message.
+        _client (Client): The sender.
+
+    Returns:
+        int: Returns 0 to indicate the function has completed.
+    """
+    sent, missing, outside, limited = [], [], [], []
+    reached = set()
+    for name in dict.fromkeys(names):
+        room = registry.room(name)
+        if room is None:
+            missing.append(name)
+        elif _client not in room.members:
+            outside.append(name)
+        elif not ratelimit.allow(len(room.members), _client.connection.message_budget, room.budget):
+            limited.append(name)
+        else:
+            receivers = room.members | registry.subscribers(room)
+            message_id = publish(room, _client.name, message, _client, receivers - reached)
+            reached |= receivers
+            federation.relay(name, _client.name, message)
+            sent.append(f"{name}#{message_id}")
+
+    send_string = ""
+    if missing:
+        send_string += strings.NEW_LINE + strings.ROOM_DOES_NOT_EXIST + " " + ",".join(missing)
+    if outside:
+        send_string += strings.NEW_LINE + strings.NOT_MEMBER + " " + ",".join(outside)
+    if limited:
+        send_string += strings.NEW_LINE + strings.ROOMS_RATE_LIMITED + ",".join(limited)
+    if sent:
+        send_bytes = f"You@{','.join(sent)}: ".encode(settings.SUPPORTED_TEXT_TYPE) + message
+    else:
+        send_bytes = strings.MESSAGE_NOT_SENT.encode(settings.SUPPORTED_TEXT_TYPE)
+    _client.connection.send(send_bytes + send_string.encode(settings.SUPPORTED_TEXT_TYPE))
+    return 0
+
+def private_message(arguments, client):
+    """
+    Sends a message straight to one or more users, named in a comma separated list, without a room.
+    Each name is looked up in the registry's name index, so delivery costs the same whatever the
+    number of users and rooms. Users signed in on another server are reached over its link. The
+    message costs one token per named user from the sender's message budget. The sender is told
+    who received the message, and which of the users are offline or unknown.
+
+    Args:
+        arguments (tuple): The comma separated user names and the message as bytes.
+        client (socket): The socket object representing the client that sent the message.
+
+    Returns:
+        int: Returns 0 to indicate the function has completed.
+    """
+    _client = authenticate(client)
+    if not _client:
+        return 0
+
+    names, message = arguments
+    names = dict.fromkeys(names.split(","))
+    if not ratelimit.allow(len(names), client.message_budget):
+        client.send(strings.RATE_LIMITED.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    receivers, sent, offline, unknown = [], [], [], []
+    for name in names:
+        receiver = registry.find(name)
+        if receiver is None:
+            (offline if registry.departed_recently(name) else unknown).append(name)
+        elif isinstance(receiver.connection, federation.RemoteUser):
+            federation.private(_client.name, name, message, receiver.connection.link)
+            sent.append(name)
+        else:
+            receivers.append(receiver)
+            sent.append(name)
+    broadcast(receivers, b"\n%s@private: %s" % (_client.name.encode(settings.SUPPORTED_TEXT_TYPE), message))
+
+    send_string = strings.PRIVATE_SENT + ",".join(sent) if sent else strings.PRIVATE_NOT_SENT
+    if offline:
+        send_string += strings.NEW_LINE + strings.USERS_OFFLINE + ",".join(offline)
+    if unknown:
+        send_string += strings.NEW_LINE + strings.USERS_UNKNOWN + ",".join(unknown)
+    client.send(send_string.encode(settings.SUPPORTED_TEXT_TYPE))
+    return 0
+
+def deliver_private(sender, name, message):
+    """
+    Delivers a private message that arrived from another server to a user signed in here.
+
+    Args:
+        sender (str): The sender's name.
+        name (str): The receiving user's name.
+        message (bytes | str): The message.
+
+    Returns:
+        bool: True if the user is signed in here.
+    """
+    receiver = registry.find(name)
+    if receiver is None or isinstance(receiver.connection, federation.RemoteUser):
+        return False
+    if isinstance(message, str):
+        message = message.encode(settings.SUPPORTED_TEXT_TYPE)
+    receiver.connection.send(b"\n%s@private: %s" % (sender.encode(settings.SUPPORTED_TEXT_TYPE), message))
+    return True
+
+def room_history(arguments, client):
+    """
+    Replays the recent messages of a room to a member: the latest n, or the ones newer than the
+    message with a given id when the argument is #id, so a reconnecting client catches up from
+    the last message it saw without anything being broadcast again.
+
+    Args:
+        arguments (tuple): The room name, and a count or # and a message id, or None.
+        client (socket): The socket object representing the client.
+
+    Returns:
+        int: Returns 0 to indicate the function has completed.
+    """
+    _client = authenticate(client)
+    if not _client:
+        return 0
+
+    room_name, selector = arguments
+    selector = selector.strip() if selector is not None else str(settings.HISTORY_REPLAY)
+    since = selector.startswith("#")
+    if since:
+        selector = selector[1:]
+    if not selector.isdigit():
+        client.send(strings.INVALID_HISTORY_REQUEST.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    room = registry.room(room_name)
+    if room is None:
+        client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    if not (_client in room.members):
+        client.send(strings.NOT_MEMBER.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    messages = room.history.since(int(selector)) if since else room.history.latest(int(selector))
+    if not messages:
+        client.send(strings.NO_HISTORY.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+    client.send(strings.ROOM_HISTORY.encode(settings.SUPPORTED_TEXT_TYPE) + replay(messages))
+    return 0
+
+def acknowledge(arguments, client):
+    """
+    Records that a member received the messages of a room up to a message id. Acknowledgements
+    are cumulative and not answered, so a client can acknowledge every message, or only the
+    latest of a burst, at the cost of one line each.
+
+    Args:
+        arguments (tuple): The room name, and the message id, optionally after a #.
+        client (socket): The socket object representing the client.
+
+    Returns:
+        int: Returns 0 to indicate the function has completed.
+    """
+    _client = authenticate(client)
+    if not _client:
+        return 0
+
+    room_name, message_id = arguments
+    message_id = message_id.strip().lstrip("#") if message_id is not None else ""
+    if not message_id.isdigit():
+        client.send(strings.INVALID_ACK.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    room = registry.room(room_name)
+    if room is None:
+        client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    if not (_client in room.members):
+        client.send(strings.NOT_MEMBER.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    message_id = int(message_id)
+    if message_id > room.acks.get(_client.name, 0):
+        room.acks[_client.name] = message_id
+    if tracing.waiting:
+        tracing.acknowledged(room_name, message_id, _client.name)
+    return 0
+
+def receipts(arguments, client):
+    """
+    Tells a member how many members of a room acknowledged a message, and which have not yet,
+    settings.MEMBERS_PAGE of them at most.
+
+    Args:
+        arguments (tuple): The room name, and the message id, optionally after a #.
+        client (socket): The socket object representing the client.
+
+    Returns:
+        int: Returns 0 to indicate the function has completed.
+    """
+    _client = authenticate(client)
+    if not _client:
+        return 0
+
+    room_name, message_id = arguments
+    message_id = message_id.strip().lstrip("#") if message_id is not None else ""
+    if not message_id.isdigit():
+        client.send(strings.INVALID_ACK.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    room = registry.room(room_name)
+    if room is None:
+        client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    if not (_client in room.members):
+        client.send(strings.NOT_MEMBER.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    message_id = int(message_id)
+    waiting = [member.name for member in room.members if room.acks.get(member.name, 0) < message_id]
+    send_string = f"{strings.ACKNOWLEDGED_BY}{len(room.members) - len(waiting)}{strings.ACKNOWLEDGED_OF}{len(room.members)}{strings.ACKNOWLEDGED_MEMBERS}"
+    if waiting:
+        send_string += strings.NOT_ACKNOWLEDGED
+        send_string += ''.join(name + strings.NEW_LINE for name in waiting[:settings.MEMBERS_PAGE])
     client.send(send_string.encode(settings.SUPPORTED_TEXT_TYPE))
-    return 0
\ No newline at end of file
+    return 0
+
+def parse_time(text):
+    """
+    Parses a point in time given as seconds since the epoch or as an ISO 8601 date, in UTC unless
+    it names its time zone.
+
+    Args:
+        text (str): The time.
+
+    Returns:
+        int: Nanoseconds since the epoch, or None if the time is invalid.
+    """
+    if text.isdigit():
+        return int(text) * 1000000000
+    try:
+        moment = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp()) * 1000000000 + moment.microsecond * 1000
+
+def search_archive(arguments, client):
+    """
+    Streams the archived messages of a room sent between two points in time, optionally only the
+    ones containing a term, to a member of the room. The messages are queued as views into the
+    archive's memory map, so they are never copied before they are written to the client. The
+    search walks settings.SEARCH_SCAN messages at most here; a longer one is left for
+    continue_searches to resume on the next turns of the server loop, and its results are sent
+    once it ends.
+
+    Args:
+        arguments (tuple): The room name, and the start and end times and optionally the term,
+                           separated by spaces, or None.
+        client (socket): The socket object representing the client.
+
+    Returns:
+        int: Returns 0 to indicate the function has completed.
+    """
+    _client = authenticate(client)
+    if not _client:
+        return 0
+
+    room_name, rest = arguments
+    arguments_arr = str.split(rest, " ", 2) if rest is not None else []
+    start = parse_time(arguments_arr[0]) if len(arguments_arr) > 1 else None
+    end = parse_time(arguments_arr[1]) if len(arguments_arr) > 1 else None
+    if archive.archive is None or start is None or end is None:
+        client.send(strings.INVALID_SEARCH.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    room = registry.room(room_name)
+    if room is None:
+        client.send(strings.ROOM_DOES_NOT_EXIST.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    if not (_client in room.members):
+        client.send(strings.NOT_MEMBER.encode(settings.SUPPORTED_TEXT_TYPE))
+        return 0
+
+    term = arguments_arr[2].encode(settings.SUPPORTED_TEXT_TYPE) if len(arguments_arr) == 3 else None
+    search = archive.archive.query(room.name, start, end, term)
+    if search.scan(settings.SEARCH_SCAN):
+        send_results(search, client)
+    else:
+        searches.append((client, search))
+    return 0
+
+def send_results(search, client):
+    """
+    Sends the messages a finished search found.
+
+    Args:
+        search (archive.Search): The search.
+        client (socket): The socket object representing the client.
+
+    Returns: None
+    """
+    results = search.results()
+    if not results:
+        client.send(strings.NO_RESULTS.encode(settings.SUPPORTED_TEXT_TYPE))
+        return
+
+    client.send(strings.SEARCH_RESULTS.encode(settings.SUPPORTED_TEXT_TYPE))
+    for message_id, time_ns, body in results:
+        moment = datetime.datetime.fromtimestamp(time_ns // 1000000000, datetime.timezone.utc)
+        client.send(b"#%d %s " % (message_id, moment.strftime("%Y-%m-%dT%H:%M:%SZ").encode(settings.SUPPORTED_TEXT_TYPE)))
+        client.send(body)
+        client.send(strings.NEW_LINE.encode(settings.SUPPORTED_TEXT_TYPE))
+
+def continue_searches(budget=None):
+    """
+    Walks the next messages of every search still scanning, one turn each so that a long search
+    does not starve the shorter ones, and sends the results of the searches that end. Searches of
+    clients that disconnected meanwhile are dropped.
+
+    Args:
+        budget (int): The number of messages each search walks, settings.SEARCH_SCAN when None,
+                      or 0 to finish every search.
+
+    Returns: None
+    """
+    budget = settings.SEARCH_SCAN if budget is None else budget or None
+    for _ in range(len(searches)):
+        client, search = searches.popleft()
+        if client.closed:
+            continue
+        if search.scan(budget):
+            send_results(search, client)
+        else:
+            searches.append((client, search))
+
+def search_timeout():
+    """
+    Returns how long the server loop may wait before continuing the searches still scanning.
+
+    Args: None
+
+    Returns:
+        float: 0 while a search is scanning, None otherwise.
+    """
+    return 0 if searches else None
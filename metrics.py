@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import os
+import socket
+
+import settings
+import strings
+
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+FAN_OUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Counter:
+    """
+    A value that only goes up.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        Adds amount to the counter.
+
+        Args:
+            amount (int): The amount to add.
+
+        Returns: None
+        """
+        self.value += amount
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, keeping their sum and count.
+    """
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        """
+        Args:
+            bounds (tuple): The sorted upper bounds of the buckets.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum    = 0
+        self.count  = 0
+
+    def observe(self, value):
+        """
+        Records one observation.
+
+        Args:
+            value (float): The observed value.
+
+        Returns: None
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Gauge:
+    """
+    A value read from a function when the metrics are exported, so keeping it current costs nothing.
+    """
+    __slots__ = ("read",)
+
+    def __init__(self, read):
+        """
+        Args:
+            read (callable): Returns the current value.
+        """
+        self.read = read
+
+class Family:
+    """
+    A named metric with one child per value of its label, or a single child without a label.
+    """
+
+    def __init__(self, name, kind, description, label=None, create=Counter):
+        """
+        Args:
+            name (str): The metric name.
+            kind (str): The Prometheus metric type.
+            description (str): The metric's help text.
+            label (str): The label name, None for an unlabelled metric.
+            create (callable): Creates a child.
+        """
+        self.name        = name
+        self.kind        = kind
+        self.description = description
+        self.label       = label
+        self.create      = create
+        self.children    = {}
+        families.append(self)
+
+    def labels(self, value=None):
+        """
+        Returns the child for a label value, creating it on first use.
+
+        Args:
+            value (str): The label value, None for an unlabelled metric.
+
+        Returns:
+            The child metric.
+        """
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = self.create()
+        return child
+
+families = []
+
+commands         = Family("chat_commands_total", "counter", "Commands handled, per command.", "command")
+command_seconds  = Family("chat_command_seconds", "histogram", "Time spent handling a command, per command.", "command",
+                          lambda: Histogram(LATENCY_BUCKETS))
+fan_out          = Family("chat_fan_out_receivers", "histogram", "Receivers a broadcast message was queued to.", None,
+                          lambda: Histogram(FAN_OUT_BUCKETS))
+fan_out_sizes    = fan_out.labels()
+reaped_total     = Family("chat_reaped_connections_total", "counter", "Idle connections disconnected after an unanswered PING.", None)
+reaped           = reaped_total.labels()
+tls_handshakes   = Family("chat_tls_handshakes_total", "counter", "TLS handshakes, per result: full, resumed or failed.", "result")
+compression      = Family("chat_compression_bytes_total", "counter", "Bytes of the compressed frames sent, before and after compression.", "stage")
+deflated_in      = compression.labels("before")
+deflated_out     = compression.labels("after")
+rate_limited     = Family("chat_rate_limited_total", "counter", "Commands and messages rejected by a rate limit, per budget.", "budget")
+
+def observe_command(command, seconds):
+    """
+    Records a handled command and the time it took.
+
+    Args:
+        command (str): The command verb, or strings.UNKNOWN for an unknown one.
+        seconds (float): The time spent handling it.
+
+    Returns: None
+    """
+    commands.labels(command).inc()
+    command_seconds.labels(command).observe(seconds)
+
+def gauge(name, description, read):
+    """
+    Registers an unlabelled gauge.
+
+    Args:
+        name (str): The metric name.
+        description (str): The metric's help text.
+        read (callable): Returns the current value.
+
+    Returns:
+        Family: The gauge's family.
+    """
+    family = Family(name, "gauge", description, None, lambda: Gauge(read))
+    family.labels()
+    return family
+
+def export():
+    """
+    Renders all metrics in the Prometheus text exposition format.
+
+    Args: None
+
+    Returns:
+        str: The metrics.
+    """
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {family.description}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for value, child in list(family.children.items()):
+            label = "" if family.label is None else f'{family.label}="{value}"'
+            if isinstance(child, Histogram):
+                total = 0
+                for bound, count in zip(child.bounds + ("+Inf",), child.counts):
+                    total += count
+                    bucket = f'{label},le="{bound}"' if label else f'le="{bound}"'
+                    lines.append(f"{family.name}_bucket{{{bucket}}} {total}")
+                suffix = f"{{{label}}}" if label else ""
+                lines.append(f"{family.name}_sum{suffix} {child.sum}")
+                lines.append(f"{family.name}_count{suffix} {child.count}")
+            else:
+                sample = child.read() if isinstance(child, Gauge) else child.value
+                lines.append(f"{family.name}{{{label}}} {sample}" if label else f"{family.name} {sample}")
+    return strings.NEW_LINE.join(lines) + strings.NEW_LINE
+
+def endpoint_path(path):
+    """
+    Removes a socket left behind at the metrics endpoint's path by an earlier run.
+
+    Args:
+        path (str): The socket path.
+
+    Returns:
+        str: The socket path.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    return path
+
+def open_endpoint(path):
+    """
+    Starts listening on a Unix-domain socket that answers every connection with the metrics.
+
+    Args:
+        path (str): The socket path.
+
+    Returns:
+        socket.socket: The listening socket.
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(endpoint_path(path))
+    listener.listen(settings.MAX_CONNECT_REQUEST)
+    return listener
+
+def answer(listener):
+    """
+    Accepts a connection on the metrics endpoint, writes the metrics and closes it.
+
+    Args:
+        listener (socket.socket): The listening socket returned by open_endpoint.
+
+    Returns: None
+    """
+    client, _ = listener.accept()
+    try:
+        client.settimeout(settings.CLIENT_TIMEOUT)
+        client.sendall(export().encode(settings.SUPPORTED_TEXT_TYPE))
+    except OSError:
+        pass
+    finally:
+        client.close()
+
+def close_endpoint(listener, path):
+    """
+    Stops serving the metrics and removes the socket path.
+
+    Args:
+        listener (socket.socket): The listening socket, None if it is closed elsewhere.
+        path (str): The socket path.
+
+    Returns: None
+    """
+    if listener is not None:
+        listener.close()
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+
+import settings
+import strings
+import registry
+
+RECORD   = struct.Struct("!II") # payload size and crc32 in front of every marshalled log record
+VERSION  = 1                    # snapshot format
+SEGMENT  = ".wal"
+SNAPSHOT = ".snapshot"
+
+ROOM = strings.ROOM # a room was created
+JOIN = strings.JOIN # a user joined a room
+LEVE = strings.LEVE # a user left a room
+SEND = strings.SEND # a message was kept in a room's history
+
+log         = None # WriteAheadLog of this server, None when persistence is off
+memberships = {}   # user name -> names of the rooms the user is a member of
+logger      = logging.getLogger(__name__)
+
+class WriteAheadLog:
+    """
+    An append-only log of state changes split into numbered segment files. Records are queued by
+    the serving thread and encoded and written by a background thread that fsyncs the batch every
+    settings.WAL_FSYNC_INTERVAL seconds, so logging never blocks the event loop. The writer thread
+    applies every record it writes to a copy of the persistent state of its own, and every
+    settings.SNAPSHOT_INTERVAL seconds with changes writes a snapshot of that copy: the log moves
+    to a new segment, the snapshot is named after it, and the segments and snapshots it replaces
+    are deleted. Snapshots thus cost the serving thread nothing however long the histories are,
+    but the copy holds every room's history a second time, up to settings.HISTORY_MESSAGES and
+    settings.HISTORY_BYTES per room like the serving thread's, so persistence doubles the memory
+    the histories take.
+
+    A write that fails, for example because the disk is full (ENOSPC) or failing (EIO), is
+    logged and tried again every settings.WAL_RETRY_INTERVAL seconds: the segment is cut back to
+    the records known to be on disk, and the records not written stay queued, with the records
+    logged meanwhile behind them, so replay never meets a torn record followed by good ones.
+    """
+
+    def __init__(self, directory, segment, state, snapshot=False):
+        """
+        Args:
+            directory (str): The directory holding the segments and snapshots.
+            segment (int): The number of the segment to start writing.
+            state (bytes): The marshalled state the log starts from.
+            snapshot (bool): Whether to write state as a snapshot first, once it was recovered
+                             from log segments.
+        """
+        self.directory = directory
+        self.segment   = segment
+        self.file      = open(path(directory, segment, SEGMENT), "ab")
+        self.size      = 0
+        self.pending   = []
+        self.unwritten = []                  # encoded records of a failed write, owned by the writer thread
+        self.state     = registry.Registry() # rooms and histories as of the records written, owned by the writer thread
+        self.saved     = {}                  # memberships as of the records written, owned by the writer thread
+        self.changed   = False               # whether records were written since the last snapshot
+        self.due       = time.monotonic() + settings.SNAPSHOT_INTERVAL
+        self.lock      = threading.Lock()
+        self.stopped   = threading.Event()
+        restore(self.state, self.saved, state)
+        if snapshot:
+            self.write_snapshot(state)
+        self.thread    = threading.Thread(target=self.run, name="wal", daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        """
+        Queues a record for the writer thread.
+
+        Args:
+            record (tuple): The record verb followed by its fields, all immutable.
+
+        Returns: None
+        """
+        with self.lock:
+            self.pending.append(record)
+
+    def run(self):
+        """
+        Writes and fsyncs the queued records in batches until the log is closed, taking a
+        snapshot once one is due.
+
+        Args: None
+
+        Returns: None
+        """
+        interval = settings.WAL_FSYNC_INTERVAL
+        while True:
+            stopping = self.stopped.wait(interval)
+            with self.lock:
+                batch, self.pending = self.pending, []
+            entries, self.unwritten = self.unwritten, []
+            for record in batch:
+                apply(self.state, self.saved, record)
+                payload = marshal.dumps(record)
+                entries.append(RECORD.pack(len(payload), zlib.crc32(payload)) + payload)
+            try:
+                self.write(entries)
+                entries = []
+                if self.changed and time.monotonic() >= self.due:
+                    self.write_snapshot(capture(self.state, self.saved))
+                interval = settings.WAL_FSYNC_INTERVAL
+            except OSError as error:
+                self.unwritten = entries
+                self.fail()
+                interval = settings.WAL_RETRY_INTERVAL
+                if stopping:
+                    logger.error('%s %s', strings.WAL_RECORDS_LOST, error)
+                else:
+                    logger.error('%s %s', strings.WAL_WRITE_FAILED, error)
+            if stopping:
+                self.file.close()
+                return
+
+    def write(self, entries):
+        """
+        Appends records to the current segment and fsyncs it, moving to a new segment once the
+        current one has reached settings.WAL_SEGMENT_SIZE.
+
+        Args:
+            entries (list): The encoded records.
+
+        Returns: None
+        """
+        if not entries:
+            return
+        if self.file.closed:
+            # reopened after a failed write, cut back to the records known to be on disk
+            self.file = open(path(self.directory, self.segment, SEGMENT), "ab")
+            self.file.truncate(self.size)
+        data = b"".join(entries)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size += len(data)
+        self.changed = True
+        if self.size >= settings.WAL_SEGMENT_SIZE:
+            self.next_segment()
+
+    def next_segment(self):
+        """
+        Closes the current segment and starts the next one.
+
+        Args: None
+
+        Returns: None
+        """
+        self.file.close()
+        self.segment += 1
+        self.size = 0
+        self.file = open(path(self.directory, self.segment, SEGMENT), "ab")
+
+    def fail(self):
+        """
+        Drops the current segment's file after a failed write, with whatever of the write is
+        still buffered in it, so the next write reopens it.
+
+        Args: None
+
+        Returns: None
+        """
+        try:
+            self.file.close()
+        except OSError:
+            pass
+
+    def write_snapshot(self, state):
+        """
+        Writes a snapshot taking over from the records written so far, then deletes the older
+        snapshots and segments.
+
+        Args:
+            state (bytes): The marshalled state.
+
+        Returns: None
+        """
+        self.next_segment()
+        target = path(self.directory, self.segment, SNAPSHOT)
+        with open(target + ".tmp", "wb") as snapshot_file:
+            snapshot_file.write(state)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(target + ".tmp", target)
+        for number, suffix in listing(self.directory):
+            if number < self.segment:
+                os.unlink(path(self.directory, number, suffix))
+        self.changed = False
+        self.due = time.monotonic() + settings.SNAPSHOT_INTERVAL
+
+    def close(self):
+        """
+        Writes what is still queued and stops the writer thread.
+
+        Args: None
+
+        Returns: None
+        """
+        self.stopped.set()
+        self.thread.join()
+
+def path(directory, number, suffix):
+    """
+    Returns the path of a numbered segment or snapshot.
+
+    Args:
+        directory (str): The data directory.
+        number (int): The segment number.
+        suffix (str): SEGMENT or SNAPSHOT.
+
+    Returns:
+        str: The path.
+    """
+    return os.path.join(directory, f"{number:010d}{suffix}")
+
+def listing(directory):
+    """
+    Lists the segments and snapshots in a data directory.
+
+    Args:
+        directory (str): The data directory.
+
+    Returns:
+        list: Sorted (number, suffix) pairs.
+    """
+    files = []
+    for name in os.listdir(directory):
+        number, suffix = name[:10], name[10:]
+        if number.isdigit() and suffix in (SEGMENT, SNAPSHOT):
+            files.append((int(number), suffix))
+    return sorted(files)
+
+def records(data):
+    """
+    Yields the records of a segment, stopping at the first torn or corrupt one.
+
+    Args:
+        data (bytes): The segment's content.
+
+    Returns:
+        generator: The records.
+    """
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        size, checksum = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        payload = data[start:start + size]
+        if len(payload) < size or zlib.crc32(payload) != checksum:
+            return
+        yield marshal.loads(payload)
+        offset = start + size
+
+def apply(registry, saved, record):
+    """
+    Applies a log record to a registry and to saved memberships.
+
+    Args:
+        registry (Registry): The registry being recovered, or the writer thread's copy.
+        saved (dict): The memberships, user name -> names of the rooms.
+        record (tuple): The record verb followed by its fields.
+
+    Returns: None
+    """
+    verb = record[0]
+    if verb == SEND:
+        room = registry.room(record[1])
+        if room is not None:
+            room.history.add(record[3], record[2])
+    elif verb == ROOM:
+        registry.add_room(record[1])
+    elif verb == JOIN:
+        saved.setdefault(record[2], set()).add(record[1])
+    elif verb == LEVE:
+        rooms = saved.get(record[2])
+        if rooms is not None:
+            rooms.discard(record[1])
+            if not rooms:
+                del saved[record[2]]
+
+def capture(registry, saved):
+    """
+    Marshals the persistent state: the rooms with their histories, and the saved memberships.
+
+    Args:
+        registry (Registry): The registry.
+        saved (dict): The memberships, user name -> names of the rooms.
+
+    Returns:
+        bytes: The marshalled state.
+    """
+    rooms = [(room.name, room.history.last_id(), room.history.since(0)) for room in registry.rooms.values()]
+    return marshal.dumps((VERSION, rooms, {name: list(rooms) for name, rooms in saved.items()}))
+
+def restore(registry, saved, state):
+    """
+    Loads a snapshot into a registry and saved memberships.
+
+    Args:
+        registry (Registry): The registry being recovered, or the writer thread's copy.
+        saved (dict): The memberships to load into.
+        state (bytes): The marshalled state.
+
+    Returns: None
+    """
+    version, rooms, members = marshal.loads(state)
+    if version != VERSION:
+        raise ValueError(f"unsupported snapshot version {version}")
+    for name, last_id, messages in rooms:
+        room = registry.add_room(name) or registry.room(name)
+        room.history.skip(last_id - len(messages))
+        for message_id, data in messages:
+            room.history.add(data, message_id)
+        room.history.skip(last_id)
+    for name, rooms in members.items():
+        saved[name] = set(rooms)
+
+def start(directory, registry):
+    """
+    Recovers the persistent state from a data directory, loading the latest snapshot and replaying
+    the log segments written after it, then starts logging to a new segment.
+
+    Args:
+        directory (str): The data directory, created if missing.
+        registry (Registry): The registry to recover into.
+
+    Returns:
+        list: The names of the recovered rooms.
+    """
+    global log
+    os.makedirs(directory, exist_ok=True)
+    files = listing(directory)
+    snapshots = [number for number, suffix in files if suffix == SNAPSHOT]
+    first = snapshots[-1] if snapshots else 0
+    if snapshots:
+        with open(path(directory, first, SNAPSHOT), "rb") as snapshot_file:
+            restore(registry, memberships, snapshot_file.read())
+
+    replayed = False
+    for number, suffix in files:
+        if suffix == SEGMENT and number >= first:
+            with open(path(directory, number, SEGMENT), "rb") as segment_file:
+                for record in records(segment_file.read()):
+                    apply(registry, memberships, record)
+                    replayed = True
+
+    log = WriteAheadLog(directory, files[-1][0] + 1 if files else 0, capture(registry, memberships), replayed)
+    return list(registry.rooms)
+
+def stop():
+    """
+    Writes the records still queued and closes the log.
+
+    Args: None
+
+    Returns: None
+    """
+    global log
+    if log is not None:
+        log.close()
+        log = None
+
+def room_added(registry, name):
+    """
+    Logs the creation of a room.
+
+    Args:
+        registry (Registry): The registry.
+        name (str): The room name.
+
+    Returns: None
+    """
+    if log is not None:
+        log.append((ROOM, name))
+
+def member_joined(registry, room, name):
+    """
+    Logs and saves a user joining a room.
+
+    Args:
+        registry (Registry): The registry.
+        room (str): The room name.
+        name (str): The user name.
+
+    Returns: None
+    """
+    if log is not None:
+        apply(registry, memberships, (JOIN, room, name))
+        log.append((JOIN, room, name))
+
+def member_left(registry, room, name):
+    """
+    Logs and forgets a user leaving a room.
+
+    Args:
+        registry (Registry): The registry.
+        room (str): The room name.
+        name (str): The user name.
+
+    Returns: None
+    """
+    if log is not None:
+        apply(registry, memberships, (LEVE, room, name))
+        log.append((LEVE, room, name))
+
+def message_added(registry, room, message_id, record):
+    """
+    Logs a message kept in a room's history.
+
+    Args:
+        registry (Registry): The registry.
+        room (str): The room name.
+        message_id (int): The message id.
+        record (bytes): The message as kept in the history.
+
+    Returns: None
+    """
+    if log is not None:
+        log.append((SEND, room, message_id, record))
+
+def saved_rooms(name):
+    """
+    Returns the rooms a user is a member of according to the saved memberships.
+
+    Args:
+        name (str): The user name.
+
+    Returns:
+        set: The room names.
+    """
+    return memberships.get(name, set()) if log is not None else set()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+import settings
+import metrics
+
+class TokenBucket:
+    """
+    A budget refilled at a steady rate up to a burst size. Taking from it costs O(1) whatever the
+    cost: the tokens earned since the last take are added in one step. A cost larger than the
+    burst is allowed from a full bucket and leaves it in debt, so a message to a room larger than
+    the burst still goes out, and the next ones wait until the debt is paid back.
+    """
+    __slots__ = ("name", "rate", "burst", "tokens", "stamp")
+
+    def __init__(self, name, rate, burst):
+        """
+        Args:
+            name (str): The budget's name, the label of the rejections counted in metrics.
+            rate (float): The tokens added per second.
+            burst (float): The most tokens the bucket holds, also its initial content.
+        """
+        self.name   = name
+        self.rate   = rate
+        self.burst  = burst
+        self.tokens = burst
+        self.stamp  = time.monotonic()
+
+    def refill(self, now):
+        """
+        Adds the tokens earned since the last refill.
+
+        Args:
+            now (float): The current time.monotonic().
+
+        Returns:
+            float: The tokens in the bucket.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return self.tokens
+
+    def affords(self, cost, now):
+        """
+        Tells whether the bucket can pay a cost.
+
+        Args:
+            cost (float): The cost.
+            now (float): The current time.monotonic().
+
+        Returns:
+            bool: True if the cost can be taken.
+        """
+        return self.refill(now) >= min(cost, self.burst)
+
+def bucket(name, rate, burst):
+    """
+    Creates a budget, or none when its rate is not set.
+
+    Args:
+        name (str): The budget's name.
+        rate (float): The tokens added per second, None for no limit.
+        burst (float): The most tokens the bucket holds.
+
+    Returns:
+        TokenBucket: The budget, or None.
+    """
+    return TokenBucket(name, rate, burst) if rate is not None else None
+
+def command_budget():
+    """
+    Creates the budget a connection's commands are taken from, one token per command.
+
+    Args: None
+
+    Returns:
+        TokenBucket: The budget, or None when commands are not limited.
+    """
+    return bucket("client_commands", settings.CLIENT_COMMAND_RATE, settings.CLIENT_COMMAND_BURST)
+
+def message_budget():
+    """
+    Creates the budget a connection's messages are taken from, one token per receiver.
+
+    Args: None
+
+    Returns:
+        TokenBucket: The budget, or None when messages are not limited.
+    """
+    return bucket("client_messages", settings.CLIENT_MESSAGE_RATE, settings.CLIENT_MESSAGE_BURST)
+
+def room_budget():
+    """
+    Creates the budget a room's messages are taken from, one token per receiver.
+
+    Args: None
+
+    Returns:
+        TokenBucket: The budget, or None when rooms are not limited.
+    """
+    return bucket("room_messages", settings.ROOM_MESSAGE_RATE, settings.ROOM_MESSAGE_BURST)
+
+def retune(budget, fresh):
+    """
+    Applies a rate and burst changed at run time to an existing budget, keeping the tokens it
+    holds up to the new burst, so changing a limit does not hand every connection a full burst.
+
+    Args:
+        budget (TokenBucket): The budget in use, None if there was no limit.
+        fresh (TokenBucket): A budget created with the new settings, None for no limit.
+
+    Returns:
+        TokenBucket: The budget to use from now on, or None.
+    """
+    if budget is None or fresh is None:
+        return fresh
+    budget.rate   = fresh.rate
+    budget.burst  = fresh.burst
+    budget.tokens = min(budget.tokens, fresh.burst)
+    return budget
+
+def allow(cost, *budgets):
+    """
+    Takes a cost from every given budget, or from none of them if one cannot pay it. Budgets that
+    are None do not limit anything. Rejections are counted in metrics by the refusing budget.
+
+    Args:
+        cost (float): The cost.
+        *budgets (TokenBucket): The budgets.
+
+    Returns:
+        bool: True if the cost was taken.
+    """
+    now = time.monotonic()
+    for budget in budgets:
+        if budget is not None and not budget.affords(cost, now):
+            metrics.rate_limited.labels(budget.name).inc()
+            return False
+    for budget in budgets:
+        if budget is not None:
+            budget.tokens -= cost
+    return True
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import settings
+import ratelimit
+import topics
+from history import History
+
+class Client:
+    """
+    A signed-in user: its name, its connection, the rooms it is a member of and the room name
+    patterns it subscribes to.
+    """
+    __slots__ = ("name", "connection", "rooms", "patterns")
+
+    def __init__(self, name, connection):
+        """
+        Args:
+            name (str): The user's name.
+            connection: The connection the user signed in on.
+        """
+        self.name       = name
+        self.connection = connection
+        self.rooms      = set()
+        self.patterns   = set()
+
+class Room:
+    """
+    A chat room, the set of its members, its recent messages, the rate limit budget its
+    messages are taken from, the presence changes waiting to be announced to its members and
+    the id of the latest message each member acknowledged.
+    """
+    __slots__ = ("name", "members", "history", "budget", "arrivals", "departures", "newcomers", "notice", "acks")
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): The room's name.
+        """
+        self.name    = name
+        self.members = set()
+        self.history = History()
+        self.budget  = ratelimit.room_budget()
+        self.arrivals   = 0    # members joined since the last presence notice
+        self.departures = 0    # members left since the last presence notice
+        self.newcomers  = {}   # member joined since the last presence notice -> arrivals and departures noted before it
+        self.notice     = None # Timer of the next presence notice, None when none is due
+        self.acks       = {}   # member name -> id of the latest message it acknowledged
+
+class Registry:
+    """
+    Indexes the signed-in clients by connection and by name, and the rooms by name. Room
+    membership is kept both ways, room to members and client to rooms, so signing in, joining,
+    leaving, lookups and disconnects cost O(1) amortized whatever the size of the rooms. The
+    names of the latest settings.DEPARTED_NAMES clients to sign out are remembered, so users that
+    are offline can be told apart from names never seen. Clients subscribing to room name
+    patterns receive the messages of the matching rooms without being members of them.
+    """
+
+    def __init__(self):
+        self.clients  = {} # connection -> Client
+        self.names    = {} # name -> Client
+        self.rooms    = {} # name -> Room
+        self.departed = {} # name -> None, oldest first
+        self.subscriptions = topics.Subscriptions()
+
+    def add_client(self, name, connection):
+        """
+        Signs in a new client.
+
+        Args:
+            name (str): The user's name.
+            connection: The connection the user signed in on.
+
+        Returns:
+            Client: The new client, or None if the name is taken.
+        """
+        if name in self.names:
+            return None
+        client = Client(name, connection)
+        self.clients[connection] = client
+        self.names[name] = client
+        self.departed.pop(name, None)
+        return client
+
+    def remove_client(self, connection):
+        """
+        Signs out the client on a connection and removes it from all of its rooms and subscriptions.
+
+        Args:
+            connection: The client's connection.
+
+        Returns:
+            Client: The removed client, or None if the connection was not signed in.
+        """
+        client = self.clients.pop(connection, None)
+        if client is None:
+            return None
+        del self.names[client.name]
+        self.departed[client.name] = None
+        if len(self.departed) > settings.DEPARTED_NAMES:
+            del self.departed[next(iter(self.departed))]
+        for room in client.rooms:
+            room.members.discard(client)
+            room.acks.pop(client.name, None)
+            room.newcomers.pop(client, None)
+        client.rooms.clear()
+        for pattern in client.patterns:
+            self.subscriptions.unsubscribe(pattern, client)
+        client.patterns.clear()
+        return client
+
+    def client(self, connection):
+        """
+        Looks up the client signed in on a connection.
+
+        Args:
+            connection: The connection.
+
+        Returns:
+            Client: The client, or None.
+        """
+        return self.clients.get(connection)
+
+    def find(self, name):
+        """
+        Looks up a client by name.
+
+        Args:
+            name (str): The user's name.
+
+        Returns:
+            Client: The client, or None.
+        """
+        return self.names.get(name)
+
+    def departed_recently(self, name):
+        """
+        Tells whether a user that is not signed in was signed in before.
+
+        Args:
+            name (str): The user's name.
+
+        Returns:
+            bool: True if the name belongs to a client that signed out.
+        """
+        return name in self.departed
+
+    def add_room(self, name):
+        """
+        Creates a room.
+
+        Args:
+            name (str): The room's name.
+
+        Returns:
+            Room: The new room, or None if the name is taken.
+        """
+        if name in self.rooms:
+            return None
+        room = Room(name)
+        self.rooms[name] = room
+        return room
+
+    def room(self, name):
+        """
+        Looks up a room by name.
+
+        Args:
+            name (str): The room's name.
+
+        Returns:
+            Room: The room, or None.
+        """
+        return self.rooms.get(name)
+
+    def join(self, client, room):
+        """
+        Adds a client to a room.
+
+        Args:
+            client (Client): The client.
+            room (Room): The room.
+
+        Returns:
+            bool: False if the client already was a member, True otherwise.
+        """
+        if client in room.members:
+            return False
+        room.members.add(client)
+        client.rooms.add(room)
+        return True
+
+    def leave(self, client, room):
+        """
+        Removes a client from a room.
+
+        Args:
+            client (Client): The client.
+            room (Room): The room.
+
+        Returns:
+            bool: False if the client was not a member, True otherwise.
+        """
+        if client not in room.members:
+            return False
+        room.members.discard(client)
+        room.acks.pop(client.name, None)
+        room.newcomers.pop(client, None)
+        client.rooms.discard(room)
+        return True
+
+    def subscribe(self, client, pattern):
+        """
+        Subscribes a client to the rooms matching a pattern.
+
+        Args:
+            client (Client): The client.
+            pattern (str): The room name pattern.
+
+        Returns:
+            bool: False if the client already was subscribed to the pattern, True otherwise.
+        """
+        if not self.subscriptions.subscribe(pattern, client):
+            return False
+        client.patterns.add(pattern)
+        return True
+
+    def unsubscribe(self, client, pattern):
+        """
+        Unsubscribes a client from a pattern.
+
+        Args:
+            client (Client): The client.
+            pattern (str): The room name pattern.
+
+        Returns:
+            bool: False if the client was not subscribed to the pattern, True otherwise.
+        """
+        if not self.subscriptions.unsubscribe(pattern, client):
+            return False
+        client.patterns.discard(pattern)
+        return True
+
+    def subscribers(self, room):
+        """
+        Looks up the clients subscribing to a room through a pattern.
+
+        Args:
+            room (Room): The room.
+
+        Returns:
+            frozenset: The subscribers, members of the room or not.
+        """
+        return self.subscriptions.match(room.name)
@@ -1,43 +1,76 @@
 
+import argparse
+import logging
+import os
+import resource
+import signal
 import socket
-import select
+import selectors
 import sys
+import time
+import traceback
 
 import settings
 import manager
 import strings
 import terminal
+import connection
+import framing
+import cluster
+import federation
+import metrics
+import persistence
+import archive
+import timers
+import tls
+import tracing
+import admin
+import handoff
 
-def start_server():
+log = logging.getLogger(__name__)
+
+def start_server(reuse_port=False):
     """
     Creates and returns a socket object representing the server, bound to the default host and port specified in settings,
     and set to listen for incoming connections.
 
-    Args: None
+    Args:
+        reuse_port (bool): whether to let other worker processes bind the same port, the kernel then
+                           spreads incoming connections over them
 
     Returns:
         server: a socket object representing the server
     """
     server = socket.socket(settings.IPV4, settings.CONNECT_TCP)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server.bind((settings.DEFAULT_HOST, settings.PORT))
-    server.listen(settings.MAX_CONNECT_REQUEST)
+    server.listen(settings.LISTEN_BACKLOG)
     return server
 
 def accept_client(server, server_stream):
     """
-    Accepts a new client connection and adds the client's socket object to the server stream
-    and increments the total number of clients. Prints a message indicating the new client's IP address.
+    Accepts a new client connection, wraps it in a connection with its own outbound buffer, adds it
+    to the server stream, starts watching it for silence and increments the total number of clients.
+    When the server serves TLS, the handshake is left to the server loop. Logs a message indicating
+    the new client's IP address.
 
     Args:
         server: a socket object representing the server
-        server_stream: a list of socket objects representing the server and standard input streams
+        server_stream: a set of socket objects representing the server and standard input streams
 
     Returns: None
     """
     client, ip_address = server.accept()
     manager.total_clients += 1
-    print(strings.NEW_CLIENT, ip_address)
-    server_stream.append(client)
+    log.info('%s %s', strings.NEW_CLIENT, ip_address)
+    if tls.context is None:
+        client = connection.SocketConnection(client)
+    else:
+        client = connection.TLSConnection(tls.wrap_server(client))
+    client.watch(lambda: manager.disconnect(server_stream, client))
+    server_stream.add(client)
 
 def read_stdin():
     """
@@ -53,53 +86,466 @@ def read_stdin():
 
 def handle_client_input(client, server_stream):
     """
-    Reads data from a client socket, decodes it as a string, executes it as a terminal command,
-    and prints a message indicating that the client input was received. If there is an error reading
-    the client socket, or if the socket is closed, disconnects the client.
+    Reads data from a client socket into the client's frame decoder and executes every complete
+    command it yields as a terminal command, logging a debug message for each one. A TLS client
+    first advances its handshake, and data it has already decrypted is read on without waiting
+    for the selector. If there is an error reading the client socket, if the socket is closed, if the
+    handshake fails, or if the client sends an oversized frame, disconnects the client.
 
     Args:
-        client: a socket object representing the client socket
-        server_stream: a list of socket objects representing the server and standard input streams
+        client: a connection object representing the client socket
+        server_stream: a set of socket objects representing the server and standard input streams
 
     Returns: None
     """
-    try:
-        client_input = client.recv(settings.INPUT_SIZE)
-    except:
-        manager.disconnect(server_stream, client)
-                
-    if client_input:
-        client_input_string = client_input.decode(settings.SUPPORTED_TEXT_TYPE).rstrip()
-        terminal.execute(client_input_string, client)
-        print(strings.CLIENT_INPUT)
-    else:
-        manager.disconnect(server_stream, client)
+    if client.handshaking:
+        if not client.handshake():
+            manager.disconnect(server_stream, client)
+            return
+        if client.handshaking:
+            return
+
+    while True:
+        try:
+            size = client.recv_into(client.decoder.writable())
+        except connection.WOULD_BLOCK:
+            return
+        except OSError:
+            size = 0
+
+        if not size:
+            manager.disconnect(server_stream, client)
+            return
+
+        client.decoder.commit(size)
+        client.last_seen = time.monotonic()
+        try:
+            for frame in client.decoder.frames():
+                terminal.execute_frame(frame, client)
+                log.debug(strings.CLIENT_INPUT)
+                if client.closed:
+                    return
+        except framing.FrameTooLarge:
+            client.send(strings.FRAME_TOO_LARGE.encode(settings.SUPPORTED_TEXT_TYPE))
+            client.flush()
+            manager.disconnect(server_stream, client)
+            return
+        if not client.buffered():
+            return
 
-def run_server():
+def flush_clients(server_stream, write_list):
+    """
+    Writes queued outbound data to every client whose socket is writable and disconnects
+    clients whose socket failed or whose outbound buffer overflowed.
+
+    Args:
+        server_stream: a set of socket objects representing the server and standard input streams
+        write_list: a list of connection objects whose sockets are writable
+
+    Returns: None
+    """
+    for client in write_list:
+        if not client.flush():
+            connection.overflowed.add(client)
+    for client in list(connection.overflowed):
+        if isinstance(client, cluster.Link):
+            server_stream.discard(client)
+            client.close()
+        else:
+            manager.disconnect(server_stream, client)
+
+def pause_sender(client, paused, server_stream):
+    """
+    Stops reading from a client while receivers it pushed over their limit under the block
+    policy drain their outbound buffers.
+
+    Args:
+        client: a connection object representing the sending client
+        paused: a dict mapping paused clients to the receivers they wait for
+        server_stream: the inputs of the server loop
+
+    Returns: None
+    """
+    receivers = connection.take_blocking()
+    if receivers:
+        paused[client] = receivers
+        server_stream.mute(client)
+
+def resume_senders(paused, server_stream):
+    """
+    Resumes reading from paused clients whose receivers have drained, unless the server drains.
+
+    Args:
+        paused: a dict mapping paused clients to the receivers they wait for
+        server_stream: the inputs of the server loop
+
+    Returns: None
+    """
+    for client, receivers in list(paused.items()):
+        if client.closed or all(receiver.relieved() for receiver in receivers):
+            del paused[client]
+            if admin.draining is None or not drains(client):
+                server_stream.unmute(client)
+
+def drains(input):
+    """
+    Tells whether the server loop stops reading an input while the server drains: it stops
+    reading client connections, and keeps reading consoles and links.
+
+    Args:
+        input: an input of the server loop
+
+    Returns:
+        bool: True if the input is no longer read while draining
+    """
+    return isinstance(input, connection.Connection) and not isinstance(input, (admin.Console, cluster.Link))
+
+def run_server(server=None, console=True, clients=()):
     """
     Starts the server, creates a server stream with the server socket and standard input,
-    and enters a loop that selects from the server stream and handles input accordingly.
+    registered with the platform's best selector (epoll, kqueue, ...), and enters a loop that
+    waits on the selector and handles input accordingly. Clients with queued outbound data are
+    watched for writability and flushed when ready.
+    In a worker process the links to the other workers are served as well, and in a federated
+    server the links to the other nodes. Due timers, such as the idle checks of the clients, run
+    after every wait. When settings.STATS_SOCKET is set, the metrics are served
+    on that Unix-domain socket. Admin commands are read from standard input and, when
+    settings.ADMIN_SOCKET is set, from consoles on that Unix-domain socket. Once DRAIN is given the
+    loop stops accepting clients and reading their commands, and returns when their outbound
+    queues are written out or the drain times out; EXIT returns at once. When
+    settings.UPGRADE_SOCKET is set, a new server process connecting to it takes the listening
+    socket and the clients over, and the loop returns.
 
-    Args: None
+    Args:
+        server: a listening socket to serve, a new one is started when None
+        console: whether to read commands from standard input
+        clients: client connections taken over from a previous server process
 
     Returns: None
     """
-    server = start_server()
-    server_stream = [server, sys.stdin]
+    server = server or start_server()
+    selector = selectors.DefaultSelector()
+    server_stream = connection.ServerStream(selector)
+    connection.writers.changed = server_stream.follow
+    try:
+        serve(server, server_stream, console, clients)
+    finally:
+        connection.writers.changed = None
+        selector.close()
+
+def serve(server, server_stream, console, clients):
+    """
+    Runs the loop of run_server until the server stops or is handed over.
+
+    Args:
+        server: the listening socket
+        server_stream: the inputs of the loop, empty at first
+        console: whether to read commands from standard input
+        clients: client connections taken over from a previous server process
+
+    Returns: None
+    """
+    server_stream.add(server)
+    if console:
+        try:
+            server_stream.add(sys.stdin)
+        except PermissionError:
+            log.warning(strings.STDIN_UNWATCHED)
+    server_stream.update(cluster.links.values())
+    for client in clients:
+        client.watch(lambda client=client: manager.disconnect(server_stream, client))
+        server_stream.add(client)
+    if settings.PEER_PORT or settings.PEERS:
+        federation.start(server_stream)
+    stats = metrics.open_endpoint(settings.STATS_SOCKET) if settings.STATS_SOCKET else None
+    if stats:
+        server_stream.add(stats)
+    consoles = admin.open_endpoint(settings.ADMIN_SOCKET) if settings.ADMIN_SOCKET else None
+    if consoles:
+        server_stream.add(consoles)
+    successor = handoff.open_endpoint(settings.UPGRADE_SOCKET) if settings.UPGRADE_SOCKET else None
+    if successor:
+        server_stream.add(successor)
+    paused = {}
     while True:
-        read_list, _, _ = select.select(server_stream, [], [])
+        if admin.draining is not None:
+            if admin.drained():
+                stop_server(server, stats, consoles, successor)
+                return
+            if server in server_stream:
+                server_stream.discard(server)
+                server.close()
+                for input in list(server_stream):
+                    if drains(input):
+                        server_stream.mute(input)
+        resume_senders(paused, server_stream)
+        read_list, write_list = server_stream.select(wait_time())
+        timers.advance()
+        manager.continue_searches()
+        federation.connect_peers(server_stream)
+        flush_clients(server_stream, write_list)
         for input in read_list:
+            if getattr(input, 'closed', False):
+                continue
             if input == server:
                 accept_client(server, server_stream)
-            elif input == sys.stdin:
-                command = read_stdin()
-                if str.upper(command[0:4]) == strings.EXIT:
-                    server.close()
-                    print(strings.SERVER_STOPPED)
+            elif input is stats:
+                metrics.answer(stats)
+            elif input is consoles:
+                admin.accept(consoles, server_stream)
+            elif isinstance(input, admin.Console):
+                admin.handle_input(input, server_stream)
+            elif input is successor:
+                peer = handoff.hand_off(successor, server, server_stream)
+                if peer is not None:
+                    stop_server(server, stats, consoles, successor)
+                    peer.close()
                     return
+            elif input is federation.listener:
+                federation.accept(server_stream)
+            elif input == sys.stdin:
+                answer = admin.execute(read_stdin())
+                if answer is not None:
+                    print(answer)
+            elif isinstance(input, cluster.Link):
+                cluster.handle_link_input(input, server_stream)
+                pause_sender(input, paused, server_stream)
             else:
                 handle_client_input(input, server_stream)
+                pause_sender(input, paused, server_stream)
+        flush_clients(server_stream, [])
+
+def stop_server(server, stats, consoles, successor):
+    """
+    Closes the listening sockets and stops persisting and archiving once the loop stops.
+
+    Args:
+        server: a socket object representing the server
+        stats: the metrics endpoint, None when metrics are not served
+        consoles: the admin endpoint, None when there is no admin socket
+        successor: the handoff endpoint, None when the server can not be taken over
+
+    Returns: None
+    """
+    server.close()
+    if stats:
+        metrics.close_endpoint(stats, settings.STATS_SOCKET)
+    if consoles:
+        metrics.close_endpoint(consoles, settings.ADMIN_SOCKET)
+    if successor:
+        metrics.close_endpoint(successor, settings.UPGRADE_SOCKET)
+    persistence.stop()
+    archive.stop()
+    print(strings.SERVER_STOPPED)
+
+def raise_file_limit():
+    """
+    Raises the soft limit on open files to the hard limit, so that the server holds as many
+    connections as the system allows rather than the usual default of 1024.
+
+    Args: None
+
+    Returns: None
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft == hard:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        log.warning('%s %s', strings.FILE_LIMIT_KEPT, soft)
+
+def wait_time():
+    """
+    Returns how long the server loop may wait for input before it has to run due timers,
+    continue a search, connect to a peer or give up draining.
+
+    Args: None
+
+    Returns:
+        float: Seconds to wait, or None to wait for input only.
+    """
+    waits = [wait for wait in (timers.timeout(), manager.search_timeout(), federation.timeout(), admin.timeout()) if wait is not None]
+    return min(waits) if waits else None
+
+def run_workers(count):
+    """
+    Forks count worker processes serving the same port, each running the server loop over its own
+    clients and the rooms it owns, connected to each other by Unix-domain socket pairs. Every worker
+    binds its own listening socket with SO_REUSEPORT; where that is not available the workers
+    accept from one listening socket created before forking. The parent process reads commands from
+    standard input and stops the workers on exit; the other admin commands are served by each
+    worker on its own admin socket.
+
+    Args:
+        count (int): the number of worker processes
+
+    Returns: None
+    """
+    reuse_port = hasattr(socket, 'SO_REUSEPORT')
+    server = None if reuse_port else start_server()
+    pairs = cluster.create_links(count)
+    workers = []
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            cluster.start(index, count, pairs, terminal.execute)
+            if settings.STATS_SOCKET:
+                settings.STATS_SOCKET += "." + str(index)
+            if settings.ADMIN_SOCKET:
+                settings.ADMIN_SOCKET += "." + str(index)
+            log.info('%s %s %s', strings.WORKER_STARTED, index, os.getpid())
+            status = 0
+            try:
+                if settings.DATA_DIR:
+                    recover(os.path.join(settings.DATA_DIR, str(index)))
+                if settings.ARCHIVE_DIR:
+                    archive.start(os.path.join(settings.ARCHIVE_DIR, str(index)))
+                run_server(server or start_server(reuse_port), console=False)
+            except KeyboardInterrupt:
+                pass
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            persistence.stop()
+            archive.stop()
+            os._exit(status)
+        workers.append(pid)
+    cluster.close_links(pairs)
+
+    try:
+        command = read_stdin()
+        while command and str.upper(command[0:4]) != strings.EXIT:
+            if command.strip():
+                print(strings.ADMIN_WORKERS)
+            command = read_stdin()
+        if not command:
+            os.wait()
+    except KeyboardInterrupt:
+        pass
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    print(strings.SERVER_STOPPED)
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+def recover(directory):
+    """
+    Recovers rooms, memberships and room history from a data directory and starts logging
+    changes to it. In a worker process the other workers are told about the recovered rooms.
+
+    Args:
+        directory (str): the data directory
+
+    Returns: None
+    """
+    for name in persistence.start(directory, manager.registry):
+        if cluster.workers > 1:
+            cluster.room_added(name)
+
+def parse_arguments(argv=None):
+    """
+    Parses the server's command line options.
+
+    Args:
+        argv (list): The command line arguments, sys.argv[1:] when None.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description=strings.SERVER_DESCRIPTION)
+    parser.add_argument('--async', dest='use_async', action='store_true', help=strings.ASYNC_HELP)
+    parser.add_argument('--workers', type=int, default=1, help=strings.WORKERS_HELP)
+    parser.add_argument('--port', type=int, default=settings.PORT, help=strings.PORT_HELP)
+    parser.add_argument('--node', default=settings.NODE_NAME, help=strings.NODE_HELP)
+    parser.add_argument('--peer-port', type=int, default=settings.PEER_PORT, help=strings.PEER_PORT_HELP)
+    parser.add_argument('--peers', type=parse_peers, default=settings.PEERS, help=strings.PEERS_HELP)
+    parser.add_argument('--data-dir', default=settings.DATA_DIR, help=strings.DATA_DIR_HELP)
+    parser.add_argument('--archive-dir', default=settings.ARCHIVE_DIR, help=strings.ARCHIVE_DIR_HELP)
+    parser.add_argument('--stats-socket', default=settings.STATS_SOCKET, help=strings.STATS_SOCKET_HELP)
+    parser.add_argument('--tls-cert', default=settings.TLS_CERTFILE, help=strings.TLS_CERT_HELP)
+    parser.add_argument('--tls-key', default=settings.TLS_KEYFILE, help=strings.TLS_KEY_HELP)
+    parser.add_argument('--presence-window', type=float, default=settings.PRESENCE_WINDOW, help=strings.PRESENCE_WINDOW_HELP)
+    parser.add_argument('--presence-limit', type=int, default=settings.PRESENCE_LIMIT, help=strings.PRESENCE_LIMIT_HELP)
+    parser.add_argument('--trace-sample', type=int, default=settings.TRACE_SAMPLE, help=strings.TRACE_SAMPLE_HELP)
+    parser.add_argument('--trace-file', default=settings.TRACE_FILE, help=strings.TRACE_FILE_HELP)
+    parser.add_argument('--admin-socket', default=settings.ADMIN_SOCKET, help=strings.ADMIN_SOCKET_HELP)
+    parser.add_argument('--upgrade-socket', default=settings.UPGRADE_SOCKET, help=strings.UPGRADE_SOCKET_HELP)
+    parser.add_argument('--takeover', help=strings.TAKEOVER_HELP)
+    parser.add_argument('--no-rate-limits', dest='rate_limits', action='store_false', help=strings.NO_RATE_LIMITS_HELP)
+    parser.add_argument('--log-level', default=settings.LOG_LEVEL, choices=LOG_LEVELS, type=str.upper,
+                        help=strings.LOG_LEVEL_HELP)
+    arguments = parser.parse_args(argv)
+    if arguments.workers > 1 and arguments.use_async:
+        parser.error(strings.WORKERS_WITH_ASYNC)
+    if (arguments.peer_port or arguments.peers) and (arguments.workers > 1 or arguments.use_async):
+        parser.error(strings.PEERS_WITH_WORKERS)
+    if (arguments.upgrade_socket or arguments.takeover) and (arguments.workers > 1 or arguments.use_async or arguments.peer_port
+                                                              or arguments.peers or arguments.tls_cert):
+        parser.error(strings.UPGRADE_UNSUPPORTED)
+    return arguments
+
+def parse_peers(value):
+    """
+    Parses a comma separated list of host:port addresses of other server nodes.
+
+    Args:
+        value (str): The list of addresses.
+
+    Returns:
+        tuple: The (host, port) pairs.
+    """
+    peers = []
+    for address in value.split(','):
+        host, _, port = address.strip().rpartition(':')
+        if not port.isdigit():
+            raise argparse.ArgumentTypeError(strings.INVALID_PEER + address)
+        peers.append((host or settings.LOCAL_HOST, int(port)))
+    return tuple(peers)
 
 if __name__ == '__main__':
+    arguments = parse_arguments()
+    settings.PORT = arguments.port
+    settings.NODE_NAME = arguments.node
+    settings.PEER_PORT = arguments.peer_port
+    settings.PEERS = arguments.peers
+    settings.STATS_SOCKET = arguments.stats_socket
+    settings.ADMIN_SOCKET = arguments.admin_socket
+    settings.UPGRADE_SOCKET = arguments.upgrade_socket or arguments.takeover
+    settings.DATA_DIR = arguments.data_dir
+    settings.ARCHIVE_DIR = arguments.archive_dir
+    settings.TLS_CERTFILE = arguments.tls_cert
+    settings.TLS_KEYFILE = arguments.tls_key
+    settings.PRESENCE_WINDOW = arguments.presence_window
+    settings.PRESENCE_LIMIT = arguments.presence_limit
+    settings.TRACE_SAMPLE = arguments.trace_sample
+    settings.TRACE_FILE = arguments.trace_file
+    if settings.TLS_CERTFILE:
+        tls.start(settings.TLS_CERTFILE, settings.TLS_KEYFILE)
+    if not arguments.rate_limits:
+        settings.CLIENT_COMMAND_RATE = settings.CLIENT_MESSAGE_RATE = settings.ROOM_MESSAGE_RATE = None
+    logging.basicConfig(format="%(message)s", level=arguments.log_level)
+    tracing.start(settings.TRACE_SAMPLE, settings.TRACE_FILE)
+    raise_file_limit()
+    server, clients = handoff.take_over(arguments.takeover) if arguments.takeover else (None, ())
+    if settings.DATA_DIR and arguments.workers == 1:
+        recover(settings.DATA_DIR)
+    if settings.ARCHIVE_DIR and arguments.workers == 1:
+        archive.start(settings.ARCHIVE_DIR)
     print(strings.SERVER_STARTED)
-    run_server()
\ No newline at end of file
+    try:
+        if arguments.use_async:
+            import async_server
+            async_server.run_server()
+        elif arguments.workers > 1:
+            run_workers(arguments.workers)
+        else:
+            run_server(server, clients=clients)
+    finally:
+        persistence.stop()
+        archive.stop()
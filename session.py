@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import random
+import re
+
+import settings
+import strings
+import compression
+
+WELCOME = strings.WELCOME_CLIENT.encode(settings.SUPPORTED_TEXT_TYPE)
+PING    = (strings.NEW_LINE + strings.PING).encode(settings.SUPPORTED_TEXT_TYPE)
+PONG    = (strings.PONG + strings.NEW_LINE).encode(settings.SUPPORTED_TEXT_TYPE)
+LINE    = strings.NEW_LINE.encode(settings.SUPPORTED_TEXT_TYPE)
+MESSAGE = re.compile(rb"#(\d+) [^@\n]*@([^:\n]+): ") # room message, history line or acknowledgement: id and room
+ERRORS  = tuple(text.encode(settings.SUPPORTED_TEXT_TYPE) for text in (
+    strings.RATE_LIMITED, strings.INPUT_INVALID, strings.INVALID_ROOM_NAME, strings.UNKNOWN_COMMAND,
+)) # answers any command may get in place of its own
+
+class Session:
+    """
+    An asyncio chat client, for bots and the load generator, keeping one user signed in. Commands
+    are pipelined: they are written as soon as they are given, answers are awaited in order, and
+    commands given while the connection is down are kept and written once it is back. A lost
+    connection is reopened with exponential backoff; the session then signs in again, joins its
+    rooms again and asks each room for the messages after the last one it saw.
+
+    The session asks the server to frame what it sends at USER time, deflating the frames with
+    compress set, so every answer and message arrives as a frame of its own and the session hands
+    out exactly one per call to received. A command is answered by the first frame that starts
+    with one of its answers, never by a message that merely quotes one.
+
+    With acks set, the session acknowledges the messages of its rooms as they arrive, one ACKS
+    command per room and read, so the server can tell senders who received them.
+
+    A process serves thousands of sessions: each costs one task and its stream buffers.
+    """
+
+    def __init__(self, name, host=None, port=None, context=None, compress=True, reconnect=True, acks=False):
+        """
+        Args:
+            name (str): The user name to sign in with.
+            host (str): The server host, settings.LOCAL_HOST when None.
+            port (int): The server port, settings.PORT when None.
+            context (ssl.SSLContext): The TLS context to connect with, plain TCP when None.
+            compress (bool): Whether to negotiate compression, or frames without compression.
+            reconnect (bool): Whether to reopen the connection when it is lost.
+            acks (bool): Whether to acknowledge the messages received in the joined rooms.
+        """
+        self.name      = name
+        self.host      = settings.LOCAL_HOST if host is None else host
+        self.port      = settings.PORT if port is None else port
+        self.context   = context
+        self.compress  = compress
+        self.reconnect = reconnect
+        self.acks      = acks
+        self.reader    = None
+        self.writer    = None
+        self.decoder   = None # compression.Decoder of the frames the server sends while connected
+        self.task      = None # Task serving the session once it is open
+        self.closed    = False
+        self.early     = []   # frames that arrived along with the welcome message
+        self.rooms     = {}   # joined room name -> id of the last message seen in it, 0 for none
+        self.waiters   = collections.deque()                              # (answers, future, quiet) in command order
+        self.backlog   = collections.deque(maxlen=settings.SESSION_BACKLOG) # command lines given while disconnected
+
+    async def open(self):
+        """
+        Connects and signs in, then serves the session in a background task.
+
+        Args: None
+
+        Returns:
+            bool: True if the session signed in, False if the name is taken.
+
+        Raises:
+            OSError: If the server can not be reached.
+            asyncio.TimeoutError: If the server does not answer in time.
+        """
+        if not await self.connect():
+            return False
+        self.task = asyncio.create_task(self.run())
+        return True
+
+    async def connect(self):
+        """
+        Opens the connection and runs the USER handshake, negotiating framing, and compression
+        when asked to. Once signed in, rejoins the session's rooms and writes the commands kept while disconnected.
+
+        Args: None
+
+        Returns:
+            bool: True if the session signed in, False if the name is taken.
+        """
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(
+            self.host, self.port, limit=settings.INPUT_SIZE, ssl=self.context,
+            server_hostname=self.host if self.context else None,
+        ), settings.CLIENT_TIMEOUT)
+        capability = strings.ZLIB if self.compress else strings.FRAME
+        self.writer.write(f"{strings.USER} {self.name} {capability}{strings.NEW_LINE}".encode(settings.SUPPORTED_TEXT_TYPE))
+        data = await self.read()
+        if compression.framed(data):
+            self.decoder = compression.Decoder()
+            self.early = list(self.decoder.frames(data))
+            while not self.early:
+                self.early = list(self.decoder.frames(await self.read()))
+            data = self.early.pop(0)
+        if self.decoder is None or not data.startswith(WELCOME):
+            self.drop()
+            return False
+        self.resume()
+        return True
+
+    async def read(self):
+        """
+        Reads from the connection.
+
+        Args: None
+
+        Returns:
+            bytes: The data read.
+
+        Raises:
+            asyncio.IncompleteReadError: If the server closed the connection.
+        """
+        data = await asyncio.wait_for(self.reader.read(settings.INPUT_SIZE), settings.CLIENT_TIMEOUT)
+        if not data:
+            raise asyncio.IncompleteReadError(b"", None)
+        return data
+
+    def resume(self):
+        """
+        Rejoins the session's rooms after a reconnect, asking every room for the messages after the
+        last one the session saw, and writes the commands kept while disconnected. The answers to
+        the joins are not handed to received, as the history they replay is already known.
+
+        Args: None
+
+        Returns: None
+        """
+        for room, last in self.rooms.items():
+            self.expect((strings.MEMBERSHIP_GRANTED, strings.ALREADY_MEMBER, strings.ROOM_DOES_NOT_EXIST), True)
+            self.write(f"{strings.JOIN} {room}")
+            if last:
+                self.write(f"{strings.HIST} {room} #{last}")
+        while self.backlog:
+            self.write(self.backlog.popleft())
+
+    async def run(self):
+        """
+        Serves the session until it is closed, reconnecting with exponential backoff and jitter
+        whenever the connection is lost.
+
+        Args: None
+
+        Returns: None
+        """
+        while not self.closed:
+            try:
+                await self.serve()
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            self.drop()
+            delay = settings.RECONNECT_DELAY
+            while self.reconnect and not self.closed:
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, settings.RECONNECT_MAX_DELAY)
+                try:
+                    if await self.connect():
+                        self.reconnected()
+                        break
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    self.drop()
+            else:
+                return
+
+    async def serve(self):
+        """
+        Reads the connection until it closes, handing every frame to dispatch.
+
+        Args: None
+
+        Returns: None
+        """
+        while self.early:
+            self.dispatch(self.early.pop(0))
+        while True:
+            data = await self.reader.read(settings.INPUT_SIZE)
+            if not data:
+                return
+            for frame in self.decoder.frames(data):
+                self.dispatch(frame)
+
+    def dispatch(self, data):
+        """
+        Handles an answer or message: answers the server's PING, resolves the waiting commands
+        it answers, notes the last message id of the joined rooms, and hands it to received.
+
+        Args:
+            data (bytes): A frame.
+
+        Returns: None
+        """
+        if data == PING:
+            self.writer.write(PONG)
+        elif self.answer(data):
+            self.track(data)
+            return
+        if self.reconnect or self.acks:
+            self.track(data)
+        self.received(data)
+
+    def answer(self, data):
+        """
+        Resolves the oldest waiting command if a frame answers it: the frame, after the new line
+        some answers open with, starts with one of the command's answers or with one of the errors
+        any command may be answered with, such as RATE_LIMITED.
+
+        Args:
+            data (bytes): A frame.
+
+        Returns:
+            bool: True if the frame answered a command awaited quietly.
+        """
+        while self.waiters and self.waiters[0][1].done():
+            self.waiters.popleft()
+        if not self.waiters:
+            return False
+        answers, future, quiet = self.waiters[0]
+        start = len(LINE) if data.startswith(LINE) else 0
+        for text in answers + ERRORS:
+            if data.startswith(text, start):
+                self.waiters.popleft()
+                future.set_result(data)
+                return quiet
+        return False
+
+    def track(self, data):
+        """
+        Notes the id of the last message seen in each joined room, to resume from it, and
+        acknowledges the rooms it moved forward in when acks is set.
+
+        Args:
+            data (bytes): An answer or message.
+
+        Returns: None
+        """
+        advanced = set()
+        for match in MESSAGE.finditer(data):
+            room = match.group(2).decode(settings.SUPPORTED_TEXT_TYPE)
+            if room in self.rooms and int(match.group(1)) > self.rooms[room]:
+                self.rooms[room] = int(match.group(1))
+                advanced.add(room)
+        if self.acks and advanced and self.connected():
+            for room in advanced:
+                self.write(f"{strings.ACKS.lower()} {room} {self.rooms[room]}")
+
+    def received(self, data):
+        """
+        Called with every answer and message not awaited quietly. Subclasses override it.
+
+        Args:
+            data (bytes): A frame.
+
+        Returns: None
+        """
+
+    def reconnected(self):
+        """
+        Called once the session signed in again after losing its connection. Subclasses override it.
+
+        Args: None
+
+        Returns: None
+        """
+
+    def expect(self, answers, quiet=False):
+        """
+        Registers a wait for the answer to the next command written.
+
+        Args:
+            answers (tuple): Texts one of which the answer starts with.
+            quiet (bool): Whether to keep the answer from received.
+
+        Returns:
+            asyncio.Future: Resolved with the answer.
+        """
+        answers = tuple(answer.encode(settings.SUPPORTED_TEXT_TYPE) for answer in answers)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((answers, future, quiet))
+        return future
+
+    def write(self, line):
+        """
+        Writes a command line to the connection, or keeps it for the next connection when the
+        connection is gone.
+
+        Args:
+            line (str): The command, without its newline.
+
+        Returns: None
+        """
+        if not self.connected():
+            self.backlog.append(line)
+            return
+        self.writer.write((line + strings.NEW_LINE).encode(settings.SUPPORTED_TEXT_TYPE))
+
+    def connected(self):
+        """
+        Tells whether the session has an open connection to write to.
+
+        Args: None
+
+        Returns:
+            bool: True if connected.
+        """
+        return self.writer is not None and not self.writer.is_closing()
+
+    def command(self, line):
+        """
+        Writes a command without waiting for its answer, or keeps it for the next connection
+        while disconnected.
+
+        Args:
+            line (str): The command, without its newline.
+
+        Returns: None
+        """
+        if self.connected():
+            self.write(line)
+        else:
+            self.backlog.append(line)
+
+    async def request(self, line, *answers):
+        """
+        Writes a command and waits for its answer. Requests are pipelined: several may be
+        waiting at once, and are answered in the order they were written.
+
+        Args:
+            line (str): The command, without its newline.
+            answers (str): Texts one of which the answer starts with.
+
+        Returns:
+            bytes: The answer.
+
+        Raises:
+            asyncio.TimeoutError: If no answer arrives within settings.CLIENT_TIMEOUT seconds.
+            ConnectionError: If the connection is lost first.
+        """
+        if not self.connected():
+            raise ConnectionError(strings.DISCONNECTED_FROM_SERVER)
+        future = self.expect(answers)
+        self.write(line)
+        return await asyncio.wait_for(future, settings.CLIENT_TIMEOUT)
+
+    async def join(self, room):
+        """
+        Joins a room, which the session then rejoins whenever it reconnects.
+
+        Args:
+            room (str): The room name.
+
+        Returns:
+            bool: True if the session is a member of the room.
+        """
+        answer = await self.request(f"{strings.JOIN} {room}", strings.MEMBERSHIP_GRANTED, strings.ALREADY_MEMBER,
+                                    strings.ROOM_DOES_NOT_EXIST)
+        joined = any(text.encode(settings.SUPPORTED_TEXT_TYPE) in answer for text in (strings.MEMBERSHIP_GRANTED, strings.ALREADY_MEMBER))
+        if joined:
+            self.rooms.setdefault(room, 0)
+            self.track(answer)
+        return joined
+
+    async def leave(self, room):
+        """
+        Leaves a room.
+
+        Args:
+            room (str): The room name.
+
+        Returns: None
+        """
+        self.rooms.pop(room, None)
+        await self.request(f"{strings.LEVE} {room}", strings.YOU_LEFT_ROOM, strings.NOT_MEMBER, strings.ROOM_DOES_NOT_EXIST)
+
+    def send(self, room, text):
+        """
+        Sends a message to a room without waiting for the acknowledgement.
+
+        Args:
+            room (str): The room name, or comma separated room names.
+            text (str): The message.
+
+        Returns: None
+        """
+        self.command(f"{strings.SEND} {room} {text}")
+
+    async def drain(self):
+        """
+        Waits until the commands written are handed to the operating system.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.connected():
+            await self.writer.drain()
+
+    def drop(self):
+        """
+        Closes the connection, failing the commands waiting for an answer.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = self.decoder = None
+        self.early = []
+        while self.waiters:
+            _, future, quiet = self.waiters.popleft()
+            if quiet:
+                future.cancel()
+            elif not future.done():
+                future.set_exception(ConnectionError(strings.DISCONNECTED_FROM_SERVER))
+
+    def pause(self):
+        """
+        Stops reading the connection, keeping it open, so the server's data piles up as it
+        does behind a slow consumer.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.task is not None:
+            self.task.cancel()
+
+    def close(self):
+        """
+        Closes the session for good.
+
+        Args: None
+
+        Returns: None
+        """
+        self.closed = True
+        self.pause()
+        self.drop()
@@ -11,10 +11,85 @@ INPUT_SIZE   = 102400
 IPV4         = socket.AF_INET
 CONNECT_TCP  = socket.SOCK_STREAM
 MAX_CONNECT_REQUEST = 6
+LISTEN_BACKLOG      = 4096
 CLIENT_TIMEOUT      = 6
 MIN_COMMAND_SIZE    = 4
 SUPPORTED_TEXT_TYPE   = "utf-8"
+OUTBOUND_LIMIT        = 1048576
+MAX_GATHER_BUFFERS    = 64
+RECEIVE_BUFFER_SIZE   = 4096
+MAX_FRAME_SIZE        = INPUT_SIZE
+LINK_OUTBOUND_LIMIT   = 67108864
+LINK_MAX_FRAME_SIZE   = 16777216
+NODE_NAME             = None
+PEER_PORT             = None
+PEERS                 = ()
+PEER_RETRY_INTERVAL   = 5
+FEDERATION_SEEN_EVENTS = 65536
+MAX_BATCH_COMMANDS    = 1000
+MAX_BATCH_BYTES       = 1048576 # command bytes a batch may collect before it is dropped
+DEPARTED_NAMES        = 65536
+SUBSCRIPTION_CACHE    = 65536   # room names whose matching subscribers are cached until subscriptions change
+PRESENCE_WINDOW       = 1.0     # seconds joins and leaves are coalesced over into one notice, 0 to announce each at once
+PRESENCE_LIMIT        = None    # rooms with more members get no presence notices, None to announce whatever the size
+MEMBERS_PAGE          = 500     # member names LIME answers with at a time
+TRACE_SAMPLE          = 0       # one in this many messages is traced from ingress to acknowledgement, 0 to trace none
+TRACE_FILE            = None    # file traces are appended to as JSON lines, None to log them
+TRACE_TIMEOUT         = 10      # seconds a trace waits for its receivers to flush and acknowledge the message
+HISTORY_MESSAGES      = 256
+HISTORY_BYTES         = 32768
+HISTORY_REPLAY        = 20
+DATA_DIR              = None
+WAL_SEGMENT_SIZE      = 67108864
+WAL_FSYNC_INTERVAL    = 0.05
+WAL_RETRY_INTERVAL    = 1       # seconds the log writer waits before writing again after a failed write
+SNAPSHOT_INTERVAL     = 300
+ARCHIVE_DIR           = None
+ARCHIVE_INTERVAL      = 0.2
+ARCHIVE_BUCKET        = 3600
+SEARCH_LIMIT          = 1000
+SEARCH_SCAN           = 10000   # archived messages a search walks per turn of the server loop before it lets other clients in
+CLIENT_COMMAND_RATE   = 100     # commands per second per connection, None for no limit
+CLIENT_COMMAND_BURST  = 200
+CLIENT_MESSAGE_RATE   = 5000    # message receivers per second per connection, None for no limit
+CLIENT_MESSAGE_BURST  = 20000
+ROOM_MESSAGE_RATE     = 50000   # message receivers per second per room, None for no limit
+ROOM_MESSAGE_BURST    = 100000
+TIMER_TICK            = 0.5
+TIMER_SLOTS           = 64
+TIMER_LEVELS          = 4
+IDLE_TIMEOUT          = 60      # seconds of silence after which a client is sent a PING
+PONG_TIMEOUT          = 20      # seconds a client has to answer a PING before it is disconnected
+TLS_CERTFILE          = None    # certificate chain the server presents, TLS is off when None
+TLS_KEYFILE           = None    # private key of the certificate, in TLS_CERTFILE when None
+TLS_CAFILE            = None    # certificates client.py trusts, the system's when None
+TLS_SESSION_TICKETS   = 2
+TLS_HANDSHAKE_TIMEOUT = 10
+COMPRESSION_THRESHOLD = 256     # frames to clients that negotiated compression are sent raw below this size
+COMPRESSION_LEVEL     = 6
+RECONNECT_DELAY       = 0.5     # seconds a session.Session waits before its first reconnect, doubled on every failure
+RECONNECT_MAX_DELAY   = 30
+SESSION_BACKLOG       = 1000    # commands a session.Session keeps while disconnected, oldest dropped first
+STATS_SOCKET          = None
+ADMIN_SOCKET          = None    # Unix-domain socket taking the admin commands of standard input, None for standard input only
+UPGRADE_SOCKET        = None    # Unix-domain socket a new server process connects to to take this one over, None for no handoff
+HANDOFF_TIMEOUT       = 10      # seconds the handoff of the sockets and state to a new server process may take
+DRAIN_TIMEOUT         = 30      # seconds DRAIN waits for the outbound queues to be written out before the server stops
+LOG_LEVEL             = "INFO"
 
 class switch(Enum):
     ON = True
     OFF = False
+
+class overflow(Enum):
+    DROP_OLDEST = "drop"
+    DISCONNECT  = "disconnect"
+    BLOCK       = "block"
+
+OVERFLOW_POLICY = overflow.DROP_OLDEST
+
+class delimiter(Enum):
+    NEWLINE       = "newline"
+    LENGTH_PREFIX = "length"
+
+FRAME_DELIMITER = delimiter.NEWLINE
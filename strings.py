@@ -5,14 +5,48 @@ NEW_LINE              = "\n"
 DEFAULT_USERNAME      = "username"
 TRYING_CONNECTION     = "trying connection"
 CAN_NOT_CONNECT       = "can not connect"
+TLS_FAILED            = "tls handshake failed: "
 CONNECTION_SUCCESS    = "connection successful"
 YOUR_NAME             = "Your name please"
 DISCONNECTED_FROM_SERVER = "Disconnect from server"
 USER                  = "User "
 
 SERVER_STARTED        = "server started: ctl + c to exit or exit to exit"
+SERVER_DESCRIPTION    = "internet relay chat server"
+CLIENT_DESCRIPTION    = "internet relay chat client"
+TLS_HELP              = "connect to the server over TLS"
+COMPRESS_HELP         = "ask the server to compress what it sends"
+TLS_CA_HELP           = "PEM file of the certificates to trust, the system's when omitted"
+ASYNC_HELP            = "serve clients with the asyncio event loop instead of select"
+WORKERS_HELP          = "number of worker processes sharing the port, rooms are spread over them"
+WORKERS_WITH_ASYNC    = "--workers runs select loop workers and can not be combined with --async"
+WORKER_STARTED        = "worker started"
+PORT_HELP             = "port to serve clients on"
+NODE_HELP             = "name of this server in a network of servers, host:port by default"
+PEER_PORT_HELP        = "port to accept links from other servers on"
+PEERS_HELP            = "comma separated host:port list of other servers to link to"
+PEERS_WITH_WORKERS    = "linked servers run a single select loop and can not be combined with --workers or --async"
+INVALID_PEER          = "invalid peer address "
+PEER_UNRESOLVED       = "peer address could not be resolved, not linking to"
+DATA_DIR_HELP         = "directory to keep the log and snapshots of rooms, memberships and history in, workers use a subdirectory each"
+ARCHIVE_DIR_HELP      = "directory to archive room messages in for SRCH, workers use a subdirectory each"
+STATS_SOCKET_HELP     = "Unix-domain socket path serving metrics in Prometheus text format, workers add .index"
+TLS_CERT_HELP         = "PEM file with the certificate chain to serve clients over TLS with, plain TCP when omitted"
+TLS_KEY_HELP          = "PEM file with the private key of the certificate, when it is not in the certificate file"
+PRESENCE_WINDOW_HELP  = "seconds to coalesce the joins and leaves of a room over into one notice, 0 to announce each at once"
+PRESENCE_LIMIT_HELP   = "rooms with more members than this get no join and leave notices"
+TRACE_SAMPLE_HELP     = "trace one in this many messages from ingress to receiver acknowledgement, 0 to trace none"
+TRACE_FILE_HELP       = "file to append message traces to as JSON lines, instead of the log"
+ADMIN_SOCKET_HELP     = "Unix-domain socket path taking admin commands, as typed on standard input, workers add .index"
+UPGRADE_SOCKET_HELP   = "Unix-domain socket path a new server started with --takeover connects to, to take this one over without disconnecting clients"
+TAKEOVER_HELP         = "take over the server listening for a successor on this socket path: its port, clients, rooms and history"
+UPGRADE_UNSUPPORTED   = "handing a server over needs a single select loop without TLS, and can not be combined with --workers, --async or linked servers"
+NO_RATE_LIMITS_HELP   = "do not limit the commands and messages of clients and rooms, for benchmarks"
+LOG_LEVEL_HELP        = "lowest level of log messages to print, DEBUG prints every client command"
 
 SERVER_STOPPED        = "server stopped"
+FILE_LIMIT_KEPT       = "open file limit could not be raised, connections limited to about"
+STDIN_UNWATCHED       = "standard input can not be watched, admin commands only on the admin socket"
 NEW_CLIENT            = "new client"
 WELCOME_CLIENT        = "welcome user \n"
 CLIENT_INPUT          = "client input received"
@@ -21,12 +55,10 @@ CLIENT_DISCONNECT     = "server disconnected"
 CLIENT_DISCONNECT_ERR = "server disconnect error"
 CLIENT_ALREADY_IN     = "you are already in the system"
 CLIENT_EXISTS         = "name exists"
+INVALID_USER_NAME     = "invalid user name"
 INPUT_INVALID         = "input invalid"
 UNKNOWN_COMMAND       = "command invalid Type - HELP"
-ROOMS                 = "rooms"
-CLIENTS               = "clients"
-NAME                  = "name"
-SOCKET                = "socket"
+FRAME_TOO_LARGE       = "command too long"
 
 ROOMS_AVAILABLE_TITLE = "Available rooms \n"
 NO_ROOMS_TITLE        = "Sorry, no rooms "
@@ -34,13 +66,65 @@ INVALID_ROOM_NAME     = "invalid room name"
 ROOM_DOES_NOT_EXIST   = "room does not exist"
 ROOM_MEMBERS          = "room members \n"
 ROOM_ADDED            = "new room added"
+ROOM_EXISTS           = "room exists"
 ALREADY_MEMBER        = "you are already member"
 NEW_MEMBER_JOINED     = "new member joined in room"
 MEMBER_LEFT           = "one member left the room"
+PRESENCE_CHANGES      = "presence in room "
+PRESENCE_JOINED       = " joined, "
+PRESENCE_LEFT         = " left"
+MORE_MEMBERS          = "more members, continue with "
+INVALID_MEMBERS_PAGE  = "invalid members page, continue with the offset lime answered"
 YOU_LEFT_ROOM         = "you left the room"
 MEMBERSHIP_GRANTED    = "Membership granted to the room"
 NOT_MEMBER            = "you are not member"
 INVALID_MESSAGE_FORMAT = "invalid message format"
+MESSAGE_NOT_SENT      = "message not sent"
+BATCH_DONE            = "batch done, commands run: "
+BATCH_TOO_LARGE       = "batch too large, commands dropped"
+BATCH_UNANSWERED      = "batch done, answers too large to send, commands run: "
+BATCH_NESTED          = "batch already open"
+PRIVATE_SENT          = "private message sent to "
+PRIVATE_NOT_SENT      = "private message not sent"
+USERS_OFFLINE         = "offline users "
+USERS_UNKNOWN         = "unknown users "
+SEARCH_RESULTS        = "\nsearch results \n"
+NO_RESULTS            = "no results"
+INVALID_SEARCH        = "invalid search, the server may not keep an archive"
+ROOMS_REJOINED        = "rejoined rooms \n"
+ROOM_HISTORY          = "\nroom history \n"
+NO_HISTORY            = "no history"
+INVALID_HISTORY_REQUEST = "invalid history request"
+RATE_LIMITED          = "rate limited, slow down"
+ROOMS_RATE_LIMITED    = "rate limited rooms "
+SUBSCRIBED            = "subscribed to rooms matching "
+ALREADY_SUBSCRIBED    = "you already subscribe to "
+UNSUBSCRIBED          = "unsubscribed from "
+NOT_SUBSCRIBED        = "you do not subscribe to "
+INVALID_PATTERN       = "invalid pattern, room name segments separated by dots, * for one segment and # for any"
+INVALID_ACK           = "invalid acknowledgement, give the room name and a message id"
+ACKNOWLEDGED_BY       = "acknowledged by "
+ACKNOWLEDGED_OF       = " of "
+ACKNOWLEDGED_MEMBERS  = " members"
+NOT_ACKNOWLEDGED      = ", waiting for \n"
+ADMIN_STATS           = "signed in users {clients}\nconnections {connections}\nrooms {rooms}\nsubscriptions {subscriptions}\nqueued bytes {queued}\nuptime seconds {uptime}\ndraining {draining}"
+ADMIN_UNKNOWN         = "admin command invalid, commands: stats, kick + user name, drain, set + setting + value, exit"
+ADMIN_WORKERS         = "admin commands other than exit are served on the admin socket of each worker, --admin-socket path.index"
+HANDED_OFF            = "server handed over to a new process, clients"
+TOOK_OVER             = "server taken over from the previous process, clients"
+HANDOFF_FAILED        = "server handoff failed"
+WAL_WRITE_FAILED      = "data directory write failed, retrying:"
+WAL_RECORDS_LOST      = "data directory write failed while stopping, records not kept:"
+YES                   = "yes"
+NO                    = "no"
+KICKED                = "\nyou were disconnected by the server operator"
+USER_KICKED           = "disconnected "
+KICK_UNKNOWN          = "no user signed in on this server named "
+SERVER_DRAINING       = "\nserver shutting down, reconnect later"
+DRAINING              = "draining, queued bytes "
+SETTING_CHANGED       = " changed "
+UNKNOWN_SETTING       = "setting can not be changed at run time, settings: "
+INVALID_SETTING       = "invalid value for "
 EXIT_SUCCESSFUL       = "'\n exit successfull"
 
 USER = "USER"
@@ -50,6 +134,24 @@ ROOM = "ROOM"
 JOIN = "JOIN"
 LEVE = "LEVE"
 SEND = "SEND"
+HIST = "HIST"
+SUBS = "SUBS"
+USUB = "USUB"
+ACKS = "ACKS"
+RCPT = "RCPT"
+SRCH = "SRCH"
+PMSG = "PMSG"
 HELP = "HELP"
 EXIT = "EXIT"
-HELP_MESSAGE = "\n commands \n liro - list all rooms \n lime + room name - list all members \n room + room name - create new room \n join + room name - join the room \n leve + room name - leave the room \n send + room name + message - send given message to given room \n help - to see help \n exit - to exit \n"
\ No newline at end of file
+PING = "PING"
+PONG = "PONG"
+STATS = "STATS"
+KICK = "KICK"
+DRAIN = "DRAIN"
+SET = "SET"
+BATCH = "BATCH"
+ZLIB = "ZLIB"
+FRAME = "FRAME"
+END = "END"
+UNKNOWN = "UNKNOWN"
+HELP_MESSAGE = "\n commands \n liro - list all rooms \n lime + room name + optional offset - list the members, a page at a time \n room + room name - create new room \n join + room name - join the room \n leve + room name - leave the room \n send + room name + message - send given message to given room, or to rooms separated by commas \n batch, commands, end - run the commands in one pass with one combined answer \n pmsg + user names separated by commas + message - send given message to given users \n hist + room name + count or #id - replay the latest messages or the ones after the given id \n subs + room name pattern - receive the messages of the rooms matching the pattern, such as ops.* or alerts.#, without joining them \n usub + room name pattern - stop receiving them \n acks + room name + message id - acknowledge the messages of the room up to the id \n rcpt + room name + message id - see which members acknowledged the message \n srch + room name + from + to + optional term - search the archived messages sent between two times, given as epoch seconds or ISO dates \n ping - check that the server answers \n help - to see help \n exit - to exit \n"
\ No newline at end of file
@@ -4,7 +4,40 @@
 import settings
 import strings
 import manager
+import connection
+import cluster
+import metrics
+import ratelimit
+import topics
+import compression
+import tracing
+import itertools
 import sys
+import time
+
+INVALID  = object() # returned by an argument parser for malformed arguments
+BATCH    = strings.BATCH.encode(settings.SUPPORTED_TEXT_TYPE)
+END      = strings.END.encode(settings.SUPPORTED_TEXT_TYPE)
+
+class Command:
+    """
+    A command verb with the manager function handling it, the parser its arguments are checked
+    and converted with, and the answer sent when they are malformed.
+    """
+    __slots__ = ("name", "handler", "parse", "error")
+
+    def __init__(self, name, handler, parse, error=None):
+        """
+        Args:
+            name (str): The command verb.
+            handler (callable): Called with the parsed arguments and the client connection.
+            parse (callable): Converts the argument bytes, returning INVALID when they are malformed.
+            error (str): The answer to malformed arguments.
+        """
+        self.name    = name
+        self.handler = handler
+        self.parse   = parse
+        self.error   = error.encode(settings.SUPPORTED_TEXT_TYPE) if error else None
 
 def execute(client_input_string: str, client) -> None:
     """
@@ -14,39 +47,249 @@ def execute(client_input_string: str, client) -> None:
         client_input_string (str): The client input string.
         client: The client object.
     """
-    command_string = client_input_string.strip()
-    if len(command_string) < settings.MIN_COMMAND_SIZE: 
+    execute_frame(client_input_string.encode(settings.SUPPORTED_TEXT_TYPE), client)
+
+def execute_frame(frame, client) -> None:
+    """
+    Executes a command received as a frame of bytes. The frame is copied out of the receive buffer
+    once and never decoded as a whole: the verb is looked up as bytes and the arguments are
+    converted by the command's parser. Between BATCH and END, commands are collected and run
+    together when the batch ends.
+
+    Args:
+        frame (bytes | memoryview): The command.
+        client: The client connection.
+    """
+    data = (frame if type(frame) is bytes else bytes(frame)).strip()
+    if client.batch is not None:
+        collect(data, client)
+    elif len(data) == len(BATCH) and data.upper() == BATCH:
+        client.batch = []
+        client.batched = 0
+    elif len(data) < settings.MIN_COMMAND_SIZE:
         client.send(strings.INPUT_INVALID.encode(settings.SUPPORTED_TEXT_TYPE))
     else:
-        command = command_string[0:4].upper()
-        argument = command_string[5:]
-        command_to_fun(command, argument, client)
+        dispatch(data, client)
 
-def command_to_fun(command, argument, client):
+def collect(data, client):
     """
-    Maps a command string to a corresponding function call in the `manager` module.
+    Adds a command to the batch being received, or runs the batch when it ends. A batch of more than
+    settings.MAX_BATCH_COMMANDS commands, or settings.MAX_BATCH_BYTES bytes of commands, is dropped.
 
     Args:
-        command (str): The command to execute.
-        argument (str): The argument to the command.
+        data (bytes): The command.
+        client: The client connection.
+
+    Returns: None
+    """
+    keyword = data.upper() if len(data) <= len(BATCH) else None
+    if keyword == END:
+        run_batch(client)
+    elif keyword == BATCH:
+        client.send(strings.BATCH_NESTED.encode(settings.SUPPORTED_TEXT_TYPE))
+    elif len(client.batch) == settings.MAX_BATCH_COMMANDS or client.batched + len(data) > settings.MAX_BATCH_BYTES:
+        client.batch = None
+        client.send(strings.BATCH_TOO_LARGE.encode(settings.SUPPORTED_TEXT_TYPE))
+    else:
+        client.batch.append(data)
+        client.batched += len(data)
+
+def run_batch(client):
+    """
+    Runs the commands of a batch in one pass, holding back their answers, then sends all answers
+    at once behind a line counting the commands run. When the answers do not fit the connection's
+    outbound limit, only the count is sent, saying that the answers were too large.
+
+    Args:
+        client: The client connection.
+
+    Returns: None
+    """
+    commands = client.batch
+    client.batch = None
+    client.held = []
+    client.withheld = 0
+    try:
+        for data in commands:
+            execute_frame(data, client)
+    finally:
+        answers = client.held
+        client.held = None
+    answer = strings.BATCH_DONE + str(len(commands)) + strings.NEW_LINE
+    answer = answer.encode(settings.SUPPORTED_TEXT_TYPE) + strings.NEW_LINE.encode(settings.SUPPORTED_TEXT_TYPE).join(answers)
+    if client.withheld > client.limit or not client.send(answer):
+        client.send((strings.BATCH_UNANSWERED + str(len(commands))).encode(settings.SUPPORTED_TEXT_TYPE))
+
+async def execute_async(frame, client) -> None:
+    """
+    Executes a command for a client served by the asyncio server, then applies the overflow
+    policies of the receivers the command queued data for.
+
+    Args:
+        frame (bytes | memoryview): The command.
+        client: The client connection.
+    """
+    execute_frame(frame, client)
+    await connection.settle()
+
+def dispatch(data, client):
+    """
+    Looks up the command of a frame in the compiled table, checks its arguments
+    against the command's parser and calls the `manager` function handling it. In a multi-process
+    server, commands for rooms owned by another worker are forwarded to it instead. Every command
+    costs one token of the connection's command budget, and is rejected when the budget is spent.
+    Counts the command and the time spent handling it in metrics.
+
+    Args:
+        data (bytes): The command, stripped of surrounding whitespace.
         client: The client connection.
 
     Returns:
         None
     """
-    actions = {
-        strings.USER: manager.create_user,
-        strings.LIRO: manager.list_rooms,
-        strings.LIME: manager.list_members,
-        strings.ROOM: manager.create_room,
-        strings.JOIN: manager.join_room,
-        strings.LEVE: manager.leave_room,
-        strings.SEND: manager.send_message,
-        strings.HELP: help_commands,
-    }
-    action = actions.get(command, lambda _, client: client.send(strings.UNKNOWN_COMMAND.encode(settings.SUPPORTED_TEXT_TYPE)))
-    action(argument, client)
-    
+    command = COMMANDS.get(data[:4])
+    start = time.perf_counter()
+    if command is None:
+        client.send(strings.UNKNOWN_COMMAND.encode(settings.SUPPORTED_TEXT_TYPE))
+        name = strings.UNKNOWN
+    elif not ratelimit.allow(1, client.command_budget):
+        client.send(strings.RATE_LIMITED.encode(settings.SUPPORTED_TEXT_TYPE))
+        name = command.name
+    else:
+        name = command.name
+        argument = data[5:]
+        value = command.parse(argument)
+        if value is INVALID:
+            client.send(command.error)
+        elif cluster.workers == 1 or not cluster.forward(name, argument.decode(settings.SUPPORTED_TEXT_TYPE, 'replace'), client):
+            if tracing.sample:
+                tracing.run(command, value, client)
+            else:
+                command.handler(value, client)
+    metrics.observe_command(name, time.perf_counter() - start)
+
+def parse_none(argument):
+    """
+    Parses the arguments of a command taking none, ignoring anything given.
+
+    Args:
+        argument (bytes): The argument bytes.
+
+    Returns:
+        None
+    """
+    return None
+
+def parse_text(argument):
+    """
+    Parses free text.
+
+    Args:
+        argument (bytes): The argument bytes.
+
+    Returns:
+        str: The decoded text.
+    """
+    return argument.decode(settings.SUPPORTED_TEXT_TYPE, 'replace')
+
+def parse_name(argument):
+    """
+    Parses a room name: one word, not empty, without the commas SEND and PMSG separate names with.
+
+    Args:
+        argument (bytes): The argument bytes.
+
+    Returns:
+        str: The name, or INVALID.
+    """
+    if not argument or b" " in argument or b"," in argument:
+        return INVALID
+    return argument.decode(settings.SUPPORTED_TEXT_TYPE, 'replace')
+
+def parse_user(argument):
+    """
+    Parses a user name, following the rules of room names so that PMSG can address it, optionally
+    followed by a compression capability the server offers.
+
+    Args:
+        argument (bytes): The argument bytes.
+
+    Returns:
+        str: The name and the capability, or INVALID.
+    """
+    name, separator, capability = argument.partition(b" ")
+    if parse_name(name) is INVALID or separator and compression.negotiate(parse_text(capability)) is None:
+        return INVALID
+    return parse_text(argument)
+
+def parse_pattern(argument):
+    """
+    Parses a room name pattern: one word of segments separated by dots, * and # only as whole segments.
+
+    Args:
+        argument (bytes): The argument bytes.
+
+    Returns:
+        str: The pattern, or INVALID.
+    """
+    name = parse_name(argument)
+    if name is INVALID or not topics.valid(name):
+        return INVALID
+    return name
+
+def parse_targets_text(argument):
+    """
+    Parses a comma separated list of names followed by a message. The message stays bytes all the
+    way to the receivers; only text that is not plain ASCII is checked to be valid UTF-8.
+
+    Args:
+        argument (bytes): The argument bytes.
+
+    Returns:
+        tuple: The names as str and the message as bytes, or INVALID.
+    """
+    split = argument.find(b" ")
+    if split <= 0 or split + 1 == len(argument):
+        return INVALID
+    message = argument[split + 1:]
+    if not message.isascii():
+        message = message.decode(settings.SUPPORTED_TEXT_TYPE, 'replace').encode(settings.SUPPORTED_TEXT_TYPE)
+    return argument[:split].decode(settings.SUPPORTED_TEXT_TYPE, 'replace'), message
+
+def parse_name_rest(argument):
+    """
+    Parses a room name optionally followed by more arguments.
+
+    Args:
+        argument (bytes): The argument bytes.
+
+    Returns:
+        tuple: The name and the rest of the arguments as str, None without any, or INVALID.
+    """
+    name, separator, rest = argument.partition(b" ")
+    if not name:
+        return INVALID
+    text = rest.decode(settings.SUPPORTED_TEXT_TYPE, 'replace') if separator else None
+    return name.decode(settings.SUPPORTED_TEXT_TYPE, 'replace'), text
+
+def compile_commands(commands):
+    """
+    Builds the dispatch table, mapping every spelling of each verb, in any mix of upper and lower
+    case, to its command, so verbs are matched on the raw bytes without changing their case.
+
+    Args:
+        commands (tuple): The commands.
+
+    Returns:
+        dict: Maps 4-byte verbs to commands.
+    """
+    table = {}
+    for command in commands:
+        verb = command.name.encode(settings.SUPPORTED_TEXT_TYPE)
+        for spelling in itertools.product(*((bytes([c]).lower(), bytes([c]).upper()) for c in verb)):
+            table[b"".join(spelling)] = command
+    return table
+
 def help_commands(argument, client):
     """
     Send a help message to the client.
@@ -60,32 +303,52 @@ def help_commands(argument, client):
     """
     client.send(strings.HELP_MESSAGE.encode(settings.SUPPORTED_TEXT_TYPE))
 
-
-def direct(name):
+def ping(argument, client):
     """
-    Print a direct prompt to the console.
+    Answers a PING from the client with a PONG.
 
     Parameters:
-    name (str): Username of the client.
+    argument (str): Argument for the ping command (not used in this function).
+    client (socket): Client socket object.
 
     Returns:
     None
     """
-    print(f'> {name} $ ', end='', flush=True) 
+    client.send(strings.PONG.encode(settings.SUPPORTED_TEXT_TYPE))
 
-
-def print_response(response):
+def pong(argument, client):
     """
-    Print a response to the console.
+    Accepts the client's answer to a PING. Like any input, it has already marked the client as
+    alive, so there is nothing left to do.
 
     Parameters:
-    response (str): Response message.
+    argument (str): Argument for the pong command (not used in this function).
+    client (socket): Client socket object.
 
     Returns:
     None
     """
-    print(f"\n{response}\n")
-    direct(manager.username)
+
+# 4-byte verb -> Command, built at import as manager never imports this module back
+COMMANDS = compile_commands((
+    Command(strings.USER, manager.create_user, parse_user, strings.INVALID_USER_NAME),
+    Command(strings.LIRO, manager.list_rooms, parse_none),
+    Command(strings.LIME, manager.list_members, parse_name_rest, strings.INVALID_ROOM_NAME),
+    Command(strings.ROOM, manager.create_room, parse_name, strings.INVALID_ROOM_NAME),
+    Command(strings.JOIN, manager.join_room, parse_name, strings.INVALID_ROOM_NAME),
+    Command(strings.LEVE, manager.leave_room, parse_name, strings.INVALID_ROOM_NAME),
+    Command(strings.SEND, manager.send_message, parse_targets_text, strings.INVALID_MESSAGE_FORMAT),
+    Command(strings.PMSG, manager.private_message, parse_targets_text, strings.INVALID_MESSAGE_FORMAT),
+    Command(strings.HIST, manager.room_history, parse_name_rest, strings.INVALID_HISTORY_REQUEST),
+    Command(strings.SRCH, manager.search_archive, parse_name_rest, strings.INVALID_SEARCH),
+    Command(strings.SUBS, manager.subscribe, parse_pattern, strings.INVALID_PATTERN),
+    Command(strings.USUB, manager.unsubscribe, parse_pattern, strings.INVALID_PATTERN),
+    Command(strings.ACKS, manager.acknowledge, parse_name_rest, strings.INVALID_ACK),
+    Command(strings.RCPT, manager.receipts, parse_name_rest, strings.INVALID_ACK),
+    Command(strings.HELP, help_commands, parse_none),
+    Command(strings.PING, ping, parse_none),
+    Command(strings.PONG, pong, parse_none),
+))
 
 
 def filter_client_command(command, client):
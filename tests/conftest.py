@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+# the modules live at the top of the repository and import each other by name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+import strings
+import manager
+import registry
+import connection
+import terminal
+
+WAIT = 5 # seconds a test waits for a server to start or to answer
+
+def free_port():
+    """
+    Returns a TCP port nothing listens on right now.
+    """
+    with socket.socket() as probe:
+        probe.bind((settings.LOCAL_HOST, 0))
+        return probe.getsockname()[1]
+
+class Client:
+    """
+    A blocking test client speaking the line protocol to a server process.
+    """
+
+    def __init__(self, port):
+        deadline = time.monotonic() + WAIT
+        while True:
+            try:
+                self.socket = socket.create_connection((settings.LOCAL_HOST, port), WAIT)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        self.received = b""
+
+    def send(self, line):
+        self.socket.sendall(line.encode(settings.SUPPORTED_TEXT_TYPE) + b"\n")
+
+    def expect(self, text, timeout=WAIT):
+        """
+        Reads until text arrives, and returns what arrived up to and including it.
+        """
+        wanted = text.encode(settings.SUPPORTED_TEXT_TYPE)
+        deadline = time.monotonic() + timeout
+        while wanted not in self.received:
+            self.socket.settimeout(max(deadline - time.monotonic(), 0.01))
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                raise AssertionError(f"{text!r} not received, got {self.received!r}")
+            if not data:
+                raise AssertionError(f"{text!r} not received before hang-up, got {self.received!r}")
+            self.received += data
+        end = self.received.index(wanted) + len(wanted)
+        answer, self.received = self.received[:end], self.received[end:]
+        return answer.decode(settings.SUPPORTED_TEXT_TYPE)
+
+    def ask(self, line):
+        """
+        Sends a command followed by a PING, and returns what arrived before the PONG.
+        """
+        self.send(line)
+        self.send(strings.PING)
+        return self.expect(strings.PONG)[:-len(strings.PONG)]
+
+    def close(self):
+        self.socket.close()
+
+@pytest.fixture
+def launch():
+    """
+    Starts server.py processes with the given options on a free port each, returning the port,
+    and stops them after the test.
+    """
+    processes = []
+
+    def start(*options, port=None):
+        port = port or free_port()
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port), *options],
+                                   cwd=ROOT, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        processes.append(process)
+        Client(port).close()
+        return port
+
+    start.processes = processes
+    yield start
+    for process in processes:
+        process.kill()
+        process.wait()
+        process.stderr.close()
+
+@pytest.fixture
+def connect():
+    """
+    Connects test clients to a server port, closing them after the test.
+    """
+    clients = []
+
+    def open_client(port, name=None):
+        client = Client(port)
+        clients.append(client)
+        if name is not None:
+            client.send("USER " + name)
+            client.expect(strings.HELP_MESSAGE)
+        return client
+
+    yield open_client
+    for client in clients:
+        client.close()
+
+class Chat:
+    """
+    Runs commands in process through terminal.execute_frame, for connections over socket pairs,
+    against a registry of its own.
+    """
+
+    def __init__(self):
+        self.pairs = []
+
+    def connect(self, name=None, **options):
+        """
+        Opens a connection, signed in as name unless it is None.
+        """
+        near, far = socket.socketpair()
+        self.pairs.append((near, far))
+        client = connection.SocketConnection(near, **options)
+        if name is not None:
+            self.run(client, "USER " + name)
+        return client
+
+    def run(self, client, *lines):
+        """
+        Runs command lines for a connection, and returns what the connection was sent meanwhile.
+        """
+        self.output(client)
+        for line in lines:
+            terminal.execute_frame(line.encode(settings.SUPPORTED_TEXT_TYPE), client)
+        return self.output(client)
+
+    def output(self, client):
+        """
+        Takes the data queued for a connection.
+        """
+        data = b"".join(bytes(chunk) for chunk in client.outbound)
+        client.outbound.clear()
+        client.pending = 0
+        client.started = False
+        connection.writers.discard(client)
+        return data.decode(settings.SUPPORTED_TEXT_TYPE)
+
+@pytest.fixture
+def chat(monkeypatch):
+    """
+    Serves commands in process against an empty registry, announcing presence changes at once.
+    """
+    fresh = registry.Registry()
+    monkeypatch.setattr(manager, "registry", fresh)
+    monkeypatch.setattr(manager, "clients", fresh.clients)
+    monkeypatch.setattr(manager, "rooms", fresh.rooms)
+    monkeypatch.setattr(settings, "PRESENCE_WINDOW", 0)
+    session = Chat()
+    yield session
+    for client in list(connection.opened):
+        client.close()
+    for near, far in session.pairs:
+        near.close()
+        far.close()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+
+import pytest
+
+import settings
+import strings
+import admin
+
+@pytest.fixture
+def tunables():
+    """
+    Restores the settings SET may change after the test.
+    """
+    saved = {key: getattr(settings, key) for key in admin.TUNABLES}
+    yield
+    for key, value in saved.items():
+        setattr(settings, key, value)
+
+class Console:
+    """
+    A connection to the admin socket of a server process.
+    """
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(5)
+        self.socket.connect(path)
+
+    def execute(self, line):
+        self.socket.sendall(line.encode(settings.SUPPORTED_TEXT_TYPE) + b"\n")
+        return self.read()
+
+    def read(self):
+        answer = b""
+        while not answer.endswith(b"\n"):
+            data = self.socket.recv(65536)
+            if not data:
+                break
+            answer += data
+        return answer.decode(settings.SUPPORTED_TEXT_TYPE)
+
+@pytest.fixture
+def console(launch, tmp_path):
+    """
+    Starts a server with an admin socket, returning its port and a function opening consoles.
+    """
+    path = str(tmp_path / "admin.sock")
+    port = launch("--admin-socket", path)
+    return port, lambda: Console(path)
+
+def test_set_changes_a_setting(tunables):
+    assert admin.change("max_frame_size", "4096") == "max_frame_size" + strings.SETTING_CHANGED + \
+        f"{settings.INPUT_SIZE} -> 4096"
+    assert settings.MAX_FRAME_SIZE == 4096
+    assert admin.change("overflow_policy", "drop").endswith("-> drop")
+    assert settings.OVERFLOW_POLICY is settings.overflow.DROP_OLDEST
+    assert admin.change("client_command_rate", "none").endswith("-> None")
+    assert settings.CLIENT_COMMAND_RATE is None
+
+@pytest.mark.parametrize("key, value", [
+    ("max_frame_size", "0"),
+    ("max_frame_size", "100"),
+    ("max_frame_size", "lots"),
+    ("outbound_limit", "0"),
+    ("outbound_limit", "-5"),
+    ("client_command_rate", "0"),
+    ("client_message_burst", "0"),
+    ("room_message_rate", "nan"),
+    ("max_batch_commands", "0"),
+    ("members_page", "0"),
+    ("idle_timeout", "0"),
+    ("overflow_policy", "explode"),
+])
+def test_set_rejects_values_below_the_minimum(tunables, key, value):
+    before = getattr(settings, key.upper())
+    assert admin.change(key, value) == strings.INVALID_SETTING + key
+    assert getattr(settings, key.upper()) == before
+
+def test_set_rejects_unknown_settings(tunables):
+    assert admin.change("port", "1").startswith(strings.UNKNOWN_SETTING)
+
+def test_unknown_command():
+    assert admin.execute("launch") == strings.ADMIN_UNKNOWN
+    assert admin.execute("  ") is None
+
+def test_oversized_console_command_closes_only_the_console(console):
+    port, open_console = console
+    oversized = open_console()
+    oversized.socket.sendall(b"x" * (settings.MAX_FRAME_SIZE + 10) + b"\n")
+    assert oversized.read() == strings.FRAME_TOO_LARGE + strings.NEW_LINE
+    # the server hangs up with the rest of the line unread, which may reset the connection
+    try:
+        assert oversized.read() == ""
+    except ConnectionResetError:
+        pass
+    assert "signed in users 0" in open_console().execute("stats")
+
+def test_stats_kick_and_drain(console, connect, launch):
+    port, open_console = console
+    alice = connect(port, "alice")
+    bob = connect(port, "bob")
+    admin_console = open_console()
+    stats = admin_console.execute("stats")
+    assert "signed in users 2" in stats
+    assert "draining no" in stats
+
+    assert admin_console.execute("kick alice").startswith(strings.USER_KICKED + "alice")
+    alice.expect(strings.KICKED)
+    assert alice.socket.recv(1) == b""
+    assert admin_console.execute("kick alice").startswith(strings.KICK_UNKNOWN)
+
+    assert admin_console.execute("set outbound_limit 0").startswith(strings.INVALID_SETTING)
+    assert admin_console.execute("set outbound_limit 4194304").startswith("outbound_limit" + strings.SETTING_CHANGED)
+
+    assert admin_console.execute("drain").startswith(strings.DRAINING)
+    bob.expect(strings.SERVER_DRAINING)
+    assert bob.socket.recv(1) == b""
+    launch.processes[0].wait(5)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+import settings
+import archive
+
+SECOND = 1000000000
+
+def filled(directory):
+    """
+    Archives messages of two rooms an hour apart in a directory, and reopens the archive.
+    """
+    messages = archive.Archive(directory)
+    start = 1700000000 * SECOND
+    for index in range(10):
+        messages.add("lobby", index + 1, start + index * 3600 * SECOND, b"hello %d" % index)
+        messages.add("other", index + 1, start + index * 3600 * SECOND, b"other %d" % index)
+    messages.close()
+    return archive.Archive(directory), start
+
+def found(results):
+    return [(message_id, bytes(body)) for message_id, _, body in results]
+
+def test_load_and_search(tmp_path):
+    messages, start = filled(str(tmp_path))
+    try:
+        assert found(messages.search("lobby", 0, start * 2)) == [(index + 1, b"hello %d" % index) for index in range(10)]
+        assert found(messages.search("other", start + 2 * 3600 * SECOND, start + 4 * 3600 * SECOND)) == \
+            [(3, b"other 2"), (4, b"other 3"), (5, b"other 4")]
+        assert found(messages.search("lobby", 0, start * 2, term=b"hello 7")) == [(8, b"hello 7")]
+        assert found(messages.search("lobby", 0, start * 2, limit=2)) == [(9, b"hello 8"), (10, b"hello 9")]
+        assert messages.search("missing", 0, start * 2) == []
+    finally:
+        messages.close()
+
+def test_appends_after_reopening(tmp_path):
+    messages, start = filled(str(tmp_path))
+    messages.add("lobby", 11, start + 10 * 3600 * SECOND, b"hello 10")
+    messages.add("new", 1, start, b"new 0")
+    messages.close()
+    messages = archive.Archive(str(tmp_path))
+    try:
+        assert found(messages.search("lobby", 0, start * 2, limit=2)) == [(10, b"hello 9"), (11, b"hello 10")]
+        assert found(messages.search("new", 0, start * 2)) == [(1, b"new 0")]
+    finally:
+        messages.close()
+
+def test_torn_heads(tmp_path):
+    messages, start = filled(str(tmp_path))
+    messages.close()
+    with open(os.path.join(str(tmp_path), archive.HEADS), "ab") as heads_file:
+        heads_file.write(b"\x01\x02\x03")
+    messages = archive.Archive(str(tmp_path))
+    try:
+        assert len(messages.heads) == 2
+        assert found(messages.search("other", 0, start * 2, limit=1)) == [(10, b"other 9")]
+    finally:
+        messages.close()
+
+def test_empty_archive(tmp_path):
+    messages = archive.Archive(str(tmp_path))
+    try:
+        assert messages.search("lobby", 0, settings.ARCHIVE_BUCKET * SECOND) == []
+    finally:
+        messages.close()
+
+def test_search_in_bounded_scans(tmp_path):
+    messages, start = filled(str(tmp_path))
+    try:
+        search = messages.query("lobby", 0, start * 2, term=b"hello")
+        scans = 1
+        while not search.scan(3):
+            scans += 1
+        assert scans == 4
+        assert found(search.results()) == [(index + 1, b"hello %d" % index) for index in range(10)]
+        assert messages.query("missing", 0, start * 2).scan(0)
+    finally:
+        messages.close()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import signal
+
+import strings
+import manager
+import cluster
+import terminal
+
+def test_links_join_every_pair_of_workers():
+    pairs = cluster.create_links(3)
+    try:
+        assert sorted(pairs) == [(0, 1), (0, 2), (1, 2)]
+        links = cluster.start(1, 3, pairs, terminal.execute)
+        assert sorted(link.peer for link in links) == [0, 2]
+        assert cluster.execute is terminal.execute
+        assert all(cluster.owner(name) in (0, 1, 2) for name in ("lobby", "alice", "ops.eu"))
+        for link in links:
+            link.close()
+    finally:
+        cluster.links.clear()
+        cluster.worker, cluster.workers, cluster.execute = 0, 1, None
+        cluster.close_links(pairs)
+
+def test_workers_forward_commands_and_messages(launch, connect):
+    port = launch("--workers", "2")
+    # the kernel spreads connections over the workers, so some of these land on each of them
+    users = [connect(port, "user%d" % index) for index in range(10)]
+    assert strings.ROOM_ADDED in users[0].ask("ROOM lobby")
+    assert strings.ROOM_EXISTS in users[1].ask("ROOM lobby")
+    for user in users:
+        assert strings.MEMBERSHIP_GRANTED in user.ask("JOIN lobby")
+    users[0].send("SEND lobby hello")
+    for user in users[1:]:
+        assert "user0@lobby: hello" in user.expect("hello")
+
+    answer = users[3].ask("PMSG user0,user9 psst")
+    assert answer.startswith(strings.PRIVATE_SENT)
+    users[0].expect("user3@private: psst")
+    users[9].expect("user3@private: psst")
+
+    twin = connect(port)
+    twin.send("USER user5")
+    twin.expect(strings.CLIENT_EXISTS)
+
+    parent = launch.processes[0]
+    parent.send_signal(signal.SIGINT)
+    assert parent.wait(5) == 0
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import settings
+import strings
+import compression
+
+SHORT = b"hi"
+LONG  = (strings.NEW_MEMBER_JOINED * 40).encode(settings.SUPPORTED_TEXT_TYPE)
+
+def test_zlib_round_trip():
+    context = compression.negotiate("zlib")
+    data = context.encode(SHORT) + context.encode(LONG) + context.encode(b"")
+    assert data[0] == compression.RAW
+    assert data[compression.HEADER.size + len(SHORT)] == compression.ZLIB
+    assert len(data) < len(LONG)
+    assert list(compression.Decoder().frames(data)) == [SHORT, LONG, b""]
+
+def test_frame_context_does_not_deflate():
+    context = compression.negotiate("FRAME")
+    data = context.encode(LONG)
+    assert data == compression.HEADER.pack(compression.RAW, len(LONG)) + LONG
+    assert compression.Decoder().feed(data) == LONG
+
+def test_split_feeds():
+    context = compression.negotiate(strings.ZLIB)
+    data = context.encode(LONG) + context.encode(SHORT)
+    decoder = compression.Decoder()
+    frames = []
+    for index in range(len(data)):
+        frames.extend(decoder.frames(data[index:index + 1]))
+    assert frames == [LONG, SHORT]
+    assert decoder.buffer == b""
+
+def test_memoryview_input():
+    context = compression.negotiate(strings.ZLIB)
+    assert compression.Decoder().feed(context.encode(memoryview(LONG))) == LONG
+
+def test_negotiate_unknown():
+    assert compression.negotiate("gzip") is None
+
+def test_framed():
+    assert compression.framed(compression.negotiate(strings.FRAME).encode(SHORT))
+    assert not compression.framed(b"Welcome")
+    assert not compression.framed(b"")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import marshal
+import selectors
+import socket
+import time
+
+import pytest
+
+import settings
+import strings
+import connection
+import framing
+import federation
+import manager
+from conftest import free_port
+
+@pytest.fixture
+def network():
+    """
+    Runs federation as node b, with links added to a server stream of its own.
+    """
+    selector = selectors.DefaultSelector()
+    server_stream = connection.ServerStream(selector)
+    federation.node, federation.stream = "b", server_stream
+    yield server_stream
+    for link in list(federation.peers.values()):
+        link.close()
+    for table in (federation.peers, federation.routes, federation.unlinked, federation.parked,
+                  federation.seen, federation.history):
+        table.clear()
+    federation.node = federation.stream = None
+    selector.close()
+
+def link(server_stream, address=None):
+    """
+    Opens a link over a socket pair, as dialled to address or as accepted when address is None.
+    """
+    near, far = socket.socketpair()
+    peer = federation.Peer(near, address)
+    server_stream.add(peer)
+    return peer, far
+
+def handshake(peer, name):
+    federation.receive(peer, (federation.NODE, name, 0))
+
+def sent(peer, far):
+    """
+    Returns the events a link wrote to the node at its other end.
+    """
+    peer.flush()
+    far.setblocking(False)
+    data = b""
+    try:
+        while True:
+            data += far.recv(65536)
+    except BlockingIOError:
+        pass
+    decoder = framing.FrameDecoder(settings.delimiter.LENGTH_PREFIX, settings.LINK_MAX_FRAME_SIZE)
+    return [marshal.loads(frame) for frame in decoder.feed(data)]
+
+def test_duplicate_link_leaves_the_loop(network):
+    accepted, _ = link(network)
+    dialled, _ = link(network, ("127.0.0.1", 1))
+    handshake(accepted, "a")
+    handshake(dialled, "a")
+    assert federation.peers["a"] is accepted
+    assert dialled.closed
+    assert dialled not in network
+    assert dialled not in network.interest
+    assert accepted in network
+
+def test_both_ends_keep_the_link_of_the_first_node(network):
+    dialled, _ = link(network, ("127.0.0.1", 1))
+    accepted, _ = link(network)
+    handshake(dialled, "c")
+    handshake(accepted, "c")
+    # b sorts before c, so the link b opened is kept whichever handshake came first
+    assert federation.peers["c"] is dialled
+    assert accepted.closed
+
+    federation.peers.clear()
+    dialled, _ = link(network, ("127.0.0.1", 2))
+    accepted, _ = link(network)
+    handshake(accepted, "a")
+    handshake(dialled, "a")
+    assert federation.peers["a"] is accepted
+    assert dialled.closed
+
+def test_linked_peer_is_not_dialled_again(network):
+    accepted, _ = link(network)
+    dialled, _ = link(network, ("127.0.0.1", 1))
+    handshake(accepted, "a")
+    handshake(dialled, "a")
+    assert ("127.0.0.1", 1) not in federation.unlinked
+    assert federation.parked == {"a": ("127.0.0.1", 1)}
+
+    accepted.close()
+    assert "a" not in federation.peers
+    assert ("127.0.0.1", 1) in federation.unlinked
+    assert not federation.parked
+
+def test_link_to_itself_is_not_dialled_again(network):
+    dialled, _ = link(network, ("127.0.0.1", 1))
+    handshake(dialled, "b")
+    assert dialled.closed
+    assert not federation.unlinked
+
+def test_failed_connection_is_retried(network):
+    closed = socket.socket()
+    closed.bind((settings.LOCAL_HOST, 0))
+    address = closed.getsockname()
+    closed.close()
+    federation.unlinked[address] = 0
+    federation.connect_peers(network)
+    assert address not in federation.unlinked
+    deadline = time.monotonic() + 5
+    while address not in federation.unlinked and time.monotonic() < deadline:
+        _, write_list = network.select(0.1)
+        for peer in write_list:
+            if not peer.flush():
+                peer.close()
+    assert federation.unlinked[address] > time.monotonic()
+    assert not network
+
+def test_mutually_peered_nodes(launch, connect):
+    first_peer, second_peer = str(free_port()), str(free_port())
+    first = launch("--node", "a", "--peer-port", first_peer, "--peers", "localhost:" + second_peer)
+    second = launch("--node", "b", "--peer-port", second_peer, "--peers", "localhost:" + first_peer)
+    alice = connect(first, "alice")
+    bob = connect(second, "bob")
+    assert strings.ROOM_ADDED in alice.ask("ROOM lobby")
+    assert strings.MEMBERSHIP_GRANTED in alice.ask("JOIN lobby")
+
+    # the nodes link within a retry interval of each other, then the room reaches b
+    deadline = time.monotonic() + settings.PEER_RETRY_INTERVAL * 3
+    while True:
+        answer = bob.ask("JOIN lobby")
+        if strings.MEMBERSHIP_GRANTED in answer:
+            break
+        assert time.monotonic() < deadline, answer
+        time.sleep(0.2)
+
+    # a relays to b once bob's membership reached it, which alice hears as a presence notice
+    alice.expect(strings.NEW_MEMBER_JOINED)
+    alice.send("SEND lobby hello")
+    assert "alice@lobby: hello" in bob.expect("hello")
+    bob.send("SEND lobby back")
+    assert "bob@lobby: back" in alice.expect("back")
+    assert "hello" not in bob.ask("HELP")
+
+    # a rejected duplicate link used to stay registered with the selector, and crashed the node
+    # once a new socket reused its descriptor, while both nodes kept dialling each other
+    time.sleep(settings.PEER_RETRY_INTERVAL * 2 + 1)
+    for port in (first, second):
+        connect(port, "carol" + str(port))
+    assert all(process.poll() is None for process in launch.processes)
+    alice.send("SEND lobby again")
+    bob.expect("again")
+
+def test_events_are_applied_and_flooded_once(network, chat):
+    first, first_end = link(network)
+    second, second_end = link(network)
+    handshake(first, "a")
+    handshake(second, "c")
+    sent(first, first_end), sent(second, second_end)
+
+    for peer in (first, second, first):
+        federation.receive(peer, (federation.RMAD, "a", 1, "lobby"))
+    assert "lobby" in manager.rooms
+    assert sent(second, second_end) == [(federation.RMAD, "a", 1, "lobby")]
+    assert sent(first, first_end) == []
+
+def test_room_messages_are_relayed_toward_members_once(network, chat):
+    first, first_end = link(network)
+    second, second_end = link(network)
+    handshake(first, "a")
+    handshake(second, "c")
+    federation.receive(first, (federation.RMAD, "a", 1, "lobby"))
+    federation.receive(first, (federation.NICK, "a", 2, "dave"))
+    federation.receive(first, (federation.JOIN, "a", 3, "lobby", "dave"))
+    alice = chat.connect("alice")
+    chat.run(alice, "JOIN lobby")
+    sent(first, first_end), sent(second, second_end)
+
+    # a message from a reaches alice once, however many links it arrives on
+    message = (federation.RMSG, "a", 4, "lobby", "dave", b"hi")
+    federation.receive(first, message)
+    federation.receive(second, message)
+    assert chat.output(alice) == "\n#1 dave@lobby: hi"
+
+    # alice's message goes only to a, where the room has a member
+    assert chat.run(alice, "SEND lobby hello") == "#2 You@lobby: hello"
+    assert [event[3:] for event in sent(first, first_end)] == [("lobby", "alice", b"hello")]
+    assert sent(second, second_end) == []
+
+    # once dave leaves, nothing is relayed to a either
+    federation.receive(first, (federation.LEVE, "a", 5, "lobby", "dave"))
+    chat.run(alice, "SEND lobby again")
+    assert sent(first, first_end) == []
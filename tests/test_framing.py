@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import settings
+import framing
+
+def decode(decoder, *chunks):
+    """
+    Feeds chunks to a decoder one after the other and collects the frames they complete.
+    """
+    return [bytes(frame) for chunk in chunks for frame in decoder.feed(chunk)]
+
+def test_newline_frames_split_across_reads():
+    decoder = framing.FrameDecoder(settings.delimiter.NEWLINE, 64)
+    assert decode(decoder, b"he", b"llo\r", b"\nwor", b"ld\nnext") == [b"hello", b"world"]
+    assert decoder.unread() == b"next"
+    assert decode(decoder, b"\n") == [b"next"]
+    assert decoder.unread() == b""
+
+def test_newline_frames_in_one_read():
+    decoder = framing.FrameDecoder(settings.delimiter.NEWLINE, 64)
+    assert decode(decoder, b"a\nb\r\n\nc\n") == [b"a", b"b", b"", b"c"]
+
+def test_newline_frame_longer_than_buffer():
+    decoder = framing.FrameDecoder(settings.delimiter.NEWLINE, settings.RECEIVE_BUFFER_SIZE * 4)
+    line = b"x" * (settings.RECEIVE_BUFFER_SIZE * 3)
+    assert decode(decoder, line[:1000], line[1000:], b"\n") == [line]
+    assert len(decoder.buffer) == settings.RECEIVE_BUFFER_SIZE
+
+def test_newline_frame_too_large():
+    decoder = framing.FrameDecoder(settings.delimiter.NEWLINE, 8)
+    with pytest.raises(framing.FrameTooLarge):
+        decode(decoder, b"123456789")
+    decoder = framing.FrameDecoder(settings.delimiter.NEWLINE, 8)
+    with pytest.raises(framing.FrameTooLarge):
+        decode(decoder, b"123456789\n")
+
+def test_newline_frame_at_max_size():
+    decoder = framing.FrameDecoder(settings.delimiter.NEWLINE, 8)
+    assert decode(decoder, b"12345678\n") == [b"12345678"]
+
+def test_length_prefixed_frames_split_across_reads():
+    decoder = framing.FrameDecoder(settings.delimiter.LENGTH_PREFIX, 64)
+    data = framing.encode_frame(b"hello") + framing.encode_frame(b"") + framing.encode_frame(b"a\nb")
+    assert decode(decoder, *(data[index:index + 1] for index in range(len(data)))) == [b"hello", b"", b"a\nb"]
+    assert decoder.unread() == b""
+
+def test_length_prefixed_frame_longer_than_buffer():
+    decoder = framing.FrameDecoder(settings.delimiter.LENGTH_PREFIX, settings.RECEIVE_BUFFER_SIZE * 4)
+    payload = bytes(range(256)) * (settings.RECEIVE_BUFFER_SIZE * 3 // 256)
+    data = framing.encode_frame(payload)
+    assert decode(decoder, data[:3], data[3:5000], data[5000:]) == [payload]
+
+def test_length_prefixed_frame_too_large():
+    decoder = framing.FrameDecoder(settings.delimiter.LENGTH_PREFIX, 8)
+    with pytest.raises(framing.FrameTooLarge):
+        decode(decoder, framing.encode_frame(b"123456789")[:framing.HEADER.size])
+
+def test_encode_frame():
+    assert framing.encode_frame(b"abc") == b"\x00\x00\x00\x03abc"
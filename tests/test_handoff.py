@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+import strings
+
+def test_takeover_keeps_clients_rooms_and_partial_commands(launch, connect, tmp_path):
+    path = str(tmp_path / "upgrade.sock")
+    port = launch("--upgrade-socket", path)
+    alice, bob = connect(port, "alice"), connect(port, "bob")
+    alice.ask("ROOM lobby")
+    alice.ask("JOIN lobby")
+    bob.ask("JOIN lobby")
+    alice.send("SEND lobby before")
+    bob.expect("alice@lobby: before")
+    alice.socket.sendall(b"SEND lobby ha")
+    time.sleep(0.2)
+
+    launch("--takeover", path, port=port)
+    assert launch.processes[0].wait(5) == 0
+
+    alice.socket.sendall(b"lf\n")
+    assert "#2 alice@lobby: half" in bob.expect("half")
+    bob.send("SEND lobby after")
+    assert "#3 bob@lobby: after" in alice.expect("after")
+
+    carol = connect(port, "carol")
+    joined = carol.ask("JOIN lobby")
+    assert strings.MEMBERSHIP_GRANTED in joined
+    assert "before" in joined and "after" in joined
+    assert strings.CLIENT_EXISTS in connect(port).ask("USER alice")
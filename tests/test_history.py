@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import history
+
+def test_ids_start_at_one():
+    kept = history.History(4, 64)
+    assert kept.last_id() == 0
+    assert kept.since(0) == []
+    assert kept.add(b"a") == 1
+    assert kept.add(b"b") == 2
+    assert kept.since(0) == [(1, b"a"), (2, b"b")]
+    assert kept.since(1) == [(2, b"b")]
+
+def test_message_bound():
+    kept = history.History(3, 64)
+    for index in range(5):
+        kept.add(b"%d" % index)
+    assert kept.since(0) == [(3, b"2"), (4, b"3"), (5, b"4")]
+    assert kept.latest(2) == [(4, b"3"), (5, b"4")]
+    assert kept.latest(10) == kept.since(0)
+
+def test_byte_bound_wraps_around():
+    kept = history.History(10, 10)
+    for data in (b"aaaa", b"bbbb", b"cccc", b"dd"):
+        kept.add(data)
+    assert kept.since(0) == [(2, b"bbbb"), (3, b"cccc"), (4, b"dd")]
+    kept.add(b"eeeee")
+    assert kept.since(0) == [(4, b"dd"), (5, b"eeeee")]
+    assert kept.used <= kept.size
+
+def test_message_larger_than_buffer():
+    kept = history.History(4, 8)
+    kept.add(b"a")
+    assert kept.add(b"x" * 9) == 2
+    assert kept.since(0) == []
+    assert kept.add(b"b") == 3
+    assert kept.since(0) == [(3, b"b")]
+
+def test_restored_ids():
+    kept = history.History(4, 64)
+    kept.skip(9)
+    assert kept.add(b"a", 10) == 10
+    assert kept.add(b"a", 10) == 10
+    assert kept.add(b"b", 12) == 12
+    assert kept.since(0) == [(12, b"b")]
+    assert kept.add(b"c") == 13
+
+def test_resize_keeps_latest():
+    kept = history.History(5, 64)
+    for data in (b"aaa", b"bbb", b"ccc", b"ddd"):
+        kept.add(data)
+    kept.resize(2, 64)
+    assert kept.since(0) == [(3, b"ccc"), (4, b"ddd")]
+    kept.resize(5, 4)
+    assert kept.since(0) == [(4, b"ddd")]
+    assert kept.add(b"e") == 5
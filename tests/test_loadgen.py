@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, free_port
+
+@pytest.mark.parametrize("scenario", ["huge-room", "many-rooms", "churn", "slow-consumers"])
+def test_scenario_reports_deliveries(scenario, tmp_path):
+    output = str(tmp_path / "results.json")
+    subprocess.run([sys.executable, os.path.join(ROOT, "bench", "loadgen.py"), "--scenario", scenario,
+                    "--clients", "20", "--senders", "4", "--rate", "200", "--duration", "0.5", "--grace", "0.5",
+                    "--room-size", "5", "--port", str(free_port()), "--output", output],
+                   cwd=ROOT, stdin=subprocess.DEVNULL, capture_output=True, timeout=60, check=True)
+    with open(output) as results_file:
+        results = json.load(results_file)
+    assert results["scenario"] == scenario
+    assert results["connect_errors"] == 0
+    assert results["connected"] >= 20
+    assert results["sent"] > 0 and results["delivered"] > 0
+    assert results["latency_ms"]["p50"] <= results["latency_ms"]["p99"] <= results["latency_ms"]["p999"]
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+import settings
+import strings
+import archive
+import manager
+import timers
+import test_archive
+
+def room(chat, name, *members):
+    """
+    Creates a room and joins the given connections to it.
+    """
+    chat.run(members[0], "ROOM " + name)
+    for member in members:
+        chat.run(member, "JOIN " + name)
+    for member in members:
+        chat.output(member)
+
+def test_send_to_several_rooms_reaches_each_member_once(chat):
+    alice, bob, carol = chat.connect("alice"), chat.connect("bob"), chat.connect("carol")
+    room(chat, "red", alice, bob)
+    room(chat, "blue", alice, bob, carol)
+    answer = chat.run(alice, "SEND red,blue,green,red hello")
+    assert answer.startswith("You@red#1,blue#1: hello")
+    assert strings.ROOM_DOES_NOT_EXIST + " green" in answer
+    assert chat.output(bob) == "\n#1 alice@red: hello"
+    assert chat.output(carol) == "\n#1 alice@blue: hello"
+    assert chat.run(bob, "HIST blue 5") .count("alice@blue: hello") == 1
+
+def test_send_to_several_rooms_reports_rooms_not_joined(chat):
+    alice, bob = chat.connect("alice"), chat.connect("bob")
+    room(chat, "red", alice)
+    room(chat, "blue", bob)
+    answer = chat.run(alice, "SEND red,blue hi")
+    assert answer.startswith("You@red#1: hi")
+    assert strings.NOT_MEMBER + " blue" in answer
+    assert chat.output(bob) == ""
+    assert chat.run(alice, "SEND blue,nowhere hi").startswith(strings.MESSAGE_NOT_SENT)
+
+def test_long_search_continues_on_the_loop(chat, tmp_path, monkeypatch):
+    messages, start = test_archive.filled(str(tmp_path))
+    monkeypatch.setattr(archive, "archive", messages)
+    monkeypatch.setattr(settings, "SEARCH_SCAN", 4)
+    alice, bob = chat.connect("alice"), chat.connect("bob")
+    room(chat, "lobby", alice, bob)
+    query = "SRCH lobby %d %d hello" % (start // test_archive.SECOND, start // test_archive.SECOND + 86400)
+    try:
+        assert chat.run(alice, query) == ""
+        assert len(manager.searches) == 1
+        chat.run(bob, "SEND lobby meanwhile")
+        manager.continue_searches()
+        assert chat.output(alice) == "\n#1 bob@lobby: meanwhile"
+        manager.continue_searches()
+        assert not manager.searches
+        answer = chat.output(alice)
+        assert answer.startswith(strings.SEARCH_RESULTS)
+        assert answer.count("hello") == 10
+
+        # a short search answers at once, and a closed client's search is dropped
+        recent = "SRCH lobby %d %d" % (start // test_archive.SECOND + 8 * 3600, start // test_archive.SECOND + 86400)
+        assert chat.run(alice, recent).endswith("hello 8\n" + "#10 2023-11-15T07:13:20Z hello 9\n")
+        chat.run(bob, query)
+        bob.close()
+        manager.continue_searches(0)
+        assert not manager.searches
+    finally:
+        manager.searches.clear()
+        messages.close()
+
+def test_private_message_reaches_named_users_once(chat):
+    alice, bob, carol = chat.connect("alice"), chat.connect("bob"), chat.connect("carol")
+    answer = chat.run(alice, "PMSG bob,carol,bob,nobody psst")
+    assert answer == strings.PRIVATE_SENT + "bob,carol" + strings.NEW_LINE + strings.USERS_UNKNOWN + "nobody"
+    assert chat.output(bob) == "\nalice@private: psst"
+    assert chat.output(carol) == "\nalice@private: psst"
+    assert chat.output(alice) == ""
+
+def test_private_message_to_users_gone(chat, monkeypatch):
+    monkeypatch.setattr(manager, "total_clients", 2)
+    alice, bob = chat.connect("alice"), chat.connect("bob")
+    manager.disconnect({bob}, bob)
+    answer = chat.run(alice, "PMSG bob,nobody hi")
+    assert answer == strings.PRIVATE_NOT_SENT + strings.NEW_LINE + strings.USERS_OFFLINE + "bob" + \
+        strings.NEW_LINE + strings.USERS_UNKNOWN + "nobody"
+
+def test_private_message_needs_a_name(chat):
+    stranger, bob = chat.connect(), chat.connect("bob")
+    assert chat.run(stranger, "PMSG bob hi") == strings.CLIENT_INVALID
+    assert chat.output(bob) == ""
+
+def test_subscribers_receive_messages_of_matching_rooms_once(chat):
+    alice, bob, carol = chat.connect("alice"), chat.connect("bob"), chat.connect("carol")
+    room(chat, "ops.eu", alice, carol)
+    room(chat, "ops.us.east", alice)
+    room(chat, "dev", alice)
+    assert chat.run(bob, "SUBS ops.*") == strings.SUBSCRIBED + "ops.*"
+    assert chat.run(bob, "SUBS ops.*") == strings.ALREADY_SUBSCRIBED + "ops.*"
+    assert chat.run(carol, "SUBS ops.#") == strings.SUBSCRIBED + "ops.#"
+
+    # a message sent to several rooms reaches every receiver once, member or subscriber
+    chat.run(alice, "SEND ops.eu,ops.us.east,dev up")
+    assert chat.output(bob) == "\n#1 alice@ops.eu: up"
+    assert chat.output(carol) == "\n#1 alice@ops.eu: up"
+    chat.run(alice, "SEND ops.us.east down")
+    assert chat.output(bob) == ""
+    assert chat.output(carol) == "\n#2 alice@ops.us.east: down"
+
+    # subscribers hear neither joins nor leaves, and can not send to the rooms
+    chat.run(carol, "LEVE ops.eu")
+    assert chat.output(alice) == strings.MEMBER_LEFT
+    assert chat.output(bob) == ""
+    assert chat.run(bob, "SEND ops.eu hi") == strings.NOT_MEMBER
+
+def test_unsubscribed_clients_stop_receiving(chat):
+    alice, bob = chat.connect("alice"), chat.connect("bob")
+    room(chat, "ops.eu", alice)
+    chat.run(bob, "SUBS ops.*")
+    assert chat.run(bob, "USUB ops.*") == strings.UNSUBSCRIBED + "ops.*"
+    assert chat.run(bob, "USUB ops.*") == strings.NOT_SUBSCRIBED + "ops.*"
+    chat.run(alice, "SEND ops.eu hi")
+    assert chat.output(bob) == ""
+
+@pytest.fixture
+def window(chat, monkeypatch):
+    """
+    Coalesces presence over a second on a timer wheel of the test's own, returning a function
+    running the wheel past the window.
+    """
+    monkeypatch.setattr(settings, "PRESENCE_WINDOW", 1.0)
+    monkeypatch.setattr(timers, "wheel", timers.TimerWheel())
+    clock = [time.monotonic()]
+
+    def run():
+        clock[0] += 2
+        timers.wheel.advance(clock[0])
+
+    return run
+
+def test_presence_is_coalesced_over_the_window(chat, window):
+    alice, bob, carol = chat.connect("alice"), chat.connect("bob"), chat.connect("carol")
+    chat.run(alice, "ROOM big", "JOIN big")
+    window()
+    assert chat.output(alice) == ""
+
+    chat.run(bob, "JOIN big")
+    chat.run(carol, "JOIN big")
+    chat.run(bob, "LEVE big")
+    assert chat.output(alice) == ""
+    window()
+    assert chat.output(alice) == strings.PRESENCE_CHANGES + "big: 2" + strings.PRESENCE_JOINED + "1" + strings.PRESENCE_LEFT
+    # carol is told only of what happened after she joined
+    assert chat.output(carol) == strings.MEMBER_LEFT
+    assert chat.output(bob) == ""
+    window()
+    assert chat.output(alice) == ""
+
+def test_no_presence_in_rooms_over_the_limit(chat, window, monkeypatch):
+    alice, bob, carol = chat.connect("alice"), chat.connect("bob"), chat.connect("carol")
+    chat.run(alice, "ROOM big", "JOIN big")
+    chat.run(bob, "JOIN big")
+    window()
+    assert chat.output(alice) == strings.NEW_MEMBER_JOINED
+
+    monkeypatch.setattr(settings, "PRESENCE_LIMIT", 1)
+    chat.run(carol, "JOIN big")
+    chat.run(bob, "LEVE big")
+    window()
+    assert chat.output(alice) == ""
+
+def test_members_are_listed_a_page_at_a_time(chat, monkeypatch):
+    monkeypatch.setattr(settings, "MEMBERS_PAGE", 2)
+    alice, bob, carol = chat.connect("alice"), chat.connect("bob"), chat.connect("carol")
+    room(chat, "big", alice, bob, carol)
+    first = chat.run(alice, "LIME big")
+    assert first.startswith(strings.ROOM_MEMBERS)
+    assert first.endswith(strings.MORE_MEMBERS + "lime big 2")
+    second = chat.run(alice, "LIME big 2")
+    assert strings.MORE_MEMBERS not in second
+    names = first.split(strings.NEW_LINE)[1:-1] + second.split(strings.NEW_LINE)[1:-1]
+    assert sorted(names) == ["alice", "bob", "carol"]
+    assert chat.run(alice, "LIME big two") == strings.INVALID_MEMBERS_PAGE
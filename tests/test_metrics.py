@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+
+import metrics
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram((1, 5, 10))
+    for value in (0, 1, 3, 7, 20):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert (histogram.sum, histogram.count) == (31, 5)
+
+def test_export_renders_labelled_histograms():
+    metrics.observe_command("TEST", 0.00002)
+    metrics.observe_command("TEST", 1.0)
+    lines = metrics.export().splitlines()
+    assert 'chat_commands_total{command="TEST"} 2' in lines
+    assert 'chat_command_seconds_bucket{command="TEST",le="1e-05"} 0' in lines
+    assert 'chat_command_seconds_bucket{command="TEST",le="2.5e-05"} 1' in lines
+    assert 'chat_command_seconds_bucket{command="TEST",le="0.1"} 1' in lines
+    assert 'chat_command_seconds_bucket{command="TEST",le="+Inf"} 2' in lines
+    assert 'chat_command_seconds_count{command="TEST"} 2' in lines
+    assert "# TYPE chat_command_seconds histogram" in lines
+
+def test_commands_and_fan_out_are_counted(chat):
+    joins = metrics.commands.labels("JOIN").value
+    fanned_out = metrics.fan_out_sizes.count
+    alice, bob = chat.connect("alice"), chat.connect("bob")
+    chat.run(alice, "ROOM lobby", "JOIN lobby")
+    chat.run(bob, "join lobby")
+    chat.run(alice, "SEND lobby hi")
+    assert metrics.commands.labels("JOIN").value == joins + 2
+    assert metrics.fan_out_sizes.count > fanned_out
+
+def test_metrics_endpoint(launch, connect, tmp_path):
+    path = str(tmp_path / "stats.sock")
+    port = launch("--stats-socket", path)
+    connect(port, "alice").ask("ROOM lobby")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as reader:
+        reader.settimeout(5)
+        reader.connect(path)
+        data = b""
+        while True:
+            chunk = reader.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    lines = data.decode().splitlines()
+    assert "chat_connected_clients 1" in lines
+    assert "chat_rooms 1" in lines
+    assert 'chat_commands_total{command="ROOM"} 1' in lines
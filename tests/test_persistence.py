@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import errno
+import marshal
+import os
+import threading
+import time
+import zlib
+
+import pytest
+
+import settings
+import strings
+import registry
+import persistence
+
+@pytest.fixture(autouse=True)
+def fresh_memberships():
+    persistence.memberships.clear()
+    yield
+    persistence.stop()
+    persistence.memberships.clear()
+
+def fill(directory):
+    """
+    Logs a room with two messages and a member to a data directory, and closes the log.
+    """
+    state = registry.Registry()
+    persistence.start(directory, state)
+    state.add_room("lobby")
+    persistence.room_added(state, "lobby")
+    persistence.member_joined(state, "lobby", "alice")
+    persistence.message_added(state, "lobby", 1, b"first")
+    persistence.message_added(state, "lobby", 2, b"second")
+    persistence.stop()
+
+def recover(directory):
+    persistence.memberships.clear()
+    state = registry.Registry()
+    persistence.start(directory, state)
+    return state
+
+def segments(directory):
+    return [persistence.path(directory, number, suffix) for number, suffix in persistence.listing(directory)
+            if suffix == persistence.SEGMENT]
+
+def test_replay(tmp_path):
+    fill(str(tmp_path))
+    state = recover(str(tmp_path))
+    assert state.room("lobby").history.since(0) == [(1, b"first"), (2, b"second")]
+    assert persistence.saved_rooms("alice") == {"lobby"}
+
+@pytest.mark.parametrize("tail", [
+    persistence.RECORD.pack(100, 0) + b"partial",                                         # payload cut short
+    persistence.RECORD.pack(5, zlib.crc32(b"other")) + marshal.dumps((persistence.SEND,))[:5],    # checksum mismatch
+    b"\x00\x00",                                                                         # header cut short
+])
+def test_replay_after_torn_write(tmp_path, tail):
+    fill(str(tmp_path))
+    with open(segments(str(tmp_path))[0], "ab") as segment_file:
+        segment_file.write(tail)
+    state = recover(str(tmp_path))
+    assert state.room("lobby").history.since(0) == [(1, b"first"), (2, b"second")]
+    persistence.message_added(state, "lobby", 3, b"third")
+    persistence.stop()
+    state = recover(str(tmp_path))
+    assert state.room("lobby").history.since(0) == [(1, b"first"), (2, b"second"), (3, b"third")]
+
+def test_records_stop_at_corruption():
+    entries = []
+    for record in ((persistence.ROOM, "a"), (persistence.ROOM, "b")):
+        payload = marshal.dumps(record)
+        entries.append(persistence.RECORD.pack(len(payload), zlib.crc32(payload)) + payload)
+    data = bytearray(b"".join(entries))
+    data[-1] ^= 0xFF
+    assert list(persistence.records(bytes(data))) == [(persistence.ROOM, "a")]
+
+def test_recovered_log_is_snapshotted(tmp_path):
+    fill(str(tmp_path))
+    recover(str(tmp_path))
+    persistence.stop()
+    files = persistence.listing(str(tmp_path))
+    assert files[0][1] == persistence.SNAPSHOT
+    state = recover(str(tmp_path))
+    assert state.room("lobby").history.last_id() == 2
+
+def written(condition):
+    """
+    Waits for the writer thread to bring about a condition.
+    """
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert persistence.log.thread.is_alive() and time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_failed_writes_are_retried(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "WAL_RETRY_INTERVAL", 0.01)
+    state = recover(str(tmp_path))
+    state.add_room("lobby")
+    persistence.room_added(state, "lobby")
+    persistence.message_added(state, "lobby", 1, b"first")
+    written(lambda: not persistence.log.pending and persistence.log.changed)
+
+    failures = []
+    fsync, writer = os.fsync, persistence.log.thread
+
+    def full_disk(fd):
+        if threading.current_thread() is writer and len(failures) < 3:
+            failures.append(fd)
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", full_disk)
+    persistence.message_added(state, "lobby", 2, b"second")
+    persistence.message_added(state, "lobby", 3, b"third")
+    written(lambda: len(failures) == 3 and not persistence.log.unwritten and not persistence.log.pending)
+    persistence.message_added(state, "lobby", 4, b"fourth")
+    persistence.stop()
+    assert persistence.log is None
+    assert strings.WAL_WRITE_FAILED in caplog.text
+
+    state = recover(str(tmp_path))
+    assert state.room("lobby").history.since(0) == [(1, b"first"), (2, b"second"), (3, b"third"), (4, b"fourth")]
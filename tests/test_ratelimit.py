@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import ratelimit
+
+def test_refill_up_to_burst():
+    bucket = ratelimit.TokenBucket("test", 2.0, 4.0)
+    bucket.tokens = 0
+    assert bucket.refill(bucket.stamp + 1) == 2.0
+    assert bucket.refill(bucket.stamp + 10) == 4.0
+
+def test_affords():
+    bucket = ratelimit.TokenBucket("test", 1.0, 4.0)
+    assert bucket.affords(4, bucket.stamp)
+    bucket.tokens = 1
+    assert not bucket.affords(2, bucket.stamp)
+    assert bucket.affords(2, bucket.stamp + 1)
+
+def test_cost_above_burst_leaves_debt():
+    bucket = ratelimit.TokenBucket("test", 1000.0, 4.0)
+    assert ratelimit.allow(10, bucket)
+    assert bucket.tokens < 0
+    assert not ratelimit.allow(1, bucket)
+
+def test_allow_takes_from_all_or_none():
+    full = ratelimit.TokenBucket("full", 0.0, 10.0)
+    empty = ratelimit.TokenBucket("empty", 0.0, 10.0)
+    empty.tokens = 0
+    assert not ratelimit.allow(1, full, empty, None)
+    assert full.tokens == 10.0
+    assert ratelimit.allow(3, full, None)
+    assert full.tokens == 7.0
+
+def test_no_limit():
+    assert ratelimit.bucket("test", None, 10) is None
+    assert ratelimit.allow(1000, None)
+
+def test_retune_keeps_tokens():
+    bucket = ratelimit.TokenBucket("test", 1.0, 10.0)
+    bucket.tokens = 3
+    retuned = ratelimit.retune(bucket, ratelimit.TokenBucket("test", 5.0, 2.0))
+    assert retuned is bucket
+    assert (bucket.rate, bucket.burst, bucket.tokens) == (5.0, 2.0, 2.0)
+    assert ratelimit.retune(bucket, None) is None
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import settings
+import strings
+import session
+
+class Recorder(session.Session):
+    """
+    A session keeping what it is handed, and noting when it signs in again.
+    """
+
+    def __init__(self, name, port, **options):
+        super().__init__(name, port=port, **options)
+        self.frames = asyncio.Queue()
+        self.back   = asyncio.Event()
+
+    def received(self, data):
+        self.frames.put_nowait(data)
+
+    def reconnected(self):
+        self.back.set()
+
+    async def next(self, text):
+        """
+        Returns the first frame received that contains text.
+        """
+        wanted = text.encode(settings.SUPPORTED_TEXT_TYPE)
+        while True:
+            data = await asyncio.wait_for(self.frames.get(), settings.CLIENT_TIMEOUT)
+            if wanted in data:
+                return data
+
+def test_generic_errors_answer_the_waiting_command(launch):
+    port = launch()
+
+    async def scenario():
+        alice = Recorder("alice", port)
+        assert await alice.open()
+        try:
+            assert await alice.request("XYZZ lobby", strings.ROOM_ADDED) == strings.UNKNOWN_COMMAND.encode()
+            assert not await alice.join("no such room")
+            assert await alice.request(f"{strings.ROOM} lobby", strings.ROOM_ADDED) == strings.ROOM_ADDED.encode()
+            assert await alice.join("lobby")
+        finally:
+            alice.close()
+
+    asyncio.run(scenario())
+
+def test_write_while_disconnected_is_kept():
+    alice = session.Session("alice", port=1)
+    alice.write("HELP")
+    assert list(alice.backlog) == ["HELP"]
+
+def test_reconnect_rejoins_and_fetches_missed_messages(launch, monkeypatch):
+    monkeypatch.setattr(settings, "RECONNECT_DELAY", 0.1)
+    port = launch()
+
+    async def scenario():
+        alice, bob = Recorder("alice", port), Recorder("bob", port)
+        assert await alice.open() and await bob.open()
+        try:
+            await alice.request(f"{strings.ROOM} lobby", strings.ROOM_ADDED)
+            assert await alice.join("lobby") and await bob.join("lobby")
+            alice.send("lobby", "first")
+            await bob.next("alice@lobby: first")
+            assert bob.rooms == {"lobby": 1}
+
+            bob.writer.close()
+            bob.send("lobby", "while away")
+            alice.send("lobby", "missed")
+            await asyncio.wait_for(bob.back.wait(), settings.CLIENT_TIMEOUT)
+            assert "missed" in (await bob.next("missed")).decode()
+            await alice.next("bob@lobby: while away")
+            assert bob.rooms["lobby"] >= 2
+        finally:
+            alice.close()
+            bob.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import subprocess
+import sys
+
+import pytest
+
+import conftest
+import settings
+import strings
+import connection
+import terminal
+
+def test_batch_runs_commands_with_one_answer(chat):
+    alice = chat.connect("alice")
+    assert chat.run(alice, "BATCH", "ROOM lobby", "JOIN lobby") == ""
+    answer = chat.run(alice, "END")
+    assert answer.startswith(strings.BATCH_DONE + "2\n")
+    assert strings.ROOM_ADDED in answer
+    assert strings.MEMBERSHIP_GRANTED in answer
+    assert len(alice.outbound) == 0 and alice.batch is None and alice.held is None
+
+def test_batch_keyword_in_any_case(chat):
+    alice = chat.connect("alice")
+    assert chat.run(alice, "batch", "help", "end").startswith(strings.BATCH_DONE + "1\n")
+
+def test_nested_batch(chat):
+    alice = chat.connect("alice")
+    assert chat.run(alice, "BATCH", "BATCH") == strings.BATCH_NESTED
+    assert chat.run(alice, "END").startswith(strings.BATCH_DONE + "0")
+
+def test_batch_command_bound(chat, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_BATCH_COMMANDS", 2)
+    alice = chat.connect("alice")
+    assert chat.run(alice, "BATCH", "HELP", "HELP", "HELP") == strings.BATCH_TOO_LARGE
+    assert alice.batch is None
+    assert not chat.run(alice, "END").startswith(strings.BATCH_DONE)
+
+def test_batch_byte_bound(chat, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_BATCH_BYTES", 1000)
+    alice = chat.connect("alice")
+    assert chat.run(alice, "BATCH", "SEND lobby " + "x" * 600) == ""
+    assert alice.batched == len("SEND lobby ") + 600
+    assert chat.run(alice, "SEND lobby " + "y" * 600) == strings.BATCH_TOO_LARGE
+    assert alice.batch is None
+
+def test_batch_answers_over_the_outbound_limit(chat):
+    alice = chat.connect("alice", limit=4096)
+    answer = chat.run(alice, "BATCH", "HELP", "HELP", "HELP", "HELP", "END")
+    assert answer == strings.BATCH_UNANSWERED + "4"
+    assert chat.run(alice, "BATCH", "HELP", "END").startswith(strings.BATCH_DONE + "1\n")
+
+def test_batch_answer_refused_by_a_full_queue(chat):
+    alice = chat.connect("alice", limit=4096, policy=settings.overflow.DISCONNECT)
+    chat.run(alice, "BATCH", "HELP")
+    alice.queue(b"x" * 3000)
+    terminal.execute_frame(b"END", alice)
+    assert chat.output(alice) == "x" * 3000 + strings.BATCH_UNANSWERED + "1"
+    connection.overflowed.discard(alice)
+
+def test_table_is_built_at_import():
+    # terminal imports manager, which must not import terminal back for the table to be built here
+    table = subprocess.run([sys.executable, "-c", "import terminal; print(len(terminal.COMMANDS))"],
+                           cwd=conftest.ROOT, capture_output=True, text=True, check=True)
+    assert int(table.stdout) == sum(2 ** len(command.name) for command in set(terminal.COMMANDS.values()))
+    assert terminal.COMMANDS[b"jOiN"] is terminal.COMMANDS[b"JOIN"]
+    assert b"JOINS" not in terminal.COMMANDS
+
+@pytest.mark.parametrize("line, answer", [
+    ("XYZZ lobby", strings.UNKNOWN_COMMAND),
+    ("J", strings.INPUT_INVALID),
+    ("JOIN", strings.INVALID_ROOM_NAME),
+    ("JOIN two words", strings.INVALID_ROOM_NAME),
+    ("ROOM a,b", strings.INVALID_ROOM_NAME),
+    ("SEND lobby", strings.INVALID_MESSAGE_FORMAT),
+    ("SEND lobby ", strings.INVALID_MESSAGE_FORMAT),
+    ("PMSG  hi", strings.INVALID_MESSAGE_FORMAT),
+    ("SUBS ops.*x", strings.INVALID_PATTERN),
+    ("HIST", strings.INVALID_HISTORY_REQUEST),
+])
+def test_malformed_arguments_are_answered_by_the_parser(chat, line, answer):
+    alice = chat.connect("alice")
+    assert chat.run(alice, line) == answer
+
+def test_verbs_in_any_case(chat):
+    alice = chat.connect()
+    assert chat.run(alice, "uSeR alice").startswith(strings.WELCOME_CLIENT)
+    assert chat.run(alice, "room lobby") == strings.ROOM_ADDED
+    assert chat.run(alice, "Ping") == strings.PONG
+
+def test_commands_over_the_budget_are_rate_limited(chat, monkeypatch):
+    monkeypatch.setattr(settings, "CLIENT_COMMAND_RATE", 1)
+    monkeypatch.setattr(settings, "CLIENT_COMMAND_BURST", 2)
+    alice = chat.connect()
+    assert chat.run(alice, "USER alice").startswith(strings.WELCOME_CLIENT)
+    assert chat.run(alice, "PING") == strings.PONG
+    assert chat.run(alice, "PING") == strings.RATE_LIMITED
+    assert chat.run(alice, "XYZZ") == strings.UNKNOWN_COMMAND
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import timers
+
+def wheel(slots=4, levels=3):
+    """
+    Returns a wheel ticking once a second, small enough for timers to move between levels.
+    """
+    return timers.TimerWheel(1.0, slots, levels)
+
+def test_timers_fire_in_order():
+    timer_wheel = wheel()
+    fired = []
+    for delay in (5, 1, 30, 2):
+        timer_wheel.schedule(delay, lambda delay=delay: fired.append(delay))
+    assert timer_wheel.count == 4
+    timer_wheel.advance(timer_wheel.start + 0.5)
+    assert fired == []
+    timer_wheel.advance(timer_wheel.start + 3.5)
+    assert fired == [1, 2]
+    timer_wheel.advance(timer_wheel.start + 100)
+    assert fired == [1, 2, 5, 30]
+    assert timer_wheel.count == 0
+
+def test_timer_does_not_fire_early():
+    timer_wheel = wheel()
+    fired = []
+    timer_wheel.schedule(20, lambda: fired.append(True))
+    for second in range(19):
+        timer_wheel.advance(timer_wheel.start + second)
+    assert fired == []
+    timer_wheel.advance(timer_wheel.start + 22)
+    assert fired == [True]
+
+def test_timer_beyond_last_level():
+    timer_wheel = wheel(slots=2, levels=2)
+    fired = []
+    timer_wheel.schedule(50, lambda: fired.append(True))
+    timer_wheel.advance(timer_wheel.start + 40)
+    assert fired == []
+    timer_wheel.advance(timer_wheel.start + 52)
+    assert fired == [True]
+
+def test_cancel():
+    timer_wheel = wheel()
+    fired = []
+    timer = timer_wheel.schedule(2, lambda: fired.append(True))
+    timer.cancel()
+    timer.cancel()
+    assert timer_wheel.count == 0
+    timer_wheel.advance(timer_wheel.start + 10)
+    assert fired == []
+
+def test_timeout():
+    timer_wheel = wheel()
+    assert timer_wheel.timeout() is None
+    timer_wheel.schedule(3, lambda: None)
+    assert 0 <= timer_wheel.timeout() <= 1.0
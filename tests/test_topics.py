@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import topics
+
+def test_literal_and_wildcards():
+    subscriptions = topics.Subscriptions()
+    subscriptions.subscribe("news.sports", "literal")
+    subscriptions.subscribe("news.*", "one")
+    subscriptions.subscribe("news.#", "any")
+    subscriptions.subscribe("#", "all")
+    subscriptions.subscribe("*.sports.#", "middle")
+    assert subscriptions.match("news") == {"any", "all"}
+    assert subscriptions.match("news.sports") == {"literal", "one", "any", "all", "middle"}
+    assert subscriptions.match("news.sports.live") == {"any", "all", "middle"}
+    assert subscriptions.match("weather") == {"all"}
+    assert subscriptions.match("weather.sports") == {"all", "middle"}
+
+def test_any_inside_pattern():
+    subscriptions = topics.Subscriptions()
+    subscriptions.subscribe("a.#.z", "client")
+    assert subscriptions.match("a.z") == {"client"}
+    assert subscriptions.match("a.b.c.z") == {"client"}
+    assert subscriptions.match("a.b.c") == frozenset()
+
+def test_unsubscribe_empties_cache():
+    subscriptions = topics.Subscriptions()
+    assert subscriptions.subscribe("a.*", "client")
+    assert not subscriptions.subscribe("a.*", "client")
+    assert subscriptions.match("a.b") == {"client"}
+    assert subscriptions.unsubscribe("a.*", "client")
+    assert not subscriptions.unsubscribe("a.*", "client")
+    assert subscriptions.match("a.b") == frozenset()
+    assert subscriptions.count == 0
+    assert not subscriptions.root.children
+
+def test_valid():
+    assert topics.valid("news.*.#")
+    assert topics.valid("news")
+    assert not topics.valid("news.")
+    assert not topics.valid("news..sports")
+    assert not topics.valid("news.sp*")
+    assert not topics.valid("#news")
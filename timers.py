@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+import settings
+import metrics
+
+wheel = None # TimerWheel of this server, created by start()
+
+class Timer:
+    """
+    A callback due at a tick of a timer wheel.
+    """
+    __slots__ = ("wheel", "expires", "callback", "slot")
+
+    def __init__(self, wheel, expires, callback):
+        """
+        Args:
+            wheel (TimerWheel): The wheel the timer waits on.
+            expires (int): The tick the timer is due at.
+            callback (callable): Called without arguments when the timer is due.
+        """
+        self.wheel    = wheel
+        self.expires  = expires
+        self.callback = callback
+        self.slot     = None # the set of the wheel the timer is waiting in
+
+    def cancel(self):
+        """
+        Removes the timer from its wheel, so it never fires.
+
+        Args: None
+
+        Returns: None
+        """
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+            self.wheel.count -= 1
+
+class TimerWheel:
+    """
+    A hierarchical timer wheel. Time advances in ticks of settings.TIMER_TICK seconds. The first
+    level has a slot for each of the next settings.TIMER_SLOTS ticks, and every further level a
+    slot for each run of settings.TIMER_SLOTS slots of the level below, so a few levels cover
+    days. A timer waits in the slot of the lowest level its tick falls in; when a level wraps
+    around, the next slot of the level above is emptied into the levels below. Scheduling and
+    cancelling cost O(1), and a tick costs O(1) plus the timers that fire or move down a level,
+    whatever the number of timers waiting.
+    """
+
+    def __init__(self, tick=None, slots=None, levels=None):
+        """
+        Args:
+            tick (float): The length of a tick in seconds, settings.TIMER_TICK when None.
+            slots (int): The slots per level, a power of two, settings.TIMER_SLOTS when None.
+            levels (int): The number of levels, settings.TIMER_LEVELS when None.
+        """
+        self.tick    = settings.TIMER_TICK if tick is None else tick
+        slots        = settings.TIMER_SLOTS if slots is None else slots
+        self.bits    = slots.bit_length() - 1
+        self.mask    = slots - 1
+        self.levels  = [[set() for _ in range(slots)] for _ in range(settings.TIMER_LEVELS if levels is None else levels)]
+        self.start   = time.monotonic()
+        self.current = 0 # the next tick to run
+        self.count   = 0 # timers waiting
+
+    def schedule(self, delay, callback):
+        """
+        Schedules a callback.
+
+        Args:
+            delay (float): The seconds from now the callback is due in, rounded up to whole ticks.
+            callback (callable): Called without arguments when the timer is due.
+
+        Returns:
+            Timer: The timer, to cancel it.
+        """
+        due = self.start + self.current * self.tick
+        timer = Timer(self, self.current + max(0, math.ceil((time.monotonic() + delay - due) / self.tick)), callback)
+        self.insert(timer)
+        self.count += 1
+        return timer
+
+    def insert(self, timer):
+        """
+        Puts a timer in the slot of the lowest level its tick falls in. Timers due beyond the last
+        level wait in its farthest slot and move down again when it is emptied.
+
+        Args:
+            timer (Timer): The timer.
+
+        Returns: None
+        """
+        delta = max(timer.expires - self.current, 0)
+        for level, slots in enumerate(self.levels):
+            if delta >> (self.bits * (level + 1)) == 0 or level == len(self.levels) - 1:
+                break
+        if delta >> (self.bits * (level + 1)):
+            slot = slots[((self.current >> (self.bits * level)) - 1) & self.mask]
+        else:
+            slot = slots[(timer.expires >> (self.bits * level)) & self.mask]
+        slot.add(timer)
+        timer.slot = slot
+
+    def cascade(self, level):
+        """
+        Empties the slot of a level that the current tick has reached into the levels below.
+
+        Args:
+            level (int): The level.
+
+        Returns: None
+        """
+        slots = self.levels[level]
+        index = (self.current >> (self.bits * level)) & self.mask
+        moving, slots[index] = slots[index], set()
+        for timer in moving:
+            self.insert(timer)
+
+    def advance(self, now=None):
+        """
+        Runs the ticks that have passed, calling the callbacks of the timers that are due.
+
+        Args:
+            now (float): The current time.monotonic(), read when None.
+
+        Returns: None
+        """
+        now = time.monotonic() if now is None else now
+        if not self.count:
+            self.current = max(self.current, int((now - self.start) // self.tick) + 1)
+            return
+        while self.start + self.current * self.tick <= now:
+            level = 1
+            while level < len(self.levels) and (self.current >> (self.bits * (level - 1))) & self.mask == 0:
+                self.cascade(level)
+                level += 1
+            slots = self.levels[0]
+            index = self.current & self.mask
+            due, slots[index] = slots[index], set()
+            self.current += 1
+            for timer in due:
+                if timer.expires >= self.current:
+                    self.insert(timer)
+                    continue
+                timer.slot = None
+                self.count -= 1
+                timer.callback()
+
+    def timeout(self):
+        """
+        Returns how long the server loop may wait before the next tick has to run.
+
+        Args: None
+
+        Returns:
+            float: Seconds to wait, or None if no timer is waiting.
+        """
+        if not self.count:
+            return None
+        return max(0, self.start + self.current * self.tick - time.monotonic())
+
+def waiting():
+    """
+    Returns the number of timers waiting on the timer wheel of this server.
+
+    Args: None
+
+    Returns:
+        int: The number of timers.
+    """
+    return wheel.count if wheel is not None else 0
+
+metrics.gauge("chat_timers", "Timers waiting on the timer wheel.", waiting)
+
+def start():
+    """
+    Creates the timer wheel of this server.
+
+    Args: None
+
+    Returns:
+        TimerWheel: The wheel.
+    """
+    global wheel
+    wheel = TimerWheel()
+    return wheel
+
+def schedule(delay, callback):
+    """
+    Schedules a callback on the timer wheel of this server.
+
+    Args:
+        delay (float): The seconds from now the callback is due in.
+        callback (callable): Called without arguments when the timer is due.
+
+    Returns:
+        Timer: The timer, to cancel it.
+    """
+    return (wheel or start()).schedule(delay, callback)
+
+def timeout():
+    """
+    Returns how long the server loop may wait before the next tick.
+
+    Args: None
+
+    Returns:
+        float: Seconds to wait, or None if no timer is waiting.
+    """
+    return wheel.timeout() if wheel is not None else None
+
+def advance():
+    """
+    Runs the ticks of the timer wheel of this server that have passed.
+
+    Args: None
+
+    Returns: None
+    """
+    if wheel is not None:
+        wheel.advance()
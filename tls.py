@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import ssl
+
+import settings
+import metrics
+
+WOULD_BLOCK = (ssl.SSLWantReadError, ssl.SSLWantWriteError)
+
+context  = None # server SSLContext, None when the server does not serve TLS
+clients  = {}   # trusted certificates file -> client SSLContext, sessions only resume in their own context
+sessions = {}   # (host, port) -> ssl.SSLSession of the last connection, reused when reconnecting
+
+def server_context(certfile, keyfile=None):
+    """
+    Creates the TLS context of the server. TLS 1.3 clients are handed
+    settings.TLS_SESSION_TICKETS session tickets after their handshake, and TLS 1.2 clients are
+    kept in OpenSSL's session cache, so a reconnecting client resumes its session without a full
+    handshake.
+
+    Args:
+        certfile (str): The PEM file holding the server's certificate chain.
+        keyfile (str): The PEM file holding the private key, certfile when None.
+
+    Returns:
+        ssl.SSLContext: The context.
+    """
+    server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server.minimum_version = ssl.TLSVersion.TLSv1_2
+    server.load_cert_chain(certfile, keyfile)
+    server.num_tickets = settings.TLS_SESSION_TICKETS
+    return server
+
+def client_context(cafile=None):
+    """
+    Creates the TLS context of a client.
+
+    Args:
+        cafile (str): The PEM file of the certificates to trust, the system's when None.
+
+    Returns:
+        ssl.SSLContext: The context.
+    """
+    client = ssl.create_default_context(cafile=cafile)
+    client.minimum_version = ssl.TLSVersion.TLSv1_2
+    return client
+
+def start(certfile, keyfile=None):
+    """
+    Makes the server serve TLS.
+
+    Args:
+        certfile (str): The PEM file holding the server's certificate chain.
+        keyfile (str): The PEM file holding the private key, certfile when None.
+
+    Returns:
+        ssl.SSLContext: The server context.
+    """
+    global context
+    context = server_context(certfile, keyfile)
+    return context
+
+def wrap_server(client):
+    """
+    Wraps an accepted socket for TLS without running the handshake, which the server loop then
+    advances whenever the socket is ready.
+
+    Args:
+        client (socket.socket): The accepted socket.
+
+    Returns:
+        ssl.SSLSocket: The wrapped socket.
+    """
+    client.setblocking(False)
+    return context.wrap_socket(client, server_side=True, do_handshake_on_connect=False)
+
+def connect(client, host, port, cafile=None):
+    """
+    Runs the TLS handshake of a client socket, resuming the session of the client's last
+    connection to the same server when there is one.
+
+    Args:
+        client (socket.socket): The connected socket.
+        host (str): The server's host name, checked against its certificate.
+        port (int): The server's port.
+        cafile (str): The PEM file of the certificates to trust, the system's when None.
+
+    Returns:
+        ssl.SSLSocket: The wrapped socket.
+    """
+    if cafile not in clients:
+        clients[cafile] = client_context(cafile)
+    return clients[cafile].wrap_socket(client, server_hostname=host, session=sessions.get((host, port)))
+
+def remember(client, host, port):
+    """
+    Keeps the session of a client connection to resume it on the next connection. TLS 1.3
+    servers send their session tickets after the handshake, so this is called once the first
+    answer has been read.
+
+    Args:
+        client (ssl.SSLSocket): The client socket.
+        host (str): The server's host name.
+        port (int): The server's port.
+
+    Returns: None
+    """
+    if isinstance(client, ssl.SSLSocket) and client.session is not None:
+        sessions[(host, port)] = client.session
+
+def pending(client):
+    """
+    Returns the number of bytes a client socket has decrypted but not handed out yet, which
+    select does not report as readable.
+
+    Args:
+        client (socket.socket): The client socket.
+
+    Returns:
+        int: The number of bytes, 0 for a plain socket.
+    """
+    return client.pending() if isinstance(client, ssl.SSLSocket) else 0
+
+def handshake_done(client):
+    """
+    Counts a finished server handshake in metrics, as resumed or full.
+
+    Args:
+        client (ssl.SSLSocket): The server socket.
+
+    Returns: None
+    """
+    metrics.tls_handshakes.labels("resumed" if client.session_reused else "full").inc()
+
+def handshake_failed():
+    """
+    Counts a failed server handshake in metrics.
+
+    Args: None
+
+    Returns: None
+    """
+    metrics.tls_handshakes.labels("failed").inc()
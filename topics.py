@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import settings
+
+SEPARATOR = "." # splits room names into the segments patterns are matched against
+ONE       = "*" # pattern segment matching exactly one segment
+ANY       = "#" # pattern segment matching zero or more segments
+
+class Node:
+    """
+    A pattern segment in the subscription trie, with the subscribers of the pattern ending there.
+    """
+    __slots__ = ("children", "subscribers", "swallows")
+
+    def __init__(self, segment=None):
+        """
+        Args:
+            segment (str): The pattern segment, None for the root.
+        """
+        self.children    = {} # segment -> Node
+        self.subscribers = set()
+        self.swallows    = segment == ANY # matches the next segment of the name and stays reached
+
+class Subscriptions:
+    """
+    Room name patterns clients subscribe to, kept in a trie of their segments. A room name is
+    matched by walking its segments down the trie, following the literal segment, ONE and ANY at
+    every step, so the cost grows with the length of the name and the wildcards on its path,
+    not with the number of subscriptions. Results are cached per room name, and the cache is
+    emptied whenever a subscription is added or removed.
+    """
+
+    def __init__(self):
+        self.root  = Node()
+        self.cache = {} # room name -> frozenset of the subscribers matching it
+        self.count = 0  # subscriptions
+
+    def subscribe(self, pattern, client):
+        """
+        Subscribes a client to a pattern.
+
+        Args:
+            pattern (str): The pattern, segments separated by SEPARATOR.
+            client: The subscriber.
+
+        Returns:
+            bool: False if the client already was subscribed to the pattern, True otherwise.
+        """
+        node = self.root
+        for segment in pattern.split(SEPARATOR):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = Node(segment)
+            node = child
+        if client in node.subscribers:
+            return False
+        node.subscribers.add(client)
+        self.count += 1
+        self.cache.clear()
+        return True
+
+    def unsubscribe(self, pattern, client):
+        """
+        Unsubscribes a client from a pattern, pruning the segments no other pattern uses.
+
+        Args:
+            pattern (str): The pattern.
+            client: The subscriber.
+
+        Returns:
+            bool: False if the client was not subscribed to the pattern, True otherwise.
+        """
+        path = [self.root]
+        for segment in pattern.split(SEPARATOR):
+            node = path[-1].children.get(segment)
+            if node is None:
+                return False
+            path.append(node)
+        if client not in path[-1].subscribers:
+            return False
+        path[-1].subscribers.discard(client)
+        for parent, segment, node in zip(reversed(path[:-1]), reversed(pattern.split(SEPARATOR)), reversed(path[1:])):
+            if node.subscribers or node.children:
+                break
+            del parent.children[segment]
+        self.count -= 1
+        self.cache.clear()
+        return True
+
+    def match(self, name):
+        """
+        Returns the subscribers of the patterns matching a room name.
+
+        Args:
+            name (str): The room name.
+
+        Returns:
+            frozenset: The subscribers.
+        """
+        subscribers = self.cache.get(name)
+        if subscribers is not None:
+            return subscribers
+        nodes = self.expand((self.root,))
+        for segment in name.split(SEPARATOR):
+            following = []
+            for node in nodes:
+                if node.swallows:
+                    following.append(node)
+                for key in (segment, ONE):
+                    child = node.children.get(key)
+                    if child is not None:
+                        following.append(child)
+            nodes = self.expand(following)
+            if not nodes:
+                break
+        subscribers = frozenset(subscriber for node in nodes for subscriber in node.subscribers)
+        if len(self.cache) >= settings.SUBSCRIPTION_CACHE:
+            self.cache.clear()
+        self.cache[name] = subscribers
+        return subscribers
+
+    def expand(self, nodes):
+        """
+        Adds the ANY segments under the given nodes, which match zero segments, to them.
+
+        Args:
+            nodes (iterable): The trie nodes reached.
+
+        Returns:
+            set: The nodes reached.
+        """
+        reached = set()
+        pending = list(nodes)
+        while pending:
+            node = pending.pop()
+            if node not in reached:
+                reached.add(node)
+                child = node.children.get(ANY)
+                if child is not None:
+                    pending.append(child)
+        return reached
+
+def valid(pattern):
+    """
+    Tells whether a pattern is well formed: segments not empty, and wildcards only as whole segments.
+
+    Args:
+        pattern (str): The pattern.
+
+    Returns:
+        bool: True if the pattern can be subscribed to.
+    """
+    return all(segment and (segment in (ONE, ANY) or not (ONE in segment or ANY in segment))
+               for segment in pattern.split(SEPARATOR))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import statistics
+import time
+
+import settings
+import strings
+import metrics
+import timers
+
+TRACED  = (strings.SEND,) # commands whose messages are sampled
+BUCKETS = (0.00001, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+sample    = 0    # one in sample messages is traced, 0 when tracing is off
+countdown = 0    # messages to let pass before the next traced one
+current   = None # Trace of the message being handled, None when it is not traced
+waiting   = {}   # room name -> {message id -> Trace waiting for its receivers}
+log       = logging.getLogger(__name__)
+output    = None # file the finished traces are written to as JSON lines, the log when None
+
+stages = metrics.Family("chat_trace_stage_seconds", "histogram",
+                        "Time traced messages spent in each stage: ingress to dispatch, dispatch to fan-out "
+                        "enqueued, enqueued to flushed and flushed to acknowledged, per receiver for the last two.",
+                        "stage", lambda: metrics.Histogram(BUCKETS))
+
+class Trace:
+    """
+    The timeline of one sampled message: when its command was read, dispatched and fanned out,
+    and when it was flushed to and acknowledged by each receiver. A trace is finished, written
+    out and counted in the stage histograms once every receiver has flushed and acknowledged the
+    message, or settings.TRACE_TIMEOUT seconds after it was sent, whichever comes first.
+    """
+    __slots__ = ("ingress", "dispatch", "enqueued", "sender", "room", "message_id", "receivers", "remote", "flushed", "acked", "timer")
+
+    def __init__(self, ingress):
+        """
+        Args:
+            ingress (float): The time.monotonic() the command was read at.
+        """
+        self.ingress    = ingress
+        self.dispatch   = time.monotonic()
+        self.enqueued   = None
+        self.sender     = None
+        self.room       = None
+        self.message_id = None
+        self.receivers  = set() # names of the receivers the message was queued to
+        self.remote     = 0     # receivers reached through another worker
+        self.flushed    = {}    # receiver name -> time the message was written to it
+        self.acked      = {}    # receiver name -> time it acknowledged the message
+        self.timer      = None
+
+    def fanned_out(self, room, message_id, sender, receivers):
+        """
+        Notes that the message was queued to its receivers, and follows it on their connections.
+        A message sent to several rooms is traced in the first of them. Receivers signed in on
+        other workers are counted, but their flushes and acknowledgements are not waited for.
+
+        Args:
+            room (str): The room name.
+            message_id (int): The message's id in the room.
+            sender (str): The sender's name.
+            receivers (list): The clients it was queued to.
+
+        Returns: None
+        """
+        if self.enqueued is not None:
+            return
+        self.enqueued   = time.monotonic()
+        self.sender     = sender
+        self.room       = room
+        self.message_id = message_id
+        for receiver in receivers:
+            follow = getattr(receiver.connection, "follow", None)
+            if follow is None:
+                self.remote += 1
+            else:
+                self.receivers.add(receiver.name)
+                follow(self, receiver.name)
+        waiting.setdefault(room, {})[message_id] = self
+        self.timer = timers.schedule(settings.TRACE_TIMEOUT, self.finish)
+        if not self.receivers:
+            self.finish()
+
+    def written(self, name):
+        """
+        Notes that the message was written to a receiver's socket.
+
+        Args:
+            name (str): The receiver's name.
+
+        Returns: None
+        """
+        self.flushed[name] = time.monotonic()
+
+    def acknowledged(self, name):
+        """
+        Notes that a receiver acknowledged the message, finishing the trace once all did.
+
+        Args:
+            name (str): The receiver's name.
+
+        Returns: None
+        """
+        if name in self.receivers and name not in self.acked:
+            self.acked[name] = time.monotonic()
+            if len(self.acked) == len(self.receivers) == len(self.flushed):
+                self.finish()
+
+    def finish(self):
+        """
+        Writes the trace out and counts its stages in the histograms.
+
+        Args: None
+
+        Returns: None
+        """
+        traces = waiting.get(self.room, {})
+        if traces.pop(self.message_id, None) is not self:
+            return
+        if not traces:
+            del waiting[self.room]
+        self.timer.cancel()
+        flushes = sorted(at - self.enqueued for at in self.flushed.values())
+        acks = sorted(at - self.flushed.get(name, at) for name, at in self.acked.items())
+        stages.labels("dispatch").observe(self.dispatch - self.ingress)
+        stages.labels("fan_out").observe(self.enqueued - self.dispatch)
+        for seconds in flushes:
+            stages.labels("flush").observe(seconds)
+        for seconds in acks:
+            stages.labels("ack").observe(seconds)
+        record = json.dumps({
+            "room": self.room,
+            "id": self.message_id,
+            "sender": self.sender,
+            "receivers": len(self.receivers),
+            "remote": self.remote,
+            "dispatch_ms": (self.dispatch - self.ingress) * 1e3,
+            "fan_out_ms": (self.enqueued - self.dispatch) * 1e3,
+            "flush_ms": summary(flushes),
+            "ack_ms": summary(acks),
+            "unflushed": len(self.receivers) - len(flushes),
+            "unacked": len(self.receivers) - len(acks),
+        })
+        if output is None:
+            log.info(record)
+        else:
+            output.write(record + strings.NEW_LINE)
+            output.flush()
+
+def summary(samples):
+    """
+    Summarizes the per-receiver times of a stage.
+
+    Args:
+        samples (list): The sorted times in seconds.
+
+    Returns:
+        dict: The median, 99th percentile and maximum in milliseconds, None without samples.
+    """
+    if not samples:
+        return None
+    return {
+        "p50": statistics.median(samples) * 1e3,
+        "p99": samples[min(len(samples) - 1, int(0.99 * len(samples)))] * 1e3,
+        "max": samples[-1] * 1e3,
+    }
+
+def start(every, path=None):
+    """
+    Turns tracing on, or changes how often it samples.
+
+    Args:
+        every (int): Trace one in every messages, 0 to leave tracing off.
+        path (str): The file to append the finished traces to, the log when None.
+
+    Returns: None
+    """
+    global sample, countdown, output
+    sample = countdown = every
+    if every and path is not None and output is None:
+        output = open(path, "a")
+
+def run(command, value, client):
+    """
+    Runs a command's handler, tracing it when it is a sampled message. Only called while tracing
+    is on, so that a server without tracing pays a single test per command.
+
+    Args:
+        command: The terminal.Command.
+        value: The parsed arguments.
+        client: The client connection.
+
+    Returns: None
+    """
+    global countdown, current
+    if command.name not in TRACED:
+        command.handler(value, client)
+        return
+    countdown -= 1
+    if countdown:
+        command.handler(value, client)
+        return
+    countdown = sample
+    current = Trace(client.last_seen)
+    try:
+        command.handler(value, client)
+    finally:
+        current = None
+
+def acknowledged(room, message_id, name):
+    """
+    Notes a receiver's acknowledgement of the messages of a room up to an id on the traces
+    waiting for it.
+
+    Args:
+        room (str): The room name.
+        message_id (int): The id of the last message acknowledged.
+        name (str): The receiver's name.
+
+    Returns: None
+    """
+    for traced_id, trace in list(waiting.get(room, {}).items()):
+        if traced_id <= message_id:
+            trace.acknowledged(name)